@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import sys
-import os
 
 import run
 
@@ -15,25 +14,5 @@ if __name__ == "__main__":
         run.repl()
     else:
         # No filename specified, but input is piped in from a file or
-        # another process
-        code = sys.stdin.read()
-        # Reset stdin so the program can take user input
-        if os.name == "posix":
-            try:
-                terminal_stdin = open("/dev/tty", "r")
-            except OSError:
-                # This system doesn't have a terminal; we just leave
-                # stdin alone and let any user input actions in the
-                # program fail
-                # TODO: more graceful ways to handle this?
-                pass
-            else:
-                sys.stdin = terminal_stdin
-        elif os.name == "nt":
-            try:
-                terminal_stdin = open("CONIN$", "r")
-            except OSError:
-                pass
-            else:
-                sys.stdin = terminal_stdin
-        run.run_program(code)
+        # another process; run the code as it comes in
+        run.run_stream(sys.stdin)
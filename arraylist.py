@@ -0,0 +1,211 @@
+
+from itertools import islice
+
+import cfg
+
+
+class ArrayList(tuple):
+    """An immutable list stored as a Python tuple of its items.
+
+To the rest of the interpreter, an ArrayList looks like the chain of
+(head, tail) cells it stands for: lyst[0] is the head, lyst[1] the
+tail, and it unpacks into head and tail. The tail is a view of the same
+items starting one further along, so taking it copies nothing; the
+view is made when it is first asked for and then kept, so that the
+tail of a given list is always the same object. The last item's tail
+is nil.
+
+The point is that the length of an ArrayList, or its nth item, can be
+found without walking it.
+"""
+    def __new__(cls, items, offset=0):
+        # The tuple itself is empty; the items are kept in an attribute
+        self = super().__new__(cls)
+        self.items = items
+        self.offset = offset
+        self.tail_view = None
+        return self
+
+    def __len__(self):
+        # A cons cell has two elements, head and tail
+        return 2
+
+    def __bool__(self):
+        return True
+
+    def __getitem__(self, index):
+        if index == 0 or index == -2:
+            return self.items[self.offset]
+        elif index == 1 or index == -1:
+            return self.tail()
+        else:
+            raise IndexError("cons cell index out of range")
+
+    def __iter__(self):
+        yield self.items[self.offset]
+        yield self.tail()
+
+    def tail(self):
+        tail_view = self.tail_view
+        if tail_view is None:
+            if self.offset + 1 < len(self.items):
+                tail_view = type(self)(self.items, self.offset + 1)
+            else:
+                tail_view = ()
+            self.tail_view = tail_view
+        return tail_view
+
+    def __eq__(self, other):
+        # Equal to any list with equal items, however it is stored
+        value1 = self
+        value2 = other
+        while True:
+            if value1 is value2:
+                return True
+            elif (isinstance(value1, ArrayList)
+                    and isinstance(value2, ArrayList)):
+                return (value1.length() == value2.length()
+                        and all(item1 == item2 for item1, item2
+                                in zip(value1.values(), value2.values())))
+            elif not (isinstance(value1, tuple)
+                      and isinstance(value2, tuple)):
+                # At most one of them is a list
+                if (isinstance(value1, ArrayList)
+                        or isinstance(value2, ArrayList)):
+                    return False
+                return value1 == value2
+            elif not value1 or not value2:
+                return not value1 and not value2
+            elif value1[0] != value2[0]:
+                return False
+            value1 = value1[1]
+            value2 = value2[1]
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.to_cells())
+
+    def __repr__(self):
+        return "ArrayList(%r)" % (self.items[self.offset:],)
+
+    def __reduce__(self):
+        return (ArrayList, (self.items[self.offset:],))
+
+    def length(self):
+        return len(self.items) - self.offset
+
+    def nth(self, index):
+        """Return the item at index, or None if there isn't one."""
+        if 0 <= index < len(self.items) - self.offset:
+            return self.items[self.offset + index]
+        return None
+
+    def values(self):
+        """Iterate over the items of the list."""
+        return islice(self.items, self.offset, None)
+
+    def take(self, count):
+        """Return a list of the first count items."""
+        if count >= self.length():
+            return self
+        return build_list(self.items[self.offset:self.offset + count])
+
+    def drop(self, count):
+        """Return what is left of the list after the first count items."""
+        if count >= self.length():
+            return ()
+        elif count == 1:
+            return self.tail()
+        return type(self)(self.items, self.offset + count)
+
+    def to_cells(self):
+        """Return the list as a chain of ordinary (head, tail) tuples."""
+        result = ()
+        for item in reversed(self.items[self.offset:]):
+            result = (item, result)
+        return result
+
+
+class CharList(ArrayList):
+    """The list of character codes of a string, as chars returns it.
+
+The items are the string itself, and each code is only worked out when
+it is asked for; so making the list costs nothing however long the
+string is, and code that looks at just the start of it (parse-int, say)
+never touches the rest. Tails are views of the same string, as with
+any ArrayList. Since the codes are all valid, str can turn the list
+straight back into the part of the string that it covers.
+"""
+    def __getitem__(self, index):
+        if index == 0 or index == -2:
+            return ord(self.items[self.offset])
+        elif index == 1 or index == -1:
+            return self.tail()
+        else:
+            raise IndexError("cons cell index out of range")
+
+    def __iter__(self):
+        yield ord(self.items[self.offset])
+        yield self.tail()
+
+    def __repr__(self):
+        return "CharList(%r)" % (self.string(),)
+
+    def __reduce__(self):
+        return (CharList, (self.string(),))
+
+    def nth(self, index):
+        """Return the item at index, or None if there isn't one."""
+        if 0 <= index < len(self.items) - self.offset:
+            return ord(self.items[self.offset + index])
+        return None
+
+    def values(self):
+        """Iterate over the items of the list."""
+        return map(ord, islice(self.items, self.offset, None))
+
+    def take(self, count):
+        """Return a list of the first count items."""
+        if count >= self.length():
+            return self
+        elif count <= 0:
+            return ()
+        return CharList(self.items[self.offset:self.offset + count])
+
+    def to_cells(self):
+        """Return the list as a chain of ordinary (head, tail) tuples."""
+        result = ()
+        for char in reversed(self.string()):
+            result = (ord(char), result)
+        return result
+
+    def string(self):
+        """Return the part of the string that the list is made from."""
+        if self.offset == 0:
+            return self.items
+        return self.items[self.offset:]
+
+
+def make_list(items):
+    """Return a list of items (a tuple or list), backed by an array."""
+    if items:
+        return ArrayList(tuple(items))
+    else:
+        return ()
+
+
+def build_list(items):
+    """Turn a Python list of items into an Appleseed list.
+
+Lists of at least cfg.ARRAY_LIST_MIN_LENGTH items are backed by an
+array. Shorter ones (which is most code) are made of cons cells, since
+the interpreter gets at the head and tail of those fastest.
+"""
+    if len(items) >= cfg.ARRAY_LIST_MIN_LENGTH:
+        return ArrayList(tuple(items))
+    result = cfg.nil
+    for item in reversed(items):
+        result = (item, result)
+    return result
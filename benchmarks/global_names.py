@@ -0,0 +1,90 @@
+"""Count the global-name lookups a function call makes, with and without
+binding defined global names into compiled code.
+
+Usage: python benchmarks/global_names.py [n]
+
+Runs a tail-recursive loop of n iterations (2000 by default), each of
+which calls filter with odd?, on each engine; first with
+cfg.BIND_GLOBAL_NAMES off, which is how names were looked up before,
+then with it on. The Program's global_names dict is replaced by one that
+counts lookups, and the lookups per iteration and the run time are
+printed.
+
+Only the compiled and vm engines bind global names; the interpreted
+engine looks a name up every time it evaluates it, so its counts are
+the same either way. Lookups of parameters in a call's local scope
+aren't counted: binding doesn't change them, and the scopes are plain
+dicts that can't be swapped for counting ones.
+"""
+
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import cfg
+from execution import Program
+
+ENGINES = ["interpreted", "compiled", "vm"]
+
+LOOP = ("(def count-odds (lambda (n total) (if n"
+        " (count-odds (sub n 1) (add total (length (filter odd? (list n)))))"
+        " total)))")
+
+
+class CountingDict(dict):
+    """A dict that counts how many times it is looked up in."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.lookups = 0
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.lookups += 1
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        return super().get(key, default)
+
+
+def count_lookups(engine, bind, n):
+    """Run the loop; return the lookups per iteration and the time."""
+    cfg.BIND_GLOBAL_NAMES = bind
+    try:
+        program = Program(engine=engine)
+        global_names = CountingDict(program.global_names)
+        program.names[0] = global_names
+        program.global_names = program.local_names = global_names
+        program.execute(LOOP)
+        # Run once so that compiling the function isn't counted
+        program.execute("(count-odds 1 0)")
+        global_names.lookups = 0
+        start = time.perf_counter()
+        result = program.asl_repr(program.execute("(count-odds %d 0)" % n))
+        elapsed = time.perf_counter() - start
+    finally:
+        cfg.BIND_GLOBAL_NAMES = True
+    assert result == str((n + 1) // 2)
+    return global_names.lookups / n, elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for engine in ENGINES:
+        for bind in (False, True):
+            lookups, elapsed = count_lookups(engine, bind, n)
+            print("%-11s %-9s %7.1f global lookups/call   %6.3f s"
+                  % (engine, "bound" if bind else "not bound",
+                     lookups, elapsed))
+
+
+if __name__ == "__main__":
+    main()
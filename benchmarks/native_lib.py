@@ -0,0 +1,91 @@
+"""Compare the native library functions with the Appleseed definitions.
+
+Usage: python benchmarks/native_lib.py [engine]
+
+Runs the definitions in SETUP, then times each case with native_lib on
+and with it off, on the given engine (interpreted by default), and
+prints both times.
+"""
+
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from execution import Program
+
+SETUP = [
+    # A 1339-character string of 300 words
+    "(def words (map (lambda (n) (repr (mul n 7))) (range 300)))",
+    '(def text (join words " "))',
+    # Square matrices of Ints
+    "(def grid-30 (map (lambda (i) (range i (add i 30))) (range 30)))",
+    "(def grid-100 (map (lambda (i) (range i (add i 100))) (range 100)))",
+    # A 100006-character line
+    '(def line (strcat "12345 " (str (repeat-val 120 100000))))',
+    "(def sq (lambda (x) (mul x x)))",
+]
+
+CASES = [
+    # lib/lists.asl and lib/metafunctions.asl
+    "(length (count-up 1 20000))",
+    "(foldl add (map inc (filter odd? (count-up 1 20000))))",
+    "(nth 19999 (reverse (range 20000)))",
+    "(contains? (range 20000) 19999)",
+    "(length (flatten (map (lambda (n) (list n (list n))) (range 5000))))",
+    # lib/math.asl
+    "(nth 300 (primes))",
+    "(length (filter prime? (range 2000)))",
+    "(prime-factors 600851475143)",
+    # lib/strings.asl
+    '(strlen (join words ", "))',
+    "(strlen (strcat text text))",
+    '(strlen (replace text "9" "nine"))',
+    '(length (split text " "))',
+    # lib/matrices.asl
+    "(length (transpose grid-100))",
+    "(sum (map sum (matmul grid-30 grid-30)))",
+    "(matrix-trace grid-100)",
+    # chars
+    "(parse-int line)",
+    '(starts-with? "123" (chars line))',
+    "(strlen (str (tail (chars line))))",
+    "(head (drop 5000 (chars line)))",
+    # Streams
+    "(length (zip-with add (range 50000) (count-up 0)))",
+    "(foldl add (map sq (range 50000)))",
+    "(foldl add (take 20000 (filter odd? (map sq (count-up 0)))))",
+    "(foldl add (take 50000 (cycle (list 1 2 3))))",
+]
+
+
+def run_time(program, code):
+    """Return how long running code and printing its value took, in seconds.
+
+Printing the value works out all of it, even if it's a lazy list.
+"""
+    start = time.perf_counter()
+    program.asl_repr(program.execute(code))
+    return time.perf_counter() - start
+
+
+def main():
+    engine = sys.argv[1] if len(sys.argv) > 1 else "interpreted"
+    # The Appleseed definitions nest Python calls deeply
+    sys.setrecursionlimit(10000)
+    native = Program(engine=engine)
+    pure = Program(engine=engine, native_lib=False)
+    for code in SETUP:
+        run_time(native, code)
+        run_time(pure, code)
+    for code in CASES:
+        pure_time = run_time(pure, code)
+        native_time = run_time(native, code)
+        print("%8.3f s -> %7.3f s   %s" % (pure_time, native_time, code))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare the throughput of the regex scanner with the old scanner.
+
+Usage: python benchmarks/scan_throughput.py [repeats]
+
+Scans the standard library sources, repeated (200 times by default),
+and a long string literal with both scanners and prints how many MB of
+source each gets through per second. Also times decoding the escape
+sequences in a shorter string literal both ways (the old decoder builds
+the string one character at a time, which takes quadratic time on the
+long one).
+"""
+
+import glob
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tests"))
+
+import parsing
+import reference_scanner
+
+LITERAL_LENGTH = 2_000_000
+DECODE_LENGTH = 200_000
+
+
+def best_time(function, *args, runs=3):
+    """Return the shortest time that function(*args) took, in seconds."""
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def scan_all(scan, code):
+    for token in scan(code):
+        pass
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    library = ""
+    for path in sorted(glob.glob(os.path.join(ROOT_DIR, "lib", "*.asl"))):
+        with open(path) as f:
+            library += f.read()
+    unit = 'abc \\"quoted\\" \\n\\t '
+    literal = '"%s"' % (unit * (LITERAL_LENGTH // len(unit)))
+    short_literal = '"%s"' % (unit * (DECODE_LENGTH // len(unit)))
+    sources = [("lib x%d" % repeats, library * repeats),
+               ("long literal", literal)]
+    for name, code in sources:
+        megabytes = len(code) / 1_000_000
+        old = best_time(scan_all, reference_scanner.scan, code)
+        new = best_time(scan_all, parsing.scan, code)
+        print("%-14s %6.1f MB   old scan %5.1f MB/s   new scan %5.1f MB/s"
+              % (name, megabytes, megabytes / old, megabytes / new))
+    old = best_time(reference_scanner.decode_string, short_literal)
+    new = best_time(parsing.parse_name_or_literal, short_literal)
+    print("%-14s %6.1f MB   old %.3f s   new %.3f s"
+          % ("literal decode", len(short_literal) / 1_000_000, old, new))
+
+
+if __name__ == "__main__":
+    main()
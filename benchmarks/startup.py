@@ -0,0 +1,66 @@
+"""Time how long a Program takes to start up, with each kind of cache.
+
+Usage: python benchmarks/startup.py [runs]
+
+Each measurement is made in a new Python process, so nothing is left
+over from the one before; the caches on disk are warmed up first. The
+time is that of making the Program and running a one-line script that
+defines start!, the best of several runs (5 by default).
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+SCRIPT = "(def start! (lambda () (print! \"hello\")))"
+
+# Run in the new process; prints the time taken in milliseconds
+TIMER = """
+import sys, time
+sys.path.insert(0, %(root)r)
+import parse_cache
+from execution import Program
+if not %(parse_cache)r:
+    parse_cache.load = lambda path, code: None
+    parse_cache.store = lambda path, code, exprs: None
+start = time.perf_counter()
+program = Program(snapshot=%(snapshot)r, lazy_stdlib=%(lazy)r)
+program.execute(%(script)r)
+print((time.perf_counter() - start) * 1000)
+"""
+
+MODES = [
+    ("no caches", dict(parse_cache=False, snapshot=None, lazy=False)),
+    ("parse cache", dict(parse_cache=True, snapshot=None, lazy=False)),
+    ("snapshot", dict(parse_cache=True, snapshot="SNAPSHOT", lazy=False)),
+    ("lazy_stdlib", dict(parse_cache=True, snapshot=None, lazy=True)),
+]
+
+
+def start_time(options):
+    """Start a Program in a new process; return how long it took, in ms."""
+    code = TIMER % dict(options, root=ROOT_DIR, script=SCRIPT)
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = os.path.join(directory, "library.snapshot")
+        for name, options in MODES:
+            if options["snapshot"] is not None:
+                options = dict(options, snapshot=snapshot)
+            # Warm up the caches, then time the runs that use them
+            start_time(options)
+            best = min(start_time(options) for i in range(runs))
+            print("%-12s %7.1f ms" % (name, best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Time a recursive function whose calls are made strictly.
+
+Usage: python benchmarks/strict_calls.py [n]
+
+Times (fib n) (20 by default) on each engine, and prints how many calls
+were made right away instead of through a thunk.
+"""
+
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from execution import Program
+
+ENGINES = ["interpreted", "compiled", "vm"]
+
+FIB = ("(def fib (lambda (n) (if (less? n 2) n"
+       " (add (fib (sub n 1)) (fib (sub n 2))))))")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for engine in ENGINES:
+        program = Program(engine=engine)
+        program.execute(FIB)
+        start = time.perf_counter()
+        result = program.asl_repr(program.execute("(fib %d)" % n))
+        elapsed = time.perf_counter() - start
+        print("%-11s (fib %d) = %s   %6.3f s   %d thunks avoided"
+              % (engine, n, result, elapsed, program.thunks_avoided))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+
+from itertools import islice
+
+from cfg import nil
+import cfg
+from thunk import resolve_thunks, cons_iter
+
+
+# How many binding plans (and function structures) to keep before the
+# oldest ones are thrown away
+MAX_BINDING_PLANS = 4096
+
+
+class BindingPlan:
+    """How to bind arguments to a valid parameter list.
+
+A parameter list is either a single name, which gets the whole list of
+arguments (rest_name); or a list of required names, followed by any
+number of (name default) pairs (optional). Working this out once per
+parameter list means that binding the arguments of a call is a straight
+loop over the names.
+"""
+    def __init__(self, required=(), optional=(), rest_name=None):
+        self.required = list(required)
+        self.optional = list(optional)
+        self.rest_name = rest_name
+        self.min_count = len(self.required)
+        self.max_count = len(self.required) + len(self.optional)
+
+    def names(self):
+        """Return all the names that the plan binds."""
+        if self.rest_name is not None:
+            return [self.rest_name]
+        return self.required + [name for name, default in self.optional]
+
+    def bind(self, environment, arguments, namespace, procedure_type):
+        """Bind the arguments of a call in namespace.
+
+If there are too few or too many arguments, give an error and raise
+TypeError.
+"""
+        if self.rest_name is not None:
+            if procedure_type == "function":
+                # Repackage arglist into nested tuples
+                args = nil
+                for arg in reversed(arguments):
+                    args = (arg, args)
+                namespace[self.rest_name] = args
+            else:
+                # Quote arglist
+                namespace[self.rest_name] = ("q", (arguments, ()))
+            return
+        if procedure_type == "macro":
+            arguments = list(cons_iter(arguments))
+        arg_count = len(arguments)
+        required = self.required
+        if arg_count == self.min_count and not self.optional:
+            # The usual case: exactly the required arguments
+            namespace.update(zip(required, arguments))
+            return
+        namespace.update(zip(required, arguments))
+        index = self.min_count
+        for name, default_val in self.optional:
+            if index < arg_count:
+                # Use argument given
+                namespace[name] = arguments[index]
+            else:
+                # No argument given; use default value
+                namespace[name] = environment.asl_eval(default_val)
+            index += 1
+        if arg_count < self.min_count:
+            # Not enough arguments
+            cfg.error(procedure_type, "takes at least", self.min_count,
+                      "arguments, got", arg_count)
+            raise TypeError
+        elif arg_count > self.max_count:
+            # Too many arguments
+            cfg.error(procedure_type, "takes at most", self.max_count,
+                      "arguments, got", arg_count)
+            raise TypeError
+
+
+def make_plan(param_names):
+    """Return the binding plan for a parameter list.
+
+Param_names should already have had its thunks resolved. If the
+parameter list isn't valid, return None; binding arguments to it gives
+errors that depend on the arguments, so it has to be done the long way.
+"""
+    if isinstance(param_names, str):
+        return BindingPlan(rest_name=param_names)
+    elif not isinstance(param_names, tuple):
+        return None
+    required = []
+    optional = []
+    for name in cons_iter(param_names):
+        name = resolve_thunks(name)
+        if isinstance(name, str):
+            if optional:
+                # Required parameter after optional parameters
+                return None
+            required.append(name)
+        elif name and isinstance(name, tuple):
+            default_pair = list(islice(cons_iter(name), 3))
+            if len(default_pair) != 2:
+                return None
+            name, default_val = map(resolve_thunks, default_pair)
+            if not isinstance(name, str):
+                return None
+            optional.append((name, default_val))
+        else:
+            return None
+    return BindingPlan(required, optional)
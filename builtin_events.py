@@ -5,6 +5,8 @@ from cfg import nil
 import cfg
 import execution
 import thunk
+from objects import Object
+from hashed import Set, Map
 
 builtin_event_names = ["start!", "receive-line!"]
 
@@ -21,7 +23,7 @@ def event_loop(environment):
             event_handlers[event_name] = environment.global_names[event_name]
     # Fire the start! event to kick things off
     # TODO: use an actual queue type for event_queue instead of a list?
-    event_queue = [{"type": "Event", "name": "start!"}]
+    event_queue = [Object([("type", "Event"), ("name", "start!")])]
     while event_queue:
         event = event_queue.pop(0)
         if event["name"] in event_handlers:
@@ -40,7 +42,7 @@ def perform_action(action):
         # List of actions
         for subaction in thunk.cons_iter(action):
             action_results.extend(perform_action(subaction))
-    elif isinstance(action, dict) and "name" in action:
+    elif isinstance(action, Object) and "name" in action:
         # Single action
         action_func = builtin_actions.get(action["name"])
         if action_func is not None:
@@ -81,9 +83,9 @@ def act_ask_line(action):
     except EOFError:
         input_line = nil
     # Generate a receive-line! event
-    return {"type": "Event",
-            "name": "receive-line!",
-            "line": input_line}
+    return Object([("type", "Event"),
+                   ("name", "receive-line!"),
+                   ("line", input_line)])
 
 
 def act_exit(action):
@@ -134,7 +136,7 @@ Keyword arguments:
         write("true" if value else "false")
     elif (isinstance(value, int) or isinstance(value, str)):
         write(value)
-    elif isinstance(value, dict):
+    elif isinstance(value, Object):
         # Object
         write("{")
         if "type" in value:
@@ -156,6 +158,24 @@ Keyword arguments:
                 asl_print(property_value, newline=False, error=error)
                 write(")")
         write("}")
+    elif isinstance(value, Set):
+        write("#set{")
+        for index, item in enumerate(value.items()):
+            if index:
+                write(" ")
+            asl_print(item, newline=False, error=error)
+        write("}")
+    elif isinstance(value, Map):
+        write("#map{")
+        for index, (key, item) in enumerate(value.items()):
+            if index:
+                write(" ")
+            write("(")
+            asl_print(key, newline=False, error=error)
+            write(" ")
+            asl_print(item, newline=False, error=error)
+            write(")")
+        write("}")
     elif hasattr(value, "is_macro"):
         # One of the builtin functions or macros
         write("<builtin %s %s>"
@@ -1,6 +1,9 @@
 
 import sys
 
+import arraylist
+import hashcons
+
 # Scanning/parsing related constants
 WHITESPACE = " \t\n\r"
 SYMBOLS = "()"
@@ -12,6 +15,28 @@ STRING_ESCAPE_CHAR = "\\"
 SPECIAL_CHARS = (WHITESPACE + SYMBOLS + LINE_COMMENT_CHAR
                  + TOKEN_DELIMITER + STRING_DELIMITER)
 
+# Source files bigger than this (in bytes) are executed as they are
+# read, rather than read in whole and their parse trees cached
+STREAMING_FILE_SIZE = 1 << 20
+
+# When code is executed as it is read, this much of it (in bytes) can be
+# held back waiting for an open s-expression to close; past that, the
+# held lines are parsed in single-line form, so that an unclosed paren
+# doesn't hold back the rest of the input until it ends
+MAX_PENDING_CODE_SIZE = 1 << 20
+
+# Lists this long or longer are stored as arrays when they are parsed
+ARRAY_LIST_MIN_LENGTH = 8
+
+# Whether compiled code (in the compiled and vm engines) uses the values
+# of defined global names directly, instead of looking them up each time
+# it runs. A name can't be redefined, so this is safe; turning it off
+# shows what it saves (see benchmarks/global_names.py)
+BIND_GLOBAL_NAMES = True
+
+# How many expansions of user-defined macro calls to remember
+MACRO_CACHE_SIZE = 4096
+
 # Repl prompt string
 PROMPT = "asl> "
 
@@ -28,7 +53,14 @@ def error(*args):
     print("Error:", *args, file=sys.stderr)
 
 
+# Running count of warnings given, so that callers can tell whether a
+# particular step (such as parsing) gave any
+warning_count = 0
+
+
 def warn(*args):
+    global warning_count
+    warning_count += 1
     print("Warning:", *args, file=sys.stderr)
 
 
@@ -46,16 +78,47 @@ class UserQuit(BaseException):
     pass
 
 
+def resolved_value(value):
+    """Return the result of value, if it is a thunk that has been resolved.
+
+Only thunks have a resolved attribute (the thunk module can't be
+imported here, since it imports this one).
+"""
+    resolved = getattr(value, "resolved", None)
+    while resolved is not None:
+        value = resolved
+        resolved = getattr(value, "resolved", None)
+    return value
+
+
 def identical(value1, value2):
+    # Resolved thunks are looked through as the lists are walked, so that
+    # comparing two long lists that have been worked out doesn't recurse
+    # once per cell
+    value1 = resolved_value(value1)
+    value2 = resolved_value(value2)
     while isinstance(value1, tuple) and isinstance(value2, tuple):
-        if value1 == value2 == ():
+        if value1 is value2:
+            return True
+        elif (isinstance(value1, arraylist.ArrayList)
+                and isinstance(value2, arraylist.ArrayList)):
+            # Compare the items directly, rather than cell by cell
+            return (value1.length() == value2.length()
+                    and all(map(identical, value1.values(),
+                                value2.values())))
+        elif (hashcons.is_interned(value1)
+                and hashcons.is_interned(value2)):
+            # Two different interned lists are never identical
+            return False
+        elif not value1 and not value2:
+            # Both nil
             return True
-        elif value1 == () or value2 == ():
+        elif not value1 or not value2:
             return False
         else:
             if identical(value1[0], value2[0]):
-                value1 = value1[1]
-                value2 = value2[1]
+                value1 = resolved_value(value1[1])
+                value2 = resolved_value(value2[1])
             else:
                 return False
     if isinstance(value1, list) and isinstance(value2, list):
@@ -0,0 +1,418 @@
+
+from itertools import islice
+
+from cfg import nil
+import cfg
+import execution
+from objects import Object
+from hashed import HashedCollection
+from thunk import Thunk, resolve_thunks, cons_iter
+
+
+# How many compiled function bodies to keep before the oldest ones are
+# thrown away (functions built at runtime, e.g. by partial, would
+# otherwise fill up the cache)
+MAX_COMPILED_FUNCTIONS = 4096
+
+
+class CompiledThunk(Thunk):
+    """A delayed function call whose body runs as compiled code."""
+    __slots__ = ()
+
+    @staticmethod
+    def run(environment, param_names, body, arglist):
+        body_code = environment.compiler.compile_function(param_names, body)
+        # Enter a new scope (as Program.new_scope does, but without the
+        # overhead of a context manager)
+        local_names = {}
+        environment.depth += 1
+        environment.names.append(local_names)
+        environment.local_names = local_names
+        try:
+            try:
+                environment.bind_params(param_names, body, arglist,
+                                        local_names)
+                return_val = body_code(local_names)
+                while type(return_val) is list:
+                    # A tail call to the same function, which returns
+                    # just the new arguments (see
+                    # Compiler.compile_static_call); bind them in place
+                    # of the old ones and run the body again
+                    local_names.clear()
+                    environment.bind_params(param_names, body, return_val,
+                                            local_names)
+                    return_val = body_code(local_names)
+            except TypeError:
+                # There was a problem with binding the parameters
+                # (bind_params already gave the error message)
+                return None
+            return return_val
+        finally:
+            environment.names.pop()
+            environment.depth -= 1
+            environment.local_names = environment.names[environment.depth]
+
+
+class Compiler:
+    """Compiles function bodies into trees of Python closures.
+
+Each closure takes the local scope of the function call and returns
+the value that Program.asl_eval would have given for the expression it
+was compiled from. Work that asl_eval redoes on every evaluation is
+done once, when the closure is built: deciding what kind of expression
+it is, whether a call's head is a builtin, a user-defined function, or
+a macro, and checking argument counts. Names bound to parameters are
+looked up in the local scope, and other names in the global scope.
+
+A head can only be decided in advance if it is a global name that is
+already defined, since a name can't be redefined once it has been
+defined. (The one exception is _ in the repl, which is never decided in
+advance.) Other heads are evaluated each time, and then dispatched on.
+
+Macro calls are expanded the first time they are evaluated, and the
+expansion is compiled and kept. This is safe because a macro's
+expansion depends only on the code it is called with. Anything unusual
+falls back on asl_eval, so error messages are the same as usual.
+"""
+    def __init__(self, environment):
+        self.environment = environment
+        self.functions = {}
+
+    def compile_function(self, param_names, body):
+        """Return the compiled code for a function's body."""
+        key = (id(param_names), id(body))
+        entry = self.functions.get(key)
+        if entry is not None:
+            return entry[2]
+        # A library function with a native version runs a call of that
+        # in place of its body (see natives.py)
+        code = self.environment.native_bodies.get(key, body)
+        body_code = self.compile(code, local_name_set(param_names),
+                                 tail=(param_names, body))
+        if len(self.functions) >= MAX_COMPILED_FUNCTIONS:
+            # Throw away the oldest compiled function
+            del self.functions[next(iter(self.functions))]
+        # Keep references to the parameter list and body, so their ids
+        # aren't reused while the entry exists
+        self.functions[key] = (param_names, body, body_code)
+        return body_code
+
+    def compile(self, expr, local_names, strict=False, tail=None):
+        """Compile an expression in a function with the given params.
+
+If strict is true, the expression's value is always needed right away
+(see Program.strict_eval), so a call of a user-defined function in it
+is made directly instead of returning a thunk.
+
+If the expression is in tail position in the body of a function, tail
+is the function's parameter names and body. A call to the same
+function there returns only the list of arguments, and
+CompiledThunk.run loops instead of making a thunk for the call.
+"""
+        environment = self.environment
+        if isinstance(expr, tuple):
+            if expr:
+                return self.compile_call(expr, local_names, strict, tail)
+            else:
+                return constant(nil)
+        elif isinstance(expr, str):
+            if expr in local_names:
+                def local_name(scope):
+                    return scope[expr]
+                return local_name
+            elif (cfg.BIND_GLOBAL_NAMES and expr != "_"
+                  and expr in environment.global_names):
+                # A global name can't be redefined, so its value can be
+                # used directly
+                return constant(environment.global_names[expr])
+            else:
+                return self.compile_global_name(expr)
+        elif (isinstance(expr, int) or isinstance(expr, Object)
+              or isinstance(expr, HashedCollection)
+              or expr in environment.builtins):
+            return constant(expr)
+        else:
+            # Thunks, and anything else unexpected
+            return self.fallback(expr)
+
+    def compile_global_name(self, name):
+        """Compile a reference to a global name that isn't defined yet.
+
+Once the name has been defined, its value is kept and used from then
+on. (Except for _ in the repl, which changes.)
+"""
+        environment = self.environment
+        global_names = environment.global_names
+        value_cell = []
+
+        def global_name(scope):
+            if value_cell:
+                return value_cell[0]
+            try:
+                value = global_names[name]
+            except KeyError:
+                # Undefined name (or one that needs to be autoloaded)
+                return environment.asl_eval(name)
+            if name != "_" and cfg.BIND_GLOBAL_NAMES:
+                value_cell.append(value)
+            return value
+        return global_name
+
+    def compile_call(self, expr, local_names, strict, tail):
+        environment = self.environment
+        head_code, raw_args = expr
+        args = proper_list(raw_args)
+        if args is None:
+            # Argument list with thunks in it, or improper list
+            return self.fallback(expr)
+        if (isinstance(head_code, str) and head_code not in local_names
+                and head_code != "_"
+                and head_code in environment.global_names):
+            head = environment.global_names[head_code]
+            if isinstance(head, Thunk):
+                return self.fallback(expr)
+            return self.compile_static_call(head, expr, args, local_names,
+                                            strict, tail)
+        elif head_code in environment.builtins:
+            # A builtin in the code itself, as in the library functions
+            # that call native versions
+            return self.compile_static_call(head_code, expr, args,
+                                            local_names, strict, tail)
+        elif isinstance(head_code, str) or isinstance(head_code, tuple):
+            return self.compile_dynamic_call(expr, args, local_names,
+                                             strict)
+        else:
+            # The head is something that can't be called; let asl_eval
+            # give the error
+            return self.fallback(expr)
+
+    def compile_static_call(self, head, expr, args, local_names, strict,
+                            tail):
+        """Compile a call whose head is known at compile time."""
+        environment = self.environment
+        if head == environment.asl_if:
+            if len(args) != 3:
+                return self.fallback(expr)
+            condition = self.compile(args[0], local_names, True)
+            true_branch, false_branch = (
+                self.compile(arg, local_names, strict, tail)
+                for arg in args[1:])
+            asl_bool = environment.asl_bool
+
+            def if_call(scope):
+                if asl_bool(condition(scope)):
+                    return true_branch(scope)
+                else:
+                    return false_branch(scope)
+            return if_call
+        elif head == environment.asl_eval:
+            if len(args) != 1:
+                return self.fallback(expr)
+            arg_code = self.compile(args[0], local_names, True)
+            asl_eval = environment.asl_eval
+
+            def eval_call(scope):
+                return asl_eval(arg_code(scope))
+            return eval_call
+        elif environment.is_macro(head):
+            return self.compile_macro_call(head, expr, local_names, strict,
+                                           tail)
+        elif head and isinstance(head, tuple):
+            function_parts = list(islice(cons_iter(head), 3))
+            if len(function_parts) != 2:
+                return self.fallback(expr)
+            param_names, body = function_parts
+            arg_codes = [self.compile(arg, local_names) for arg in args]
+            if (tail is not None and param_names is tail[0]
+                    and body is tail[1]):
+                # A tail call to the function itself; just give the
+                # arguments to CompiledThunk.run
+                def function_call(scope):
+                    return [arg_code(scope) for arg_code in arg_codes]
+            elif strict:
+                run_call = environment.run_call
+
+                def function_call(scope):
+                    return run_call(param_names, body,
+                                    [arg_code(scope) for arg_code in arg_codes])
+            else:
+                def function_call(scope):
+                    return CompiledThunk(environment, param_names, body,
+                                         [arg_code(scope)
+                                          for arg_code in arg_codes])
+            return function_call
+        elif head in environment.builtins:
+            if (head.name in execution.top_level_macros
+                    or head.name in execution.repl_macros
+                    or not arg_count_ok(head, len(args))):
+                # Let asl_eval give the error
+                return self.fallback(expr)
+            elif head.is_macro:
+                if head == environment.asl_quote:
+                    return constant(args[0])
+
+                def builtin_macro_call(scope):
+                    return head(*args)
+                return builtin_macro_call
+            else:
+                return self.compile_builtin_call(head, args, local_names)
+        else:
+            return self.fallback(expr)
+
+    def compile_builtin_call(self, builtin, args, local_names):
+        arg_codes = [self.compile(arg, local_names, builtin.strict_args)
+                     for arg in args]
+        # Special-case the most common argument counts
+        if len(arg_codes) == 1:
+            arg_code, = arg_codes
+
+            def builtin_call(scope):
+                return builtin(arg_code(scope))
+        elif len(arg_codes) == 2:
+            arg_code1, arg_code2 = arg_codes
+
+            def builtin_call(scope):
+                return builtin(arg_code1(scope), arg_code2(scope))
+        else:
+            def builtin_call(scope):
+                return builtin(*[arg_code(scope) for arg_code in arg_codes])
+        return builtin_call
+
+    def compile_macro_call(self, macro, expr, local_names, strict, tail):
+        """Compile a call to a user-defined macro.
+
+The expansion is done when the call is first evaluated, rather than
+now, since a macro can expand into a call to itself.
+"""
+        environment = self.environment
+        flag, macro_params, macro_body = cons_iter(macro)
+        macro_params = resolve_thunks(macro_params)
+        if isinstance(macro_params, tuple) and any(
+                isinstance(resolve_thunks(param), tuple)
+                for param in cons_iter(macro_params)):
+            # Default values for macro parameters are evaluated when
+            # the macro is expanded, so the expansion can't be kept
+            return self.fallback(expr)
+        fallback = self.fallback(expr)
+        expansion = [None]
+
+        def macro_call(scope):
+            expanded_code = expansion[0]
+            if expanded_code is None:
+                warning_count = cfg.warning_count
+                macro_names = {}
+                try:
+                    environment.bind_params(macro_params, macro_body,
+                                            expr[1], macro_names)
+                except TypeError:
+                    # There was a problem with the arguments (and
+                    # bind_params gave the error message); from now on,
+                    # let asl_eval give the error each time
+                    expansion[0] = fallback
+                    return nil
+                expression = environment.replace(macro_names,
+                                                 resolve_thunks(macro_body))
+                expanded_code = self.compile(resolve_thunks(expression),
+                                             local_names, strict, tail)
+                if cfg.warning_count == warning_count:
+                    expansion[0] = expanded_code
+                else:
+                    # Expanding the macro gave warnings, which asl_eval
+                    # would give every time
+                    expansion[0] = fallback
+            return expanded_code(scope)
+        return macro_call
+
+    def compile_dynamic_call(self, expr, args, local_names, strict):
+        """Compile a call whose head has to be evaluated each time."""
+        environment = self.environment
+        head_code = self.compile(expr[0], local_names, True)
+        raw_args = expr[1]
+        arg_codes = [self.compile(arg, local_names) for arg in args]
+        # Remember the parts of the last function called from here
+        last_call = [None, None, None]
+        if strict:
+            make_call = environment.run_call
+        else:
+            def make_call(param_names, body, arglist):
+                return CompiledThunk(environment, param_names, body, arglist)
+
+        def dynamic_call(scope):
+            function = resolve_thunks(head_code(scope))
+            if function is last_call[0]:
+                return make_call(last_call[1], last_call[2],
+                                 [arg_code(scope) for arg_code in arg_codes])
+            elif (function and isinstance(function, tuple)
+                    and not environment.is_macro(function)):
+                function_parts = list(islice(cons_iter(function), 3))
+                if len(function_parts) == 2:
+                    last_call[:] = [function] + function_parts
+                    return make_call(*function_parts,
+                                     [arg_code(scope)
+                                      for arg_code in arg_codes])
+            elif (function in environment.builtins
+                    and not function.is_macro
+                    and function != environment.asl_eval):
+                return environment.call_builtin(
+                    function, [arg_code(scope) for arg_code in arg_codes])
+            # Macros, if, eval, and errors
+            return environment.apply(function, raw_args, strict=strict)
+        return dynamic_call
+
+    def fallback(self, expr):
+        """Compile an expression by leaving it for asl_eval."""
+        asl_eval = self.environment.asl_eval
+
+        def evaluate(scope):
+            return asl_eval(expr)
+        return evaluate
+
+
+def constant(value):
+    def constant_value(scope):
+        return value
+    return constant_value
+
+
+def local_name_set(param_names):
+    """Return the names that a parameter list binds."""
+    param_names = resolve_thunks(param_names)
+    if isinstance(param_names, str):
+        return {param_names}
+    names = set()
+    if isinstance(param_names, tuple):
+        for name in cons_iter(param_names):
+            name = resolve_thunks(name)
+            if name and isinstance(name, tuple):
+                # Name + default value pair
+                name = resolve_thunks(name[0])
+            if isinstance(name, str):
+                names.add(name)
+    return names
+
+
+def proper_list(expr):
+    """Return the items of a cons list as a Python list.
+
+If the list contains thunks or isn't a proper list, return None.
+"""
+    items = []
+    while expr and isinstance(expr, tuple):
+        items.append(expr[0])
+        expr = expr[1]
+    if expr == nil and isinstance(expr, tuple):
+        return items
+    else:
+        return None
+
+
+def arg_count_ok(builtin, arg_count):
+    """Can a builtin be called with this many arguments?"""
+    min_count = builtin.min_param_count
+    max_count = builtin.max_param_count
+    if isinstance(min_count, int) and arg_count < min_count:
+        return False
+    elif isinstance(max_count, int) and arg_count > max_count:
+        return False
+    else:
+        return True
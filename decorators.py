@@ -0,0 +1,43 @@
+
+from thunk import resolve_thunks
+
+
+# Decorators for member functions that implement builtins
+
+def macro(pyfunc):
+    pyfunc.is_macro = True
+    pyfunc.name = pyfunc.__name__
+    pyfunc.strict_args = getattr(pyfunc, "strict_args", False)
+    return pyfunc
+
+
+def function(pyfunc):
+    pyfunc.is_macro = False
+    pyfunc.name = pyfunc.__name__
+    pyfunc.strict_args = getattr(pyfunc, "strict_args", False)
+    return pyfunc
+
+
+def params(min_param_count, max_param_count=None):
+    def params_decorator(pyfunc):
+        pyfunc.min_param_count = min_param_count
+        if max_param_count is not None:
+            pyfunc.max_param_count = max_param_count
+        else:
+            pyfunc.max_param_count = min_param_count
+        return pyfunc
+    return params_decorator
+
+
+def no_thunks(pyfunc):
+    def resolve_thunks_and_call(*args, **kwargs):
+        resolved_args = []
+        for value in args:
+            value = resolve_thunks(value)
+            resolved_args.append(value)
+        return pyfunc(*resolved_args, **kwargs)
+    resolve_thunks_and_call.__name__ = pyfunc.__name__
+    # The arguments are always resolved, so they can be evaluated
+    # strictly (see Program.strict_eval)
+    resolve_thunks_and_call.strict_args = True
+    return resolve_thunks_and_call
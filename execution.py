@@ -6,8 +6,23 @@ from itertools import zip_longest, islice
 
 from cfg import nil, identical
 import cfg
-from parsing import parse
+from parsing import parse, parse_lines
+import parse_cache
+import snapshots
+from macro_cache import MacroCache
+import binding
+import hashcons
+from arraylist import ArrayList, CharList, build_list
+from objects import Object, EMPTY_OBJECT
+from hashed import HashedCollection, Set, Map, EMPTY_SET, EMPTY_MAP
+import compiler
+import vm
 from thunk import Thunk, resolve_thunks, cons_iter
+from decorators import macro, function, params, no_thunks
+import native_lists
+import native_math
+import native_strings
+import native_matrices
 import help_text
 
 
@@ -31,6 +46,21 @@ builtins = {"asl_cons": "cons",
             "asl_chars": "chars",
             "asl_repr": "repr",
             "asl_bool": "bool",
+            "asl_hash_set": "hash-set",
+            "asl_hash_map": "hash-map",
+            "asl_to_set": "to-set",
+            "asl_to_map": "to-map",
+            "asl_to_list": "to-list",
+            "asl_size": "size",
+            "asl_set_insert": "set-insert",
+            "asl_set_remove": "set-remove",
+            "asl_set_contains": "set-contains?",
+            "asl_set_union": "set-union",
+            "asl_map_insert": "map-insert",
+            "asl_map_remove": "map-remove",
+            "asl_map_get": "map-get",
+            "asl_map_contains": "map-contains?",
+            "asl_map_union": "map-union",
             # The following are macros:
             "asl_def": "def",
             "asl_if": "if",
@@ -55,49 +85,66 @@ top_level_macros = ["asl_def", "asl_load"]
 
 repl_macros = ["asl_help", "asl_restart", "asl_quit"]
 
+# Native versions of library functions. They don't have names of their
+# own; in native mode, calls of the library functions they stand in for
+# are made by calling them instead (see natives.py)
 
-# Decorators for member functions that implement builtins
+native_builtins = dict(native_lists.builtins)
+native_builtins.update(native_math.builtins)
+native_builtins.update(native_strings.builtins)
+native_builtins.update(native_matrices.builtins)
+builtins.update(native_builtins)
 
-def macro(pyfunc):
-    pyfunc.is_macro = True
-    pyfunc.name = pyfunc.__name__
-    return pyfunc
 
+def remember(cache, key, value):
+    """Add an entry to a cache, dropping the oldest one if it's full."""
+    if len(cache) >= binding.MAX_BINDING_PLANS:
+        del cache[next(iter(cache))]
+    cache[key] = value
 
-def function(pyfunc):
-    pyfunc.is_macro = False
-    pyfunc.name = pyfunc.__name__
-    return pyfunc
 
-
-def params(min_param_count, max_param_count=None):
-    def params_decorator(pyfunc):
-        pyfunc.min_param_count = min_param_count
-        if max_param_count is not None:
-            pyfunc.max_param_count = max_param_count
-        else:
-            pyfunc.max_param_count = min_param_count
-        return pyfunc
-    return params_decorator
-
-
-def no_thunks(pyfunc):
-    def resolve_thunks_and_call(*args, **kwargs):
-        resolved_args = []
-        for value in args:
-            value = resolve_thunks(value)
-            resolved_args.append(value)
-        return pyfunc(*resolved_args, **kwargs)
-    resolve_thunks_and_call.__name__ = pyfunc.__name__
-    return resolve_thunks_and_call
-
-
-class Program:
-    def __init__(self, repl=False, max_list_items=None):
+class Program(native_lists.ListNatives, native_math.MathNatives,
+              native_strings.StringNatives, native_matrices.MatrixNatives):
+    def __init__(self, repl=False, max_list_items=None, snapshot=None,
+                 lazy_stdlib=False, engine="interpreted", hash_cons=False,
+                 native_lib=True):
         self.repl = repl
         self.max_list_items = max_list_items
+        self.snapshot = snapshot
+        self.lazy_stdlib = lazy_stdlib
+        self.engine = engine
+        # In hash-consing mode, code and lists built with cons are
+        # interned, so that equal lists share one object
+        self.hash_cons = hash_cons
+        # In native mode, the library's list, math, string, and matrix
+        # functions are run by native code instead of being interpreted
+        self.native_lib = native_lib
+        # The engine decides how the bodies of user-defined functions
+        # are run: by walking the code each time a function is called,
+        # by compiling it once into Python closures, or by compiling it
+        # to bytecode for a VM
+        if engine == "interpreted":
+            self.compiler = None
+            self.thunk_type = Thunk
+        elif engine == "compiled":
+            self.compiler = compiler.Compiler(self)
+            self.thunk_type = compiler.CompiledThunk
+        elif engine == "vm":
+            self.vm = vm.VM(self)
+            self.thunk_type = vm.VMThunk
+        else:
+            raise ValueError("unknown engine %r" % (engine,))
+        self.autoload_index = {}
+        self.macro_cache = MacroCache(cfg.MACRO_CACHE_SIZE)
+        self.binding_plans = {}
+        self.function_structures = {}
+        # How many calls of user-defined functions were made right
+        # away, in places where their values were needed, instead of
+        # through a thunk (see strict_eval)
+        self.thunks_avoided = 0
         self.modules = []
         self.module_paths = [os.path.abspath(os.path.dirname(__file__))]
+        self.library_directory = os.path.join(self.module_paths[0], "lib")
         self.extensions = []
         self.names = [{}]
         self.depth = 0
@@ -107,70 +154,208 @@ class Program:
         # Go through the Appleseed builtins and put the corresponding
         # member functions into the top-level symbol table
         for func_name, asl_func_name in builtins.items():
-            builtin = getattr(self, func_name)
-            self.builtins.append(builtin)
-            self.global_names[asl_func_name] = builtin
-        # Load the standard library
-        self.asl_load("library")
+            if func_name not in native_builtins:
+                builtin = getattr(self, func_name)
+                self.builtins.append(builtin)
+                self.global_names[asl_func_name] = builtin
+        # Library function name -> native builtin that stands in for it
+        self.native_functions = {}
+        # Library function name -> its parameters, body, and the body to
+        # run when the native version hands a call back
+        self.native_originals = {}
+        # Ids of a library function's parameters and body -> the native
+        # call that is evaluated in place of the body
+        self.native_bodies = {}
+        if native_lib:
+            for func_name, asl_func_name in native_builtins.items():
+                builtin = getattr(self, func_name)
+                self.builtins.append(builtin)
+                self.native_functions[asl_func_name] = builtin
+        # Load the standard library, from a snapshot of the
+        # environment if there is an up-to-date one; or, in lazy mode,
+        # load each library module only when one of the names it
+        # defines is first used
+        if lazy_stdlib:
+            self.autoload_index = self.build_autoload_index("library")
+        elif snapshot is not None and snapshots.restore(self, snapshot):
+            if hash_cons:
+                for name, value in self.global_names.items():
+                    self.global_names[name] = hashcons.intern(value)
+                # The library functions are new objects now
+                self.add_native_versions()
+            self.inform("Loaded", "library.asl")
+        else:
+            self.asl_load("library")
+            if snapshot is not None:
+                snapshots.save(self, snapshot)
 
     def execute(self, code):
         if isinstance(code, str):
-            # Determine whether the code is in single-line or
-            # multiline form:
-            # In single-line form, the code is parsed one line at a time
-            # with closing parentheses inferred at the end of each line
-            # In multiline form, the code is parsed as a whole, with
-            # closing parentheses inferred only at the end
-            # If any line in the code contains more closing parens than
-            # opening parens, the code is assumed to be in multiline
-            # form; otherwise, it's single-line
-            codelines = code.split("\n")
-            multiline = any(line.count(")") > line.count("(")
-                            for line in codelines)
             result = None
-            if multiline:
-                # Parse code as a whole
-                for expr in parse(code):
-                    result = self.execute_expression(expr)
-            else:
-                # Parse each line separately
-                for codeline in codelines:
-                    for expr in parse(codeline):
-                        result = self.execute_expression(expr)
+            for expr in self.parse_code(code):
+                result = self.execute_expression(expr)
             return result
         else:
             raise NotImplementedError("Argument to execute() must be "
                                       "str, not %s" % type(code))
+
+    def execute_stream(self, lines):
+        """Execute code from an iterable of lines, such as a file.
+
+Each top-level expression is executed as soon as it has been read, so
+only the expression currently being read has to be kept in memory.
+An s-expression left open holds back at most cfg.MAX_PENDING_CODE_SIZE
+bytes of the code that follows it (see parsing.parse_lines).
+"""
+        result = None
+        for expr in parse_lines(lines):
+            result = self.execute_expression(expr)
+        return result
+
+    def execute_file(self, path, code):
+        """Execute code read from a file, using the parse cache.
+
+If the file's parse trees are in the cache, they are executed without
+parsing the code; otherwise, the code is parsed and executed and the
+cache is updated.
+"""
+        exprs = parse_cache.load(path, code)
+        if exprs is None:
+            exprs = parse_cache.parse_and_store(path, code,
+                                                self.parse_code(code))
+        result = None
+        for expr in exprs:
+            result = self.execute_expression(expr)
+        return result
+
+    def read_module(self, path):
+        """Return the top-level expressions in a module file."""
+        with open(path) as f:
+            code = f.read()
+        exprs = parse_cache.load(path, code)
+        if exprs is None:
+            exprs = list(parse_cache.parse_and_store(path, code,
+                                                     self.parse_code(code)))
+        return exprs
+
+    def build_autoload_index(self, library):
+        """Map each name defined by a library's modules to its module.
+
+The library is a module file that consists of loads of other modules,
+like library.asl. Each top-level (def name ...) in one of those
+modules puts name in the index.
+"""
+        directory = self.module_paths[0]
+        library_path = os.path.join(directory, library + ".asl")
+        index = parse_cache.load_index(library_path)
+        if index is not None:
+            return index
+        index = {}
+        for expr in self.read_module(library_path):
+            load_args = list(islice(cons_iter(expr), 3))
+            if len(load_args) != 2 or load_args[0] != "load":
+                continue
+            module_path = os.path.abspath(os.path.join(directory,
+                                                       load_args[1]
+                                                       + ".asl"))
+            for module_expr in self.read_module(module_path):
+                def_args = list(islice(cons_iter(module_expr), 3))
+                if (len(def_args) == 3 and def_args[0] == "def"
+                        and isinstance(def_args[1], str)):
+                    index.setdefault(def_args[1], module_path)
+        parse_cache.store_index(library_path, index)
+        return index
+
+    def autoload(self, name):
+        """Load the library module that defines name, if there is one.
+
+Returns True if name is now defined. The module is loaded at global
+scope, whatever scope the name was referenced from.
+"""
+        module_path = self.autoload_index.get(name)
+        if module_path is None or module_path in self.modules:
+            return False
+        names, depth = self.names, self.depth
+        self.names = [self.global_names]
+        self.depth = 0
+        self.local_names = self.global_names
+        try:
+            self.asl_load(module_path)
+        finally:
+            self.names, self.depth = names, depth
+            self.local_names = self.names[self.depth]
+        return name in self.global_names
+
+    def parse_code(self, code):
+        """Parse a string of code, yielding top-level expressions."""
+        # Determine whether the code is in single-line or multiline
+        # form:
+        # In single-line form, the code is parsed one line at a time
+        # with closing parentheses inferred at the end of each line
+        # In multiline form, the code is parsed as a whole, with
+        # closing parentheses inferred only at the end
+        # If any line in the code contains more closing parens than
+        # opening parens, the code is assumed to be in multiline
+        # form; otherwise, it's single-line
+        codelines = code.split("\n")
+        multiline = any(line.count(")") > line.count("(")
+                        for line in codelines)
+        if multiline:
+            # Parse code as a whole
+            yield from parse(code)
+        else:
+            # Parse each line separately
+            for codeline in codelines:
+                yield from parse(codeline)
     
     def execute_expression(self, expr):
         """Evaluate an expression; display it if in repl mode."""
+        if self.hash_cons:
+            expr = hashcons.intern(expr)
         result = self.asl_eval(expr, top_level=True)
         # If running in repl mode, display the result
         if self.repl:
             self.display(result)
         return result
 
-    def call_data(self, function, raw_args):
-        """Returns parameter names, body, and list of eval'd args."""
+    def function_parts(self, function):
+        """Returns parameter names and body, or None if not a function."""
         # Function should be a nested-tuple structure containing
         # parameter names and function body
+        structure = self.function_structures.get(id(function))
+        if structure is not None:
+            # We have seen this function before
+            return structure[1:]
         function_parts = list(islice(cons_iter(function), 3))
         if len(function_parts) == 2:
             param_names, body = function_parts
-            # Function arguments are evaluated
-            arglist = [self.asl_eval(arg) for arg in cons_iter(raw_args)]
-        elif len(function_parts) > 2:
-            cfg.error("list callable as function must have 2 elements,",
-                      "not more")
-            raise TypeError
-        else:
-            cfg.error("list callable as function must have 2 elements, not",
-                      len(function_parts))
+            remember(self.function_structures, id(function),
+                     (function, param_names, body))
+            return param_names, body
+        return None
+
+    def call_data(self, function, raw_args):
+        """Returns parameter names, body, and list of eval'd args."""
+        function_parts = self.function_parts(function)
+        if function_parts is None:
+            element_count = len(list(islice(cons_iter(function), 3)))
+            if element_count > 2:
+                cfg.error("list callable as function must have 2 elements,",
+                          "not more")
+            else:
+                cfg.error("list callable as function must have 2 elements,",
+                          "not", element_count)
             raise TypeError
+        param_names, body = function_parts
+        # Function arguments are evaluated
+        arglist = [self.asl_eval(arg) for arg in cons_iter(raw_args)]
         return param_names, body, arglist
 
-    def bind_params(self, param_names, arguments, namespace):
-        """Binds arguments to param_names in namespace."""
+    def bind_params(self, param_names, body, arguments, namespace):
+        """Binds arguments to param_names in namespace.
+
+The body is that of the function or macro whose parameters these are.
+"""
         arguments = resolve_thunks(arguments)
         if isinstance(arguments, list):
             # This is a function with a Python list of eval'd arguments
@@ -186,7 +371,12 @@ class Program:
                                       "nested tuple, not "
                                       + str(type(arguments)))
         param_names = resolve_thunks(param_names)
-        if isinstance(param_names, tuple):
+        plan = self.binding_plan(param_names, body, procedure_type)
+        if plan is not None:
+            plan.bind(self, arguments, namespace, procedure_type)
+        elif isinstance(param_names, tuple):
+            # The parameter list isn't valid; go through it one name at
+            # a time, to give the right error for these arguments
             name_iter = cons_iter(param_names)
             required_param_count = 0
             optional_param_count = 0
@@ -257,30 +447,113 @@ class Program:
                 cfg.error(procedure_type, "takes at most", max_name_count,
                           "arguments, got", arg_count)
                 raise TypeError
-        elif isinstance(param_names, str):
-            # Single name, bind entire arglist to it
-            arglist_name = param_names
-            if arglist_name in self.global_names:
-                cfg.warn(procedure_type, "parameter name shadows global name",
-                         arglist_name)
-            if procedure_type == "function":
-                # Repackage arglist into nested tuples and assign
-                args = nil
-                for arg in reversed(arguments):
-                    args = (arg, args)
-                namespace[arglist_name] = args
-            elif procedure_type == "macro":
-                # Quote arglist and assign
-                namespace[arglist_name] = ("q", (arguments, ()))
-            else:
-                # Code should never get here
-                raise NotImplementedError("procedure_type should be either "
-                                          "function or macro")
         else:
             cfg.error("parameters must either be name or list of names,",
                       "not", self.asl_type(param_names))
             raise TypeError
 
+    def binding_plan(self, param_names, body, procedure_type):
+        """Return the binding plan for a function's parameter list, or None.
+
+The plan is worked out the first time the function or macro with these
+parameters and this body is called; this is also when parameter names
+that shadow global names are warned about, once for each definition.
+(Two definitions can share a parameter list object, as when it's a
+single name, or when hash-consing is on, so the body is part of the
+key.)
+"""
+        key = (id(param_names), id(body), procedure_type)
+        entry = self.binding_plans.get(key)
+        if entry is not None:
+            return entry[2]
+        plan = binding.make_plan(param_names)
+        if plan is not None:
+            for name in plan.names():
+                if name in self.global_names:
+                    cfg.warn(procedure_type, "parameter name shadows",
+                             "global name", name)
+        # Keep references to the parameter list and body, so that their
+        # ids aren't reused while the entry exists
+        remember(self.binding_plans, key, (param_names, body, plan))
+        return plan
+
+    def apply(self, function, raw_args, top_level=False, strict=False):
+        """Evaluate a call, given the evaluated head and the raw args.
+
+If strict is true, the value of the call is needed right away, so a call
+of a user-defined function is made now, rather than deferred.
+"""
+        # Eliminate any macro calls, including <if> and <eval>
+        try:
+            function, raw_args = self.resolve_macros(function, raw_args)
+        except TypeError:
+            # resolve_macros encountered an error condition (it
+            # already gave the error message)
+            return nil
+        function = resolve_thunks(function)
+        if function is None:
+            # After resolving macros, the result was a simple value,
+            # not an s-expression
+            return self.asl_eval(raw_args)
+        elif function and isinstance(function, tuple):
+            # User-defined function or macro
+            if not strict:
+                return self.call(function, raw_args)
+            try:
+                call_data = self.call_data(function, raw_args)
+            except TypeError:
+                # There was a problem with the structure of the supposed
+                # function (call_data already gave the error message)
+                return nil
+            else:
+                return self.run_call(*call_data)
+        elif function in self.builtins:
+            # Builtin function or macro
+            if not self.repl and function.name in repl_macros:
+                cfg.error(builtins[function.name], "can only be used",
+                          "in repl mode")
+                return nil
+            if not top_level and (function.name in top_level_macros
+                                  or function.name in repl_macros):
+                cfg.error(builtins[function.name],
+                          "cannot be called from a user-defined function")
+                return nil
+            if function.is_macro:
+                # Macros receive their args unevaluated
+                args = list(cons_iter(raw_args))
+            elif function.strict_args:
+                # Functions that resolve their args right away
+                args = [self.strict_eval(arg) for arg in cons_iter(raw_args)]
+            else:
+                # Functions receive their args evaluated
+                args = [self.asl_eval(arg) for arg in cons_iter(raw_args)]
+            return self.call_builtin(function, args)
+        else:
+            # Trying to call something other than a builtin or
+            # user-defined function
+            cfg.error(function, "is not a function or macro")
+            return nil
+
+    def call_builtin(self, function, args):
+        """Call a builtin, reporting a wrong number of arguments."""
+        try:
+            return function(*args)
+        except TypeError as err:
+            # Wrong number of arguments to builtin
+            if len(args) < function.min_param_count:
+                cfg.error(builtins[function.name], "takes at least",
+                          function.min_param_count, "arguments, got",
+                          len(args))
+            elif len(args) > function.max_param_count:
+                cfg.error(builtins[function.name], "takes at most",
+                          function.max_param_count, "arguments, got",
+                          len(args))
+            else:
+                # Code should never get here--just re-raise the
+                # TypeError
+                raise
+            return nil
+
     def call(self, function, raw_args):
         """Generate a deferred call of a user-defined function."""
         try:
@@ -290,7 +563,37 @@ class Program:
             # function (call_data already gave the error message)
             return nil
         else:
-            return Thunk(self, *call_data)
+            return self.thunk_type(self, *call_data)
+
+    def run_call(self, param_names, body, arglist):
+        """Make a call of a user-defined function and return its value.
+
+This does what resolving a thunk for the call would, but without
+creating the thunk.
+"""
+        self.thunks_avoided += 1
+        value = self.thunk_type.run(self, param_names, body, arglist)
+        if value is None:
+            # There was an error (which has already been reported)
+            return nil
+        return resolve_thunks(value)
+
+    def strict_eval(self, code):
+        """Evaluate code whose value is needed right away.
+
+This is used for the arguments of builtins that resolve all their
+arguments, the conditions of ifs, and the heads of calls. It gives the
+same value as resolving the result of asl_eval, but calls of
+user-defined functions (that aren't in tail position within some other
+function) are made directly, instead of creating a thunk and resolving
+it straight away. Calls in lazy positions, such as the arguments of
+cons and of user-defined functions, still create thunks.
+"""
+        if code and isinstance(code, tuple):
+            function = self.strict_eval(code[0])
+            return resolve_thunks(self.apply(function, code[1],
+                                             strict=True))
+        return resolve_thunks(self.asl_eval(code))
 
     def resolve_macros(self, head, raw_args):
         """Given head and tail of an expression, rewrite any macros.
@@ -313,7 +616,7 @@ user-defined macros.
                 # If needs exactly three arguments
                 if_args = list(islice(cons_iter(raw_args), 4))
                 if len(if_args) == 3:
-                    condition = self.asl_eval(if_args[0])
+                    condition = self.strict_eval(if_args[0])
                     if self.asl_bool(condition):
                         # Use the true branch
                         expression = if_args[1]
@@ -331,7 +634,7 @@ user-defined macros.
                 # Eval needs exactly one argument
                 eval_args = list(islice(cons_iter(raw_args), 2))
                 if len(eval_args) == 1:
-                    expression = self.asl_eval(eval_args[0])
+                    expression = self.strict_eval(eval_args[0])
                 elif len(eval_args) > 1:
                     cfg.error("eval takes 1 argument, not more")
                     raise TypeError
@@ -340,23 +643,16 @@ user-defined macros.
                     raise TypeError
             elif is_udef_macro:
                 # The head is a list representing a user-defined macro
-                flag, macro_params, macro_body = cons_iter(head)
-                macro_names = {}
-                try:
-                    self.bind_params(macro_params, raw_args, macro_names)
-                except TypeError:
-                    raise
-                # Substitute the arguments for the parameter names in
-                # the macro body expression
-                expression = self.replace(macro_names,
-                                          resolve_thunks(macro_body))
+                expression = self.macro_cache.get(head, raw_args)
+                if expression is None:
+                    expression = self.expand_macro(head, raw_args)
             expression = resolve_thunks(expression)
             if expression and isinstance(expression, tuple):
                 # The result was a nonempty s-expression which could be
                 # another macro invocation, so set up for another trip
                 # through the loop
                 head, raw_args = expression
-                head = resolve_thunks(self.asl_eval(head))
+                head = self.strict_eval(head)
                 is_udef_macro = self.is_macro(head)
             else:
                 # The result was nil or something other than an
@@ -366,6 +662,32 @@ user-defined macros.
         # no longer a macro--finish its evaluation somewhere else
         return head, raw_args
 
+    def expand_macro(self, macro, raw_args):
+        """Expand a call to a user-defined macro.
+
+The expansion is added to the macro cache, unless it could come out
+differently next time: default values of macro parameters are
+evaluated, and warnings given during expansion should be given again.
+"""
+        flag, macro_params, macro_body = cons_iter(macro)
+        warning_count = cfg.warning_count
+        macro_names = {}
+        # If binding the args fails, bind_params gives the error message
+        # and raises TypeError, which the caller handles
+        self.bind_params(macro_params, macro_body, raw_args, macro_names)
+        # Substitute the arguments for the parameter names in the macro
+        # body expression
+        expression = self.replace(macro_names, resolve_thunks(macro_body))
+        if self.hash_cons:
+            expression = hashcons.intern(expression)
+        macro_params = resolve_thunks(macro_params)
+        has_defaults = isinstance(macro_params, tuple) and any(
+            isinstance(resolve_thunks(param), tuple)
+            for param in cons_iter(macro_params))
+        if not has_defaults and cfg.warning_count == warning_count:
+            self.macro_cache.put(macro, raw_args, expression)
+        return expression
+
     def is_macro(self, expression):
         """Does an expression represent a user-defined macro?"""
         expression = resolve_thunks(expression)
@@ -426,6 +748,10 @@ Names that aren't in bindings are left untouched.
         if isinstance(tail, tuple) or isinstance(tail, Thunk):
             # TODO: do we need to resolve a tail thunk one level to
             # make sure it's a list?
+            if self.hash_cons:
+                cell = hashcons.cons(head, tail)
+                if cell is not None:
+                    return cell
             return (head, tail)
         else:
             cfg.error("cannot cons to", self.asl_type(tail), "in Appleseed")
@@ -565,6 +891,9 @@ Names that aren't in bindings are left untouched.
         if identical(arg1, arg2):
             # Two identical values or thunks
             return True
+        elif hashcons.is_interned(arg1) and hashcons.is_interned(arg2):
+            # Two different interned lists, which can't be equal
+            return False
         arg1 = resolve_thunks(arg1)
         arg2 = resolve_thunks(arg2)
         while isinstance(arg1, tuple) and isinstance(arg2, tuple):
@@ -591,62 +920,8 @@ Names that aren't in bindings are left untouched.
     def asl_eval(self, code, top_level=False):
         if code and isinstance(code, tuple):
             # A function/macro call
-            function = self.asl_eval(code[0])
-            raw_args = code[1]
-            # Eliminate any macro calls, including <if> and <eval>
-            try:
-                function, raw_args = self.resolve_macros(function, raw_args)
-            except TypeError:
-                # resolve_macros encountered an error condition (it
-                # already gave the error message)
-                return nil
-            function = resolve_thunks(function)
-            if function is None:
-                # After resolving macros, the result was a simple
-                # value, not an s-expression
-                code = raw_args
-            elif function and isinstance(function, tuple):
-                # User-defined function or macro
-                return self.call(function, raw_args)
-            elif function in self.builtins:
-                # Builtin function or macro
-                if not self.repl and function.name in repl_macros:
-                    cfg.error(builtins[function.name], "can only be used",
-                              "in repl mode")
-                    return nil
-                if not top_level and (function.name in top_level_macros
-                                      or function.name in repl_macros):
-                    cfg.error(builtins[function.name],
-                              "cannot be called from a user-defined function")
-                    return nil
-                if function.is_macro:
-                    # Macros receive their args unevaluated
-                    args = list(cons_iter(raw_args))
-                else:
-                    # Functions receive their args evaluated
-                    args = [self.asl_eval(arg) for arg in cons_iter(raw_args)]
-                try:
-                    return function(*args)
-                except TypeError as err:
-                    # Wrong number of arguments to builtin
-                    if len(args) < function.min_param_count:
-                        cfg.error(builtins[function.name], "takes at least",
-                                  function.min_param_count, "arguments, got",
-                                  len(args))
-                    elif len(args) > function.max_param_count:
-                        cfg.error(builtins[function.name], "takes at most",
-                                  function.max_param_count, "arguments, got",
-                                  len(args))
-                    else:
-                        # Code should never get here--just re-raise
-                        # the TypeError
-                        raise
-                    return nil
-            else:
-                # Trying to call something other than a builtin or
-                # user-defined function
-                cfg.error(function, "is not a function or macro")
-                return nil
+            function = self.strict_eval(code[0])
+            return self.apply(function, code[1], top_level)
         if code == nil:
             # Nil evaluates to itself
             return nil
@@ -656,12 +931,17 @@ Names that aren't in bindings are left untouched.
                 return self.local_names[code]
             elif code in self.global_names:
                 return self.global_names[code]
+            elif self.autoload(code):
+                # The name is defined by a library module that hadn't
+                # been loaded yet
+                return self.global_names[code]
             else:
                 cfg.error("referencing undefined name", code)
                 return nil
-        elif (isinstance(code, int) or isinstance(code, dict)
+        elif (isinstance(code, int) or isinstance(code, Object)
+              or isinstance(code, HashedCollection)
               or code in self.builtins):
-            # Int, Bool, Object, or Builtin evaluates to itself
+            # Int, Bool, Object, Set, Map, or Builtin evaluates to itself
             return code
         else:
             # Code should never get here
@@ -681,8 +961,12 @@ Names that aren't in bindings are left untouched.
             return "String"
         elif isinstance(value, tuple):
             return "List"
-        elif isinstance(value, dict):
+        elif isinstance(value, Object):
             return "Object"
+        elif isinstance(value, Set):
+            return "Set"
+        elif isinstance(value, Map):
+            return "Map"
         elif value in self.builtins:
             return "Builtin"
         else:
@@ -733,7 +1017,7 @@ Names that aren't in bindings are left untouched.
                 result = cfg.TOKEN_DELIMITER + result + cfg.TOKEN_DELIMITER
             else:
                 result = value
-        elif isinstance(value, dict):
+        elif isinstance(value, Object):
             # Object
             result = "{"
             if "type" in value:
@@ -750,6 +1034,12 @@ Names that aren't in bindings are left untouched.
                     result += "(%s %s)" % (self.asl_repr(property_name),
                                            self.asl_repr(property_value))
             result += "}"
+        elif isinstance(value, Set):
+            result = "#set{%s}" % " ".join(map(self.asl_repr, value.items()))
+        elif isinstance(value, Map):
+            result = "#map{%s}" % " ".join("(%s %s)" % (self.asl_repr(key),
+                                                        self.asl_repr(item))
+                                           for key, item in value.items())
         elif value in self.builtins:
             # One of the builtin functions or macros
             result = ("<builtin %s %s>"
@@ -765,11 +1055,24 @@ Names that aren't in bindings are left untouched.
     @no_thunks
     def asl_str(self, value):
         if isinstance(value, tuple):
-            result = ""
+            if type(value) is CharList:
+                # Made by chars and not changed since: it is still part
+                # of a string
+                return value.string()
+            elif type(value) is ArrayList:
+                # All the codes are there already; if they are all
+                # valid, convert them in one go
+                try:
+                    return "".join(map(chr, value.values()))
+                except (TypeError, ValueError):
+                    # Go through them one at a time to give the right
+                    # errors and warnings
+                    pass
+            chars = []
             for char_code in cons_iter(value):
                 if isinstance(char_code, int):
                     try:
-                        result += chr(char_code)
+                        chars.append(chr(char_code))
                     except ValueError:
                         # Can't convert this number to a character
                         cfg.warn("cannot convert", char_code, "to character")
@@ -778,7 +1081,7 @@ Names that aren't in bindings are left untouched.
                     cfg.error("argument of str must be list of Ints, not of",
                               self.asl_type(char_code))
                     return nil
-            return result
+            return "".join(chars)
         else:
             cfg.error("argument of str must be list of Ints, not",
                       self.asl_type(value),
@@ -790,10 +1093,8 @@ Names that aren't in bindings are left untouched.
     @no_thunks
     def asl_chars(self, value):
         if isinstance(value, str):
-            result = nil
-            for char in reversed(value):
-                result = (ord(char), result)
-            return result
+            # The codes are worked out as they are used
+            return CharList(value) if value else nil
         else:
             cfg.error("argument of chars must be String, not",
                       self.asl_type(value))
@@ -803,17 +1104,222 @@ Names that aren't in bindings are left untouched.
     @params(1)
     @no_thunks
     def asl_bool(self, value):
-        return value not in (0, False, nil, "", {})
+        value_type = type(value)
+        if value_type is Object or value_type is Set or value_type is Map:
+            # Only empty ones are falsey
+            return len(value) > 0
+        return value not in (0, False, nil, "")
+
+    @function
+    @params(0, "variadic")
+    @no_thunks
+    def asl_hash_set(self, *values):
+        result = EMPTY_SET
+        for value in values:
+            result = result.insert(value)
+        return result
+
+    @function
+    @params(0, "variadic")
+    @no_thunks
+    def asl_hash_map(self, *keys_and_values):
+        if len(keys_and_values) % 2:
+            cfg.error("hash-map takes keys and values in pairs, not",
+                      len(keys_and_values), "arguments")
+            return nil
+        result = EMPTY_MAP
+        for index in range(0, len(keys_and_values), 2):
+            result = result.insert(keys_and_values[index],
+                                   keys_and_values[index + 1])
+        return result
+
+    @function
+    @params(1)
+    @no_thunks
+    def asl_to_set(self, value):
+        if isinstance(value, tuple):
+            result = EMPTY_SET
+            for item in cons_iter(value):
+                result = result.insert(item)
+            return result
+        elif isinstance(value, Set):
+            return value
+        elif isinstance(value, Map):
+            return value.key_set()
+        else:
+            cfg.error("cannot convert", self.asl_type(value), "to Set")
+            return nil
+
+    @function
+    @params(1)
+    @no_thunks
+    def asl_to_map(self, value):
+        if isinstance(value, tuple):
+            # A list of (key value) pairs
+            result = EMPTY_MAP
+            for pair in cons_iter(value):
+                pair = resolve_thunks(pair)
+                if isinstance(pair, tuple):
+                    key_and_value = list(islice(cons_iter(pair), 3))
+                else:
+                    # Not a list at all
+                    key_and_value = []
+                if len(key_and_value) != 2:
+                    cfg.error("items of a list converted to Map must be",
+                              "(key value) lists")
+                    return nil
+                result = result.insert(*key_and_value)
+            return result
+        elif isinstance(value, Map):
+            return value
+        else:
+            cfg.error("cannot convert", self.asl_type(value), "to Map")
+            return nil
+
+    @function
+    @params(1)
+    @no_thunks
+    def asl_to_list(self, value):
+        if isinstance(value, Set):
+            return build_list(value.items())
+        elif isinstance(value, Map):
+            return build_list([(key, (item_value, nil))
+                               for key, item_value in value.items()])
+        elif isinstance(value, tuple):
+            return value
+        else:
+            cfg.error("cannot convert", self.asl_type(value), "to List")
+            return nil
+
+    @function
+    @params(1)
+    @no_thunks
+    def asl_size(self, collection):
+        if isinstance(collection, HashedCollection):
+            return len(collection)
+        else:
+            cfg.error("cannot get size of", self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    @no_thunks
+    def asl_set_insert(self, collection, value):
+        if isinstance(collection, Set):
+            return collection.insert(value)
+        else:
+            cfg.error("set-insert takes a Set, not", self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    @no_thunks
+    def asl_set_remove(self, collection, value):
+        if isinstance(collection, Set):
+            return collection.remove(value)
+        else:
+            cfg.error("set-remove takes a Set, not", self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    @no_thunks
+    def asl_set_contains(self, collection, value):
+        if isinstance(collection, Set):
+            return value in collection
+        else:
+            cfg.error("set-contains? takes a Set, not",
+                      self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    @no_thunks
+    def asl_set_union(self, collection1, collection2):
+        if isinstance(collection1, Set) and isinstance(collection2, Set):
+            return collection1.union(collection2)
+        else:
+            cfg.error("set-union takes two Sets, not",
+                      self.asl_type(collection1), "and",
+                      self.asl_type(collection2))
+            return nil
+
+    @function
+    @params(3)
+    @no_thunks
+    def asl_map_insert(self, collection, key, value):
+        if isinstance(collection, Map):
+            return collection.insert(key, value)
+        else:
+            cfg.error("map-insert takes a Map, not", self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    @no_thunks
+    def asl_map_remove(self, collection, key):
+        if isinstance(collection, Map):
+            return collection.remove(key)
+        else:
+            cfg.error("map-remove takes a Map, not", self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2, 3)
+    @no_thunks
+    def asl_map_get(self, collection, key, default=None):
+        if isinstance(collection, Map):
+            value = collection.get(key)
+            if value is not None:
+                return value
+            elif default is not None:
+                # The Map doesn't have the key; return the default
+                # value
+                return default
+            else:
+                cfg.error("map does not have key", self.asl_repr(key))
+                return nil
+        else:
+            cfg.error("map-get takes a Map, not", self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    @no_thunks
+    def asl_map_contains(self, collection, key):
+        if isinstance(collection, Map):
+            return key in collection
+        else:
+            cfg.error("map-contains? takes a Map, not",
+                      self.asl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    @no_thunks
+    def asl_map_union(self, collection1, collection2):
+        if isinstance(collection1, Map) and isinstance(collection2, Map):
+            return collection1.union(collection2)
+        else:
+            cfg.error("map-union takes two Maps, not",
+                      self.asl_type(collection1), "and",
+                      self.asl_type(collection2))
+            return nil
 
     @macro
     @params(2)
     def asl_def(self, name, value):
         if isinstance(name, str):
-            if name in self.global_names:
+            if name in self.global_names or self.autoload(name):
                 cfg.error("name", name, "already in use")
                 return nil
             else:
-                self.global_names[name] = self.asl_eval(value)
+                value = self.asl_eval(value)
+                if (name in self.native_functions
+                        and self.module_paths[-1] == self.library_directory):
+                    # A library function with a native version
+                    self.add_native_version(name, value)
+                self.global_names[name] = value
                 return name
         else:
             cfg.error("cannot define", self.asl_type(name),
@@ -839,13 +1345,13 @@ Names that aren't in bindings are left untouched.
     @macro
     @params("variadic")
     def asl_object(self, *properties):
-        obj = {}
+        obj = EMPTY_OBJECT
         for prop in properties:
             name_value_pair = list(islice(cons_iter(prop), 3))
             if len(name_value_pair) == 2:
                 prop_name, expression = name_value_pair
                 prop_value = self.asl_eval(expression)
-                obj[prop_name] = prop_value
+                obj = obj.with_property(prop_name, prop_value)
                 # TBD: warn when overwriting an existing property?
             elif len(name_value_pair) > 2:
                 cfg.error("(name value) lists in object constructor must have",
@@ -861,7 +1367,7 @@ Names that aren't in bindings are left untouched.
     @params(2)
     def asl_has_property(self, obj, prop_name):
         obj = resolve_thunks(self.asl_eval(obj))
-        if isinstance(obj, dict):
+        if isinstance(obj, Object):
             # TBD: error if prop_name is a list or something?
             return prop_name in obj
         else:
@@ -872,10 +1378,11 @@ Names that aren't in bindings are left untouched.
     @params(2, 3)
     def asl_get_property(self, obj, prop_name, default=None):
         obj = resolve_thunks(self.asl_eval(obj))
-        if isinstance(obj, dict):
-            if prop_name in obj:
+        if isinstance(obj, Object):
+            value = obj.get(prop_name)
+            if value is not None:
                 # The object has this property; return it
-                return obj[prop_name]
+                return value
             elif default is not None:
                 # The object doesn't have the property; return the
                 # default value
@@ -893,16 +1400,17 @@ Names that aren't in bindings are left untouched.
     @params(1, "variadic")
     def asl_copy(self, obj, *new_properties):
         obj = resolve_thunks(self.asl_eval(obj))
-        if isinstance(obj, dict):
+        if isinstance(obj, Object):
             # Create a new Object from this one, possibly with some
-            # properties added or changed
-            new_obj = obj.copy()
+            # properties added or changed; it shares what is unchanged
+            # with the original
+            new_obj = obj
             for prop in new_properties:
                 name_value_pair = list(islice(cons_iter(prop), 3))
                 if len(name_value_pair) == 2:
                     prop_name, expression = name_value_pair
                     prop_value = self.asl_eval(expression)
-                    new_obj[prop_name] = prop_value
+                    new_obj = new_obj.with_property(prop_name, prop_value)
                 elif len(name_value_pair) > 2:
                     cfg.error("(name value) lists in object copy must have",
                               "2 elements, not more")
@@ -945,7 +1453,7 @@ Names that aren't in bindings are left untouched.
                     # calls from within the module
                     self.module_paths.append(module_directory)
                     # Execute the module code
-                    self.execute(module_code)
+                    self.execute_file(abspath, module_code)
                     # Put everything back the way it was before loading
                     self.module_paths.pop()
                     self.inform("Loaded", module)
@@ -964,7 +1472,10 @@ Names that aren't in bindings are left untouched.
     @macro
     @params(0)
     def asl_restart(self):
-        self.__init__(repl=self.repl, max_list_items=self.max_list_items)
+        self.__init__(repl=self.repl, max_list_items=self.max_list_items,
+                      snapshot=self.snapshot, lazy_stdlib=self.lazy_stdlib,
+                      engine=self.engine, hash_cons=self.hash_cons,
+                      native_lib=self.native_lib)
         self.inform("Restarting...")
         return None
 
@@ -0,0 +1,264 @@
+# Each level of the trie is indexed by this many bits of a key's hash
+LEVEL_BITS = 5
+LEVEL_MASK = (1 << LEVEL_BITS) - 1
+
+# Hashes are cut down to this many bits; keys whose hashes are the same
+# all the way down end up together in a CollisionNode
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+# In the entries of a BitmapNode, marks a slot that holds a child node
+# instead of a key and its value
+SUBNODE = object()
+
+
+def key_hash(key):
+    return hash(key) & HASH_MASK
+
+
+if hasattr(int, "bit_count"):
+    def slot_index(bitmap, bit):
+        """Return where the slot for bit is, among the slots in bitmap."""
+        return 2 * (bitmap & (bit - 1)).bit_count()
+else:
+    # Before Python 3.10
+    def slot_index(bitmap, bit):
+        """Return where the slot for bit is, among the slots in bitmap."""
+        return 2 * bin(bitmap & (bit - 1)).count("1")
+
+
+class BitmapNode:
+    """A node of the trie, with a slot for each of up to 32 hash values.
+
+The bitmap says which of the 32 values (taken from LEVEL_BITS bits of
+the hash, depending on the level) have a slot. The entries are a flat
+tuple with two elements per slot: either a key and its value, or
+SUBNODE and a node one level down that holds all the keys for that
+slot.
+"""
+    __slots__ = ("bitmap", "entries")
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+    def with_item(self, shift, hash_value, key, value):
+        """Return a node with key set to value, and whether key is new.
+
+The node itself is returned if nothing changes.
+"""
+        bit = 1 << ((hash_value >> shift) & LEVEL_MASK)
+        index = slot_index(self.bitmap, bit)
+        entries = self.entries
+        if not self.bitmap & bit:
+            entries = entries[:index] + (key, value) + entries[index:]
+            return BitmapNode(self.bitmap | bit, entries), True
+        entry_key = entries[index]
+        entry_value = entries[index + 1]
+        if entry_key is SUBNODE:
+            child, added = entry_value.with_item(shift + LEVEL_BITS,
+                                                 hash_value, key, value)
+            if child is entry_value:
+                return self, False
+            entries = entries[:index + 1] + (child,) + entries[index + 2:]
+            return BitmapNode(self.bitmap, entries), added
+        elif entry_key is key or entry_key == key:
+            if entry_value is value:
+                return self, False
+            entries = entries[:index + 1] + (value,) + entries[index + 2:]
+            return BitmapNode(self.bitmap, entries), False
+        # Another key already has this slot; both go down a level
+        child = pair_node(shift + LEVEL_BITS,
+                          key_hash(entry_key), entry_key, entry_value,
+                          hash_value, key, value)
+        entries = entries[:index] + (SUBNODE, child) + entries[index + 2:]
+        return BitmapNode(self.bitmap, entries), True
+
+    def without(self, shift, hash_value, key):
+        """Return a node without key, or None if that leaves it empty.
+
+The node itself is returned if key isn't there.
+"""
+        bit = 1 << ((hash_value >> shift) & LEVEL_MASK)
+        if not self.bitmap & bit:
+            return self
+        index = slot_index(self.bitmap, bit)
+        entries = self.entries
+        entry_key = entries[index]
+        entry_value = entries[index + 1]
+        if entry_key is SUBNODE:
+            child = entry_value.without(shift + LEVEL_BITS, hash_value, key)
+            if child is entry_value:
+                return self
+            elif child is None:
+                pass
+            elif (type(child) is BitmapNode and len(child.entries) == 2
+                    and child.entries[0] is not SUBNODE):
+                # Only one key is left down there, so it can move up
+                entries = entries[:index] + child.entries + entries[index + 2:]
+                return BitmapNode(self.bitmap, entries)
+            else:
+                entries = (entries[:index + 1] + (child,)
+                           + entries[index + 2:])
+                return BitmapNode(self.bitmap, entries)
+        elif not (entry_key is key or entry_key == key):
+            return self
+        if self.bitmap == bit:
+            return None
+        return BitmapNode(self.bitmap ^ bit,
+                          entries[:index] + entries[index + 2:])
+
+    def items(self):
+        entries = self.entries
+        for index in range(0, len(entries), 2):
+            if entries[index] is SUBNODE:
+                yield from entries[index + 1].items()
+            else:
+                yield entries[index], entries[index + 1]
+
+
+class CollisionNode:
+    """A node at the bottom of the trie, for keys whose hashes are equal.
+
+The entries are a flat tuple of keys and their values, which are
+searched one by one.
+"""
+    __slots__ = ("entries",)
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def find(self, key):
+        entries = self.entries
+        for index in range(0, len(entries), 2):
+            if entries[index] is key or entries[index] == key:
+                return index
+        return None
+
+    def with_item(self, shift, hash_value, key, value):
+        entries = self.entries
+        index = self.find(key)
+        if index is None:
+            return CollisionNode(entries + (key, value)), True
+        elif entries[index + 1] is value:
+            return self, False
+        entries = entries[:index + 1] + (value,) + entries[index + 2:]
+        return CollisionNode(entries), False
+
+    def without(self, shift, hash_value, key):
+        entries = self.entries
+        index = self.find(key)
+        if index is None:
+            return self
+        entries = entries[:index] + entries[index + 2:]
+        if len(entries) == 2:
+            # A node with one key in it, which the parent can take in
+            return BitmapNode(1, entries)
+        return CollisionNode(entries)
+
+    def items(self):
+        entries = self.entries
+        for index in range(0, len(entries), 2):
+            yield entries[index], entries[index + 1]
+
+
+def pair_node(shift, hash1, key1, value1, hash2, key2, value2):
+    """Return a node holding two keys that have the same slot above it."""
+    if shift >= HASH_BITS:
+        return CollisionNode((key1, value1, key2, value2))
+    bit1 = 1 << ((hash1 >> shift) & LEVEL_MASK)
+    bit2 = 1 << ((hash2 >> shift) & LEVEL_MASK)
+    if bit1 == bit2:
+        child = pair_node(shift + LEVEL_BITS,
+                          hash1, key1, value1, hash2, key2, value2)
+        return BitmapNode(bit1, (SUBNODE, child))
+    elif bit1 < bit2:
+        return BitmapNode(bit1 | bit2, (key1, value1, key2, value2))
+    else:
+        return BitmapNode(bit1 | bit2, (key2, value2, key1, value1))
+
+
+EMPTY_NODE = BitmapNode(0, ())
+
+
+class Hamt:
+    """An immutable hash map: a hash array mapped trie.
+
+Keys are found by their hash, five bits of it at each level of the
+trie, so a lookup visits at most a handful of small nodes however many
+keys there are. with_item and without return a new Hamt and leave this
+one as it was; the new one shares every node except those on the path
+to the key, so an update costs O(log n) time and memory, not a copy of
+the whole map.
+
+Keys can be any hashable Python values.
+"""
+    __slots__ = ("root", "size")
+
+    def __init__(self, items=(), root=EMPTY_NODE, size=0):
+        self.root = root
+        self.size = size
+        for key, value in items:
+            self.root, added = self.root.with_item(0, key_hash(key),
+                                                   key, value)
+            self.size += added
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __contains__(self, key):
+        return self.get(key, SUBNODE) is not SUBNODE
+
+    def __iter__(self):
+        for key, value in self.root.items():
+            yield key
+
+    def __reduce__(self):
+        return (Hamt, (list(self.items()),))
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if key isn't there."""
+        # (This is the most used operation, so it is all done here)
+        hash_value = hash(key) & HASH_MASK
+        node = self.root
+        while type(node) is BitmapNode:
+            bitmap = node.bitmap
+            bit = 1 << (hash_value & LEVEL_MASK)
+            if not bitmap & bit:
+                return default
+            index = slot_index(bitmap, bit)
+            entry_key = node.entries[index]
+            if entry_key is SUBNODE:
+                node = node.entries[index + 1]
+                hash_value >>= LEVEL_BITS
+            elif entry_key is key or entry_key == key:
+                return node.entries[index + 1]
+            else:
+                return default
+        index = node.find(key)
+        if index is None:
+            return default
+        return node.entries[index + 1]
+
+    def with_item(self, key, value):
+        """Return a Hamt with key set to value."""
+        root, added = self.root.with_item(0, key_hash(key), key, value)
+        if root is self.root:
+            return self
+        return Hamt(root=root, size=self.size + added)
+
+    def without(self, key):
+        """Return a Hamt without key."""
+        root = self.root.without(0, key_hash(key), key)
+        if root is self.root:
+            return self
+        elif root is None:
+            root = EMPTY_NODE
+        return Hamt(root=root, size=self.size - 1)
+
+    def items(self):
+        """Iterate over the keys and values, in no particular order."""
+        return self.root.items()
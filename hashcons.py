@@ -0,0 +1,169 @@
+
+import sys
+
+
+# The table starts being swept for unused cells once it has this many
+NEW_TABLE_SWEEP_SIZE = 1 << 14
+
+
+class InternTable:
+    """A table of hash-consed list cells.
+
+Each interned cell is a 2-tuple whose head and tail are atoms (names,
+strings, ints, bools, nil) or other interned cells, and no two interned
+cells have the same structure. So two interned lists are identical
+exactly when they are the same object, and can be compared in constant
+time.
+
+A cell is looked up by a key made from its head's and tail's keys: an
+atom's key is its type and value, and an interned cell's key is its
+id. This makes the key of every cell constant-size, in effect a hash
+computed once per cell.
+
+Tuples can't be weakly referenced, so the table holds strong
+references to its cells, and once it is big enough, cells that nothing
+else refers to any more are swept out of it from time to time. Each
+sweep takes time in proportion to the size of the table, and the table
+has to double in size before the next one, so the sweeps take constant
+time per cell made.
+"""
+    def __init__(self):
+        # Key -> cell
+        self.cells = {}
+        # Id of cell -> cell
+        self.by_id = {}
+        self.sweep_size = NEW_TABLE_SWEEP_SIZE
+
+    def is_interned(self, value):
+        return self.by_id.get(id(value)) is value
+
+    def key(self, value):
+        """Return the key of an atom or interned cell, or None."""
+        value_type = type(value)
+        if value_type is str or value_type is int or value_type is bool:
+            return (value_type, value)
+        elif value_type is tuple:
+            if not value:
+                # Nil
+                return (tuple,)
+            elif self.by_id.get(id(value)) is value:
+                return id(value)
+        # Anything else (thunks, objects, builtins, cells that aren't
+        # interned) can't be part of an interned cell
+        return None
+
+    def cons(self, head, tail):
+        """Return the interned cell for (head, tail).
+
+If head or tail can't be part of an interned cell, return None.
+"""
+        head_key = self.key(head)
+        if head_key is None:
+            return None
+        tail_key = self.key(tail)
+        if tail_key is None:
+            return None
+        key = (head_key, tail_key)
+        cell = self.cells.get(key)
+        if cell is None:
+            if len(self.cells) >= self.sweep_size:
+                self.sweep()
+            cell = (head, tail)
+            self.cells[key] = cell
+            self.by_id[id(cell)] = cell
+        return cell
+
+    def intern(self, value):
+        """Return a version of a value with its lists interned.
+
+Lists (and sublists) that contain anything that can't be interned are
+rebuilt out of interned parts as far as possible, but are not
+interned themselves.
+"""
+        if not isinstance(value, tuple) or not value:
+            return value
+        # Id of an original cell -> its replacement
+        results = {}
+        stack = [value]
+        while stack:
+            cell = stack[-1]
+            if id(cell) in results:
+                stack.pop()
+                continue
+            if len(cell) != 2:
+                # Not a cons cell; leave it as it is
+                results[id(cell)] = cell
+                stack.pop()
+                continue
+            head, tail = cell
+            # Do the tail and head first
+            pending = False
+            for part in (head, tail):
+                if (isinstance(part, tuple) and part
+                        and id(part) not in results):
+                    stack.append(part)
+                    pending = True
+            if pending:
+                continue
+            stack.pop()
+            if isinstance(head, tuple) and head:
+                head = results[id(head)]
+            if isinstance(tail, tuple) and tail:
+                tail = results[id(tail)]
+            new_cell = self.cons(head, tail)
+            if new_cell is None:
+                if head is cell[0] and tail is cell[1]:
+                    new_cell = cell
+                else:
+                    new_cell = (head, tail)
+            results[id(cell)] = new_cell
+        return results[id(value)]
+
+    def sweep(self):
+        """Drop the cells that are only referred to by the table.
+
+Dropping a cell can leave its head and tail referred to only by the
+table too, so they are checked again once it has gone; each cell is
+checked once, plus once for each interned cell dropped that contained
+it. Where reference counts aren't available, every cell is dropped.
+(That is always safe: a dropped cell is still a valid list, just not
+an interned one, and is compared structurally instead.)
+"""
+        getrefcount = getattr(sys, "getrefcount", None)
+        if getrefcount is None:
+            self.cells.clear()
+            self.by_id.clear()
+            return
+        cells = self.cells
+        by_id = self.by_id
+        # Ids, rather than cells, so that the worklist adds no
+        # references of its own
+        worklist = list(by_id)
+        while worklist:
+            cell = by_id.get(worklist.pop())
+            # References held by cells and by_id, by cell, and by
+            # getrefcount's argument
+            if cell is None or getrefcount(cell) > 4:
+                continue
+            head, tail = cell
+            del cells[(self.key(head), self.key(tail))]
+            del by_id[id(cell)]
+            for part in (head, tail):
+                if type(part) is tuple and by_id.get(id(part)) is part:
+                    worklist.append(id(part))
+            # Let go of the cell, so that its head and tail lose the
+            # references it held
+            del cell, head, tail, part
+        # Sweep again once the table has doubled in size
+        self.sweep_size = max(NEW_TABLE_SWEEP_SIZE, 2 * len(self.cells))
+
+    def __len__(self):
+        return len(self.cells)
+
+
+# The table is shared by all environments, since interned values don't
+# depend on any of them
+table = InternTable()
+is_interned = table.is_interned
+cons = table.cons
+intern = table.intern
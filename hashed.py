@@ -0,0 +1,174 @@
+from hamt import Hamt
+from objects import Object
+from thunk import resolve_thunks, cons_iter
+
+
+def value_key(value):
+    """Return a hashable Python value standing for an Appleseed value.
+
+Two values have equal keys exactly when equal? says that they are
+equal: lists are compared item by item however they are stored,
+Objects, Sets, and Maps by their contents, and Bools are kept apart
+from Ints. Thunks are resolved, including those inside lists, so a list
+that is used as a key has to be finite.
+"""
+    value = resolve_thunks(value)
+    value_type = type(value)
+    if value_type is int or value_type is str:
+        return value
+    elif value_type is bool:
+        return ("Bool", value)
+    elif isinstance(value, tuple):
+        return ("List",) + tuple(map(value_key, cons_iter(value)))
+    elif value_type is Object:
+        return ("Object", frozenset((value_key(name), value_key(prop_value))
+                                    for name, prop_value in value.items()))
+    elif value_type is Set:
+        return ("Set", frozenset(value.entries))
+    elif value_type is Map:
+        return ("Map", frozenset((key, value_key(item[1]))
+                                 for key, (order, item)
+                                 in value.entries.items()))
+    else:
+        # A builtin
+        return ("Builtin", value.name)
+
+
+class HashedCollection:
+    """What Sets and Maps have in common.
+
+The items are kept in a Hamt (see hamt.py) under their keys, as given
+by value_key, so finding one takes the same time however many there
+are; and since a Hamt is persistent, adding or removing one makes a new
+collection in O(log n) time and memory, sharing the rest with the old.
+
+As with Objects, each item is stored along with its place in the order
+that items were added, which is the order they are listed in.
+"""
+    __slots__ = ("entries", "next_order")
+
+    def __init__(self, entries=Hamt(), next_order=0):
+        # Each key maps to (order, item)
+        self.entries = entries
+        self.next_order = next_order
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        return len(self.entries) > 0
+
+    def __eq__(self, other):
+        # Equal to a collection of the same type with the same contents
+        if type(other) is not type(self):
+            return NotImplemented
+        return value_key(self) == value_key(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    # Like Objects, these can't be hashed (value_key has to be used)
+    __hash__ = None
+
+    def __reduce__(self):
+        return (type(self), (self.entries, self.next_order))
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.items())
+
+    def with_entry(self, key, item, replace):
+        """Return a copy with item added under key.
+
+If there is already an item under key, it keeps its place, and is only
+replaced by the new one if replace is true.
+"""
+        entries = self.entries
+        entry = entries.get(key)
+        if entry is None:
+            return type(self)(entries.with_item(key, (self.next_order, item)),
+                              self.next_order + 1)
+        elif not replace or entry[1] is item:
+            return self
+        return type(self)(entries.with_item(key, (entry[0], item)),
+                          self.next_order)
+
+    def without_key(self, key):
+        """Return a copy without the item under key."""
+        entries = self.entries.without(key)
+        if entries is self.entries:
+            return self
+        return type(self)(entries, self.next_order)
+
+    def ordered_entries(self):
+        """Return a list of the keys and their items, in order."""
+        entries = sorted(self.entries.items(),
+                         key=lambda key_and_entry: key_and_entry[1][0])
+        return [(key, item) for key, (order, item) in entries]
+
+    def items(self):
+        """Return a list of the items, in order."""
+        return [item for key, item in self.ordered_entries()]
+
+    def union(self, other):
+        """Return a copy with the items of other added, after its own."""
+        result = self
+        for key, item in other.ordered_entries():
+            result = result.with_entry(key, item, self.union_replaces)
+        return result
+
+
+class Set(HashedCollection):
+    """An Appleseed Set: an immutable collection of distinct values."""
+    __slots__ = ()
+    # A value that is in both Sets of a union is kept from the first
+    union_replaces = False
+
+    def __contains__(self, value):
+        return value_key(value) in self.entries
+
+    def insert(self, value):
+        # Adding a value that is already there leaves the Set as it was
+        return self.with_entry(value_key(value), value, replace=False)
+
+    def remove(self, value):
+        return self.without_key(value_key(value))
+
+
+class Map(HashedCollection):
+    """An Appleseed Map: an immutable collection of keys and their values.
+
+The items are (key, value) pairs, keys being Appleseed values of any
+type.
+"""
+    __slots__ = ()
+    # Where both Maps of a union have a key, the value from the second
+    # is used
+    union_replaces = True
+
+    def __contains__(self, key):
+        return value_key(key) in self.entries
+
+    def get(self, key, default=None):
+        entry = self.entries.get(value_key(key))
+        if entry is None:
+            return default
+        return entry[1][1]
+
+    def insert(self, key, value):
+        return self.with_entry(value_key(key), (key, value), replace=True)
+
+    def remove(self, key):
+        return self.without_key(value_key(key))
+
+    def key_set(self):
+        """Return a Set of the keys, in the same order."""
+        entries = Hamt((key, (order, item[0]))
+                       for key, (order, item) in self.entries.items())
+        return Set(entries, self.next_order)
+
+
+EMPTY_SET = Set()
+EMPTY_MAP = Map()
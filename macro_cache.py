@@ -0,0 +1,55 @@
+
+from collections import OrderedDict
+
+
+class MacroCache:
+    """Remembers the expansions of user-defined macro calls.
+
+Appleseed code can't be modified, so expanding the same macro with the
+same (unevaluated) arguments always gives the same expression. Entries
+are keyed on the identity of the macro and of the argument list at the
+call site. Each entry keeps references to both, so that their ids
+can't be reused while it is in the cache.
+
+The cache holds at most maxsize entries; when it is full, the least
+recently used entry is dropped.
+"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, macro, raw_args):
+        """Return the cached expansion of a macro call, or None."""
+        key = (id(macro), id(raw_args))
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, macro, raw_args, expansion):
+        """Add the expansion of a macro call to the cache."""
+        if self.maxsize <= 0:
+            return
+        key = (id(macro), id(raw_args))
+        self.entries[key] = (macro, raw_args, expansion)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            # Drop the least recently used entry
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return "MacroCache(%d/%d entries, %d hits, %d misses)" % (
+            len(self.entries), self.maxsize, self.hits, self.misses)
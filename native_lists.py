@@ -0,0 +1,616 @@
+
+from cfg import nil
+from arraylist import ArrayList
+from decorators import function, params
+from natives import NativeSupport, NativeThunk, NATIVE_CHUNK_SIZE, settled
+from thunk import Thunk, resolve_thunks
+from streams import (Stream, RangeSource, CycleSource, END, resolve_stream,
+                     MapItems, FilterItems, TakeItems, TakeWhileItems,
+                     DropWhileItems)
+
+
+# Native versions of functions from lib/lists.asl and
+# lib/metafunctions.asl
+# Key = implementation name; value = name of the library function
+
+builtins = {"native_length": "length",
+            "native_nth": "nth",
+            "native_last": "last",
+            "native_take": "take",
+            "native_cycle": "cycle",
+            "native_drop": "drop",
+            "native_reverse": "reverse",
+            "native_concat": "concat",
+            "native_concat_rest": "_concat",
+            "native_flatten": "flatten",
+            "native_flatten_rest": "_flatten",
+            "native_contains": "contains?",
+            "native_count_occurrences": "count-occurrences",
+            "native_first_index": "first-index",
+            "native_count_up": "count-up",
+            "native_count_down": "count-down",
+            "native_range": "range",
+            "native_repeat_val": "repeat-val",
+            "native_all": "all",
+            "native_any": "any",
+            "native_none": "none",
+            "native_map": "map",
+            "native_filter": "filter",
+            "native_filter_not": "filter-not",
+            "native_take_while": "take-while",
+            "native_drop_while": "drop-while",
+            "native_foldl": "foldl",
+            "native_foldl_rest": "_foldl",
+            }
+
+
+def is_nil(value):
+    return isinstance(value, tuple) and not value
+
+
+class ListNatives(NativeSupport):
+    """Native versions of the list functions in the standard library.
+
+Each one follows the Appleseed definition of the function it stands in
+for step by step; the comments give the Appleseed code where it helps.
+Wherever a list turns out not to be a list, or a number not an Int,
+they call native_fallback with the arguments the Appleseed version
+would have got at that point.
+
+count-up, range, and cycle give Streams (see streams.py), and map,
+filter, filter-not, take, take-while, and drop-while, given a Stream
+that hasn't been started, add a stage to it instead of working through
+its cells one at a time; foldl, given a pure one, runs it.
+"""
+
+    @function
+    @params(2)
+    def native_length(self, ls, accum):
+        ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("length", ls, accum)
+        elif not ls:
+            return accum
+        accum = resolve_thunks(accum)
+        if type(accum) is not int:
+            return self.native_fallback("length", ls, accum)
+        while ls:
+            if isinstance(ls, ArrayList):
+                return accum + ls.length()
+            accum += 1
+            ls = resolve_thunks(ls[1])
+            if not isinstance(ls, tuple):
+                return self.native_fallback("length", ls, accum)
+        return accum
+
+    @function
+    @params(2)
+    def native_nth(self, index, ls):
+        index = resolve_thunks(index)
+        if type(index) is not int:
+            # (Bools aren't Ints, either)
+            return self.native_fallback("nth", index, ls)
+        elif index < 0:
+            return nil
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("nth", index, ls)
+            elif not ls:
+                # The head and tail of nil are nil
+                return nil
+            elif isinstance(ls, ArrayList):
+                item = ls.nth(index)
+                return nil if item is None else item
+            elif not index:
+                return ls[0]
+            index -= 1
+            ls = ls[1]
+
+    @function
+    @params(1)
+    def native_last(self, ls):
+        ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("last", ls)
+        elif not ls:
+            return nil
+        while True:
+            if isinstance(ls, ArrayList):
+                return ls.nth(ls.length() - 1)
+            rest = resolve_thunks(ls[1])
+            if not isinstance(rest, tuple):
+                return self.native_fallback("last", ls)
+            elif not rest:
+                return ls[0]
+            ls = rest
+
+    @function
+    @params(2)
+    def native_take(self, count, ls):
+        ls = resolve_stream(ls)
+        if isinstance(ls, Stream):
+            count = settled(count)
+            if type(count) is int:
+                return ls.with_stage(TakeItems, count)
+        ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("take", count, ls)
+        elif not ls:
+            return nil
+        count = resolve_thunks(count)
+        if type(count) is not int:
+            return self.native_fallback("take", count, ls)
+        elif count <= 0:
+            return nil
+        elif isinstance(ls, ArrayList):
+            # All the items are there already, so the result can be
+            # too
+            return ls.take(count)
+        return (ls[0], NativeThunk(self, self.native_take,
+                                   [count - 1, ls[1]]))
+
+    @function
+    @params(2)
+    def native_cycle(self, ls, partial_ls):
+        ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("cycle", ls, partial_ls)
+        elif not ls:
+            return nil
+        values = self.built_items(ls)
+        if values is None:
+            # The list isn't all there yet; the Appleseed version only
+            # builds as much of it as it needs
+            return self.native_fallback("cycle", ls, partial_ls)
+        partial_ls = resolve_thunks(partial_ls)
+        prefix = (self.built_items(partial_ls)
+                  if isinstance(partial_ls, tuple) else None)
+        if prefix is None:
+            return self.native_fallback("cycle", ls, partial_ls)
+        return Stream(self, CycleSource(tuple(prefix), tuple(values)))
+
+    @function
+    @params(2)
+    def native_drop(self, count, ls):
+        ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("drop", count, ls)
+        elif not ls:
+            return nil
+        count = resolve_thunks(count)
+        if type(count) is not int:
+            return self.native_fallback("drop", count, ls)
+        while count > 0:
+            if isinstance(ls, ArrayList):
+                return ls.drop(count)
+            ls = resolve_thunks(ls[1])
+            count -= 1
+            if not isinstance(ls, tuple):
+                return self.native_fallback("drop", count, ls)
+            elif not ls:
+                return nil
+        return ls
+
+    @function
+    @params(2)
+    def native_reverse(self, ls, accum):
+        ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("reverse", ls, accum)
+        elif not ls:
+            return accum
+        elif not (isinstance(accum, tuple) or isinstance(accum, Thunk)):
+            # Can't cons to accum
+            return self.native_fallback("reverse", ls, accum)
+        cons = self.native_cons
+        while ls:
+            if isinstance(ls, ArrayList):
+                for item in ls.values():
+                    accum = cons(item, accum)
+                return accum
+            accum = cons(ls[0], accum)
+            ls = resolve_thunks(ls[1])
+            if not isinstance(ls, tuple):
+                return self.native_fallback("reverse", ls, accum)
+        return accum
+
+    @function
+    @params(1)
+    def native_concat(self, lists):
+        lists = resolve_thunks(lists)
+        if not isinstance(lists, tuple):
+            return self.native_fallback("concat", lists)
+        elif not lists:
+            return nil
+        rest = resolve_thunks(lists[1])
+        if not isinstance(rest, tuple):
+            return self.native_fallback("concat", lists)
+        elif not rest:
+            return lists[0]
+        return self.native_concat_rest(lists[0], rest)
+
+    @function
+    @params(2)
+    def native_concat_rest(self, ls, lists):
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("_concat", ls, lists)
+            elif ls:
+                return (ls[0], NativeThunk(self, self.native_concat_rest,
+                                           [ls[1], lists]))
+            # Done with ls; go on to the next list in lists
+            lists = resolve_thunks(lists)
+            if not isinstance(lists, tuple):
+                return self.native_fallback("_concat", ls, lists)
+            elif not lists:
+                return nil
+            rest = resolve_thunks(lists[1])
+            if not isinstance(rest, tuple):
+                return self.native_fallback("_concat", ls, lists)
+            elif not rest:
+                return lists[0]
+            ls = lists[0]
+            lists = rest
+
+    @function
+    @params(1)
+    def native_flatten(self, val):
+        value = resolve_thunks(val)
+        if not isinstance(value, tuple):
+            # <val> is not a list--make it into a single-item list
+            return self.native_cons(val, nil)
+        elif not value:
+            return nil
+        return self.native_flatten_rest(self.native_flatten(value[0]),
+                                        value[1])
+
+    @function
+    @params(2)
+    def native_flatten_rest(self, ls, rest):
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("_flatten", ls, rest)
+            elif ls:
+                # <ls> is a nonempty, already flattened list
+                return (ls[0], NativeThunk(self, self.native_flatten_rest,
+                                           [ls[1], rest]))
+            rest = resolve_thunks(rest)
+            if not isinstance(rest, tuple):
+                return self.native_fallback("_flatten", ls, rest)
+            elif not rest:
+                return nil
+            ls = self.native_flatten(rest[0])
+            rest = rest[1]
+
+    @function
+    @params(2)
+    def native_contains(self, ls, item):
+        equal = self.asl_equal
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("contains?", ls, item)
+            elif not ls:
+                return False
+            elif isinstance(ls, ArrayList):
+                return any(equal(value, item) for value in ls.values())
+            elif equal(ls[0], item):
+                return True
+            ls = ls[1]
+
+    @function
+    @params(3)
+    def native_count_occurrences(self, item, ls, count):
+        equal = self.asl_equal
+        # Count isn't looked at until the first time it's incremented
+        count_checked = False
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("count-occurrences", item, ls,
+                                            count)
+            elif not ls:
+                return count
+            elif equal(ls[0], item):
+                if not count_checked:
+                    count = resolve_thunks(count)
+                    if type(count) is not int:
+                        return self.native_fallback("count-occurrences",
+                                                    item, ls, count)
+                    count_checked = True
+                count += 1
+            ls = ls[1]
+
+    @function
+    @params(3)
+    def native_first_index(self, item, ls, index):
+        equal = self.asl_equal
+        index_checked = False
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("first-index", item, ls, index)
+            elif not ls:
+                return nil
+            elif equal(ls[0], item):
+                return index
+            if not index_checked:
+                index = resolve_thunks(index)
+                if type(index) is not int:
+                    return self.native_fallback("first-index", item, ls,
+                                                index)
+                index_checked = True
+            index += 1
+            ls = ls[1]
+
+    @function
+    @params(2)
+    def native_count_up(self, lower, upper):
+        upper = resolve_thunks(upper)
+        lower = resolve_thunks(lower)
+        if (type(lower) is not int
+                or not (is_nil(upper) or type(upper) is int)):
+            return self.native_fallback("count-up", lower, upper)
+        if is_nil(upper):
+            # Infinite range from <lower> on up
+            return Stream(self, RangeSource(lower, None))
+        elif upper < lower:
+            return nil
+        # Traditional range from <lower> to <upper>
+        return Stream(self, RangeSource(lower, upper))
+
+    @function
+    @params(2)
+    def native_count_down(self, upper, lower):
+        lower = resolve_thunks(lower)
+        upper = resolve_thunks(upper)
+        if (type(upper) is not int
+                or not (is_nil(lower) or type(lower) is int)):
+            return self.native_fallback("count-down", upper, lower)
+        if is_nil(lower):
+            # Infinite range from <upper> on down
+            stop = upper - NATIVE_CHUNK_SIZE + 1
+            rest = NativeThunk(self, self.native_count_down,
+                               [stop - 1, nil])
+        elif upper < lower:
+            return nil
+        else:
+            # Traditional range from <upper> down to <lower>
+            stop = max(lower, upper - NATIVE_CHUNK_SIZE + 1)
+            if stop > lower:
+                rest = NativeThunk(self, self.native_count_down,
+                                   [stop - 1, lower])
+            else:
+                rest = nil
+        for number in range(stop, upper + 1):
+            rest = (number, rest)
+        return rest
+
+    @function
+    @params(2)
+    def native_range(self, first, second):
+        second = resolve_thunks(second)
+        if is_nil(second):
+            first = resolve_thunks(first)
+            if type(first) is not int:
+                return self.native_fallback("range", first, second)
+            return self.native_count_up(0, first - 1)
+        elif type(second) is not int:
+            return self.native_fallback("range", first, second)
+        return self.native_count_up(first, second - 1)
+
+    @function
+    @params(2)
+    def native_repeat_val(self, val, count):
+        count = resolve_thunks(count)
+        if is_nil(count):
+            # Infinite list of <val>s
+            length = NATIVE_CHUNK_SIZE
+            rest = NativeThunk(self, self.native_repeat_val, [val, nil])
+        elif type(count) is not int:
+            return self.native_fallback("repeat-val", val, count)
+        elif count <= 0:
+            return nil
+        else:
+            length = min(count, NATIVE_CHUNK_SIZE)
+            if length < count:
+                rest = NativeThunk(self, self.native_repeat_val,
+                                   [val, count - length])
+            else:
+                rest = nil
+        for i in range(length):
+            rest = (val, rest)
+        return rest
+
+    @function
+    @params(1)
+    def native_all(self, ls):
+        found, ls = self.find_truth_value(ls, False)
+        if found is None:
+            return self.native_fallback("all", ls)
+        return not found
+
+    @function
+    @params(1)
+    def native_any(self, ls):
+        found, ls = self.find_truth_value(ls, True)
+        if found is None:
+            return self.native_fallback("any", ls)
+        return found
+
+    @function
+    @params(1)
+    def native_none(self, ls):
+        found, ls = self.find_truth_value(ls, True)
+        if found is None:
+            return self.native_fallback("none", ls)
+        return not found
+
+    def find_truth_value(self, ls, truth):
+        """Look for an item of ls that is truthy (or falsey, if not truth).
+
+Returns (True, None) if there is one and (False, None) if there isn't.
+If ls turns out not to be a proper list, returns None and whatever
+was found in place of the rest of the list.
+"""
+        is_true = self.asl_bool
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return None, ls
+            elif not ls:
+                return False, None
+            elif isinstance(ls, ArrayList):
+                return (any(is_true(item) == truth for item in ls.values()),
+                        None)
+            elif is_true(ls[0]) == truth:
+                return True, None
+            ls = ls[1]
+
+    @function
+    @params(2)
+    def native_map(self, func, ls):
+        ls = resolve_stream(ls)
+        if isinstance(ls, Stream):
+            call = self.stream_caller(func)
+            if call is not None:
+                return ls.with_stage(MapItems, call)
+            ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("map", func, ls)
+        elif not ls:
+            return nil
+        call = self.function_caller(func)
+        if call is None:
+            return self.native_fallback("map", func, ls)
+        return (call(ls[0]), NativeThunk(self, self.native_map,
+                                         [func, ls[1]]))
+
+    @function
+    @params(2)
+    def native_filter(self, func, ls):
+        return self.native_filter_step("filter", func, ls, True)
+
+    @function
+    @params(2)
+    def native_filter_not(self, func, ls):
+        return self.native_filter_step("filter-not", func, ls, False)
+
+    def native_filter_step(self, name, func, ls, keep):
+        """Find the next item of ls for filter (keep = True) or filter-not.
+
+Return a list cell with that item, whose tail filters the rest of the
+list; or nil, if there are no more items to keep.
+"""
+        is_true = self.asl_bool
+        ls = resolve_stream(ls)
+        if isinstance(ls, Stream):
+            call = self.stream_caller(func, strict=True)
+            if call is not None:
+                return ls.with_stage(FilterItems, call, keep, is_true)
+        call = None
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback(name, func, ls)
+            elif not ls:
+                return nil
+            if call is None:
+                call = self.function_caller(func, strict=True)
+                if call is None:
+                    return self.native_fallback(name, func, ls)
+            item = ls[0]
+            if is_true(call(item)) == keep:
+                native = (self.native_filter if keep
+                          else self.native_filter_not)
+                return (item, NativeThunk(self, native, [func, ls[1]]))
+            ls = ls[1]
+
+    @function
+    @params(2)
+    def native_take_while(self, func, ls):
+        ls = resolve_stream(ls)
+        if isinstance(ls, Stream):
+            call = self.stream_caller(func, strict=True)
+            if call is not None:
+                return ls.with_stage(TakeWhileItems, call, self.asl_bool)
+            ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("take-while", func, ls)
+        elif not ls:
+            return nil
+        call = self.function_caller(func, strict=True)
+        if call is None:
+            return self.native_fallback("take-while", func, ls)
+        if not self.asl_bool(call(ls[0])):
+            return nil
+        return (ls[0], NativeThunk(self, self.native_take_while,
+                                   [func, ls[1]]))
+
+    @function
+    @params(2)
+    def native_drop_while(self, func, ls):
+        is_true = self.asl_bool
+        ls = resolve_stream(ls)
+        if isinstance(ls, Stream):
+            call = self.stream_caller(func, strict=True)
+            if call is not None:
+                return ls.with_stage(DropWhileItems, call, is_true)
+        call = None
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("drop-while", func, ls)
+            elif not ls:
+                return ls
+            if call is None:
+                call = self.function_caller(func, strict=True)
+                if call is None:
+                    return self.native_fallback("drop-while", func, ls)
+            if not is_true(call(ls[0])):
+                return ls
+            ls = ls[1]
+
+    @function
+    @params(3)
+    def native_foldl(self, func, ls, default):
+        ls = resolve_stream(ls)
+        if isinstance(ls, Stream) and ls.pure:
+            call = self.stream_caller(func)
+            if call is not None:
+                # Run the pipeline, without building any cells at all
+                items = ls.items()
+                accum = next(items, END)
+                if accum is END:
+                    return default
+                for item in items:
+                    accum = call(accum, item)
+                return accum
+        ls = resolve_thunks(ls)
+        if not isinstance(ls, tuple):
+            return self.native_fallback("foldl", func, ls, default)
+        elif not ls:
+            return default
+        return self.native_foldl_rest(func, ls[1], ls[0])
+
+    @function
+    @params(3)
+    def native_foldl_rest(self, func, ls, accum):
+        call = None
+        while True:
+            ls = resolve_thunks(ls)
+            if not isinstance(ls, tuple):
+                return self.native_fallback("_foldl", func, ls, accum)
+            elif not ls:
+                return accum
+            if call is None:
+                call = self.function_caller(func)
+                if call is None:
+                    return self.native_fallback("_foldl", func, ls, accum)
+            # With a user-defined function, this is a deferred call, as
+            # it would be in Appleseed
+            accum = call(accum, ls[0])
+            ls = ls[1]
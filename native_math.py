@@ -0,0 +1,338 @@
+import math
+from itertools import compress
+
+from cfg import nil
+from decorators import function, params
+from natives import NativeSupport, NativeThunk, NATIVE_CHUNK_SIZE
+from thunk import Thunk, resolve_thunks
+from streams import Stream
+
+
+# Native versions of functions from lib/math.asl
+# Key = implementation name; value = name of the library function
+
+builtins = {"native_pow": "pow",
+            "native_pow_mod": "pow-mod",
+            "native_gcd": "gcd",
+            "native_factorial": "factorial",
+            "native_prime": "prime?",
+            "native_primes": "primes",
+            "native_prime_factors": "prime-factors",
+            }
+
+# The first numbers the primes stream sieves at once, and the most it
+# ever sieves at once; the width doubles from one segment to the next
+PRIME_SEGMENT_MIN_WIDTH = 64
+PRIME_SEGMENT_MAX_WIDTH = 1 << 16
+
+# Factors up to this are found by trial division, before anything
+# cleverer is tried
+TRIAL_DIVISION_LIMIT = 1000
+
+# Miller-Rabin with the primes up to 41 as bases is exact for all
+# numbers below this
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+MILLER_RABIN_LIMIT = 3317044064679887385961981
+
+
+class PrimeTable:
+    """The primes up to some limit, extended as needed.
+
+The primes stream uses these to sieve each segment, so it only ever
+needs the ones up to the square root of the numbers it has reached.
+"""
+    def __init__(self):
+        self.limit = 1
+        self.primes = []
+
+    def up_to(self, limit):
+        """Return a list of (at least) the primes up to limit."""
+        if limit > self.limit:
+            self.extend(max(limit, 2 * self.limit))
+        return self.primes
+
+    def extend(self, limit):
+        is_prime = bytearray([1]) * (limit + 1)
+        is_prime[0:2] = b"\x00\x00"
+        for number in range(2, math.isqrt(limit) + 1):
+            if is_prime[number]:
+                start = number * number
+                is_prime[start::number] = bytes(
+                    len(range(start, limit + 1, number)))
+        self.primes = list(compress(range(limit + 1), is_prime))
+        self.limit = limit
+
+
+prime_table = PrimeTable()
+
+
+def sieve_segment(low, high):
+    """Return a list of the primes from low up to but not including high."""
+    width = high - low
+    is_prime = bytearray([1]) * width
+    for number in range(low, min(2, high)):
+        is_prime[number - low] = 0
+    for prime in prime_table.up_to(math.isqrt(high - 1)):
+        start = prime * prime
+        if start >= high:
+            break
+        # The first multiple of prime in the segment that isn't prime
+        # itself
+        start = max(start, -(-low // prime) * prime)
+        is_prime[start - low::prime] = bytes(
+            len(range(start - low, width, prime)))
+    return list(compress(range(low, high), is_prime))
+
+
+def is_strong_probable_prime(num, base, odd_part, twos):
+    """One round of Miller-Rabin: num - 1 is odd_part * 2 ** twos."""
+    value = pow(base, odd_part, num)
+    if value == 1 or value == num - 1:
+        return True
+    for i in range(twos - 1):
+        value = value * value % num
+        if value == num - 1:
+            return True
+    return False
+
+
+def is_prime(num):
+    """Tell whether num is prime, for num > 1.
+
+Below MILLER_RABIN_LIMIT, the Miller-Rabin bases used are known to give
+the right answer. Above it, every base up to 2 (ln num) ** 2 is used,
+which is exact as long as the generalized Riemann hypothesis holds.
+"""
+    for prime in MILLER_RABIN_BASES:
+        if num % prime == 0:
+            return num == prime
+    if num < MILLER_RABIN_BASES[-1] ** 2:
+        return True
+    odd_part = num - 1
+    twos = 0
+    while odd_part % 2 == 0:
+        odd_part //= 2
+        twos += 1
+    if num < MILLER_RABIN_LIMIT:
+        bases = MILLER_RABIN_BASES
+    else:
+        bases = prime_table.up_to(int(2 * math.log(num) ** 2))
+    return all(is_strong_probable_prime(num, base, odd_part, twos)
+               for base in bases)
+
+
+def find_factor(num):
+    """Return a nontrivial factor of num, which is composite and odd.
+
+Uses Pollard's rho method, with Brent's cycle finding.
+"""
+    if math.isqrt(num) ** 2 == num:
+        return math.isqrt(num)
+    increment = 1
+    while True:
+        # Each try is deterministic, so the same number always gets
+        # factored the same way
+        x = y = saved = 2
+        factor = 1
+        power = 1
+        while factor == 1:
+            saved = x
+            for i in range(power):
+                x = (x * x + increment) % num
+                factor = math.gcd(abs(x - saved), num)
+                if factor != 1:
+                    break
+            power *= 2
+        if factor != num:
+            return factor
+        increment += 1
+
+
+def factor_large(num):
+    """Return the prime factors of num, in increasing order.
+
+num has no prime factors up to TRIAL_DIVISION_LIMIT.
+"""
+    factors = []
+    unfactored = [num]
+    while unfactored:
+        num = unfactored.pop()
+        if num == 1:
+            continue
+        elif is_prime(num):
+            factors.append(num)
+        else:
+            factor = find_factor(num)
+            unfactored.append(factor)
+            unfactored.append(num // factor)
+    factors.sort()
+    return factors
+
+
+def int_pow(base, exponent):
+    """Return what pow gives for two Ints, or None for division by zero."""
+    if exponent >= 0:
+        return base ** exponent
+    elif base == 0:
+        return None
+    elif base == 1 or base == -1:
+        return base ** -exponent
+    elif base < 0 and exponent % 2:
+        # 1 divided by a negative number of magnitude 2 or more,
+        # rounded down
+        return -1
+    else:
+        return 0
+
+
+class MathNatives(NativeSupport):
+    """Native versions of the number theory functions in the library.
+
+They take the same Ints and give the same results as the Appleseed
+versions, but use better algorithms: a segmented sieve for primes,
+Miller-Rabin for prime?, and Pollard's rho for prime-factors. Anything
+other than Ints is handed to the Appleseed definitions.
+"""
+
+    @function
+    @params(2)
+    def native_pow(self, base, exponent):
+        exponent = resolve_thunks(exponent)
+        if type(exponent) is not int:
+            return self.native_fallback("pow", base, exponent)
+        elif exponent == 0:
+            # Even if <base> is not an Int
+            return 1
+        base = resolve_thunks(base)
+        if type(base) is not int:
+            return self.native_fallback("pow", base, exponent)
+        result = int_pow(base, exponent)
+        if result is None:
+            return self.native_fallback("pow", base, exponent)
+        return result
+
+    @function
+    @params(3)
+    def native_pow_mod(self, base, exponent, modulus):
+        exponent = resolve_thunks(exponent)
+        base = resolve_thunks(base)
+        modulus = resolve_thunks(modulus)
+        if (type(exponent) is not int or type(base) is not int
+                or type(modulus) is not int or modulus == 0):
+            return self.native_fallback("pow-mod", base, exponent, modulus)
+        elif exponent >= 0:
+            return pow(base, exponent, modulus)
+        result = int_pow(base, exponent)
+        if result is None:
+            return self.native_fallback("pow-mod", base, exponent, modulus)
+        return result % modulus
+
+    @function
+    @params(2)
+    def native_gcd(self, num1, num2):
+        num1 = resolve_thunks(num1)
+        num2 = resolve_thunks(num2)
+        if type(num1) is not int or type(num2) is not int:
+            return self.native_fallback("gcd", num1, num2)
+        return math.gcd(num1, num2)
+
+    @function
+    @params(1)
+    def native_factorial(self, num):
+        num = resolve_thunks(num)
+        if type(num) is not int:
+            return self.native_fallback("factorial", num)
+        elif num < 1:
+            # The product of an empty list
+            return 1
+        return math.factorial(num)
+
+    @function
+    @params(1)
+    def native_prime(self, num):
+        num = resolve_thunks(num)
+        if type(num) is not int:
+            return self.native_fallback("prime?", num)
+        elif num == -1:
+            return True
+        elif num < 2:
+            return False
+        return is_prime(num)
+
+    @function
+    @params(1)
+    def native_primes(self, sieve):
+        sieve = resolve_thunks(sieve)
+        if not self.counts_up_from(sieve, 2):
+            # Sieving something other than the numbers from 2 on up
+            return self.native_fallback("primes", sieve)
+        return self.native_prime_segment(2, PRIME_SEGMENT_MIN_WIDTH)
+
+    def native_prime_segment(self, low, width):
+        """Return the primes from low on up, one segment at a time."""
+        high = low + width
+        width = min(2 * width, PRIME_SEGMENT_MAX_WIDTH)
+        result = NativeThunk(self, self.native_prime_segment, [high, width])
+        for prime in reversed(sieve_segment(low, high)):
+            result = (prime, result)
+        return result
+
+    def counts_up_from(self, ls, number):
+        """Tell whether ls is the infinite list of Ints from number on up.
+
+It is, if it was made by count-up with no upper limit; that is, if the
+first few cells are the right numbers, and then the rest of the list is
+a Stream of the numbers after them that hasn't been started. Calls that
+haven't been made yet aren't resolved, so this never does any work that
+the list's user wouldn't have done.
+"""
+        for i in range(NATIVE_CHUNK_SIZE + 1):
+            while isinstance(ls, Thunk) and ls.resolved is not None:
+                ls = ls.resolved
+            if isinstance(ls, Stream):
+                return ls.counts_up_from(number)
+            elif (not isinstance(ls, tuple) or not ls
+                    or type(ls[0]) is not int or ls[0] != number):
+                return False
+            ls = ls[1]
+            number += 1
+        return False
+
+    @function
+    @params(1)
+    def native_prime_factors(self, num):
+        num = resolve_thunks(num)
+        if type(num) is not int:
+            return self.native_fallback("prime-factors", num)
+        elif num == 0:
+            return (0, nil)
+        # Small factors are found straight away; the rest, which can
+        # take much longer, only when they are needed
+        factors = []
+        unfactored = abs(num)
+        for prime in prime_table.up_to(TRIAL_DIVISION_LIMIT):
+            if prime * prime > unfactored:
+                break
+            while unfactored % prime == 0:
+                factors.append(prime)
+                unfactored //= prime
+        if unfactored == 1:
+            result = nil
+        elif unfactored < TRIAL_DIVISION_LIMIT ** 2:
+            # What is left has no factor up to its square root
+            result = (unfactored, nil)
+        else:
+            result = NativeThunk(self, self.native_large_factors,
+                                 [unfactored])
+        for factor in reversed(factors):
+            result = (factor, result)
+        if num < 0:
+            result = (-1, result)
+        return result
+
+    def native_large_factors(self, num):
+        """Return a list of the prime factors of num, in increasing order."""
+        result = nil
+        for factor in reversed(factor_large(num)):
+            result = (factor, result)
+        return result
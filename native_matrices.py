@@ -0,0 +1,254 @@
+from operator import add, sub, mul, floordiv, mod
+
+from cfg import nil
+from arraylist import ArrayList
+from decorators import function, params
+import packed
+from packed import pack_list
+from natives import NativeSupport, NativeThunk, settled
+from thunk import Thunk, resolve_thunks
+from streams import Stream, ZipSource, unstarted_streams
+
+
+# Native versions of functions from lib/matrices.asl
+# Key = implementation name; value = name of the library function
+
+builtins = {"native_transpose": "transpose",
+            "native_zip_with": "zip-with",
+            "native_main_diagonal": "main-diagonal",
+            "native_dot": "dot",
+            "native_matmul": "matmul",
+            "native_matrix_column": "matrix-column",
+            "native_submatrix": "submatrix",
+            }
+
+# Builtins that zip-with can apply to two lists of Ints all at once
+# Key = implementation name; value = the Python operation
+ELEMENTWISE_OPERATIONS = {"asl_add": add,
+                          "asl_sub": sub,
+                          "asl_mul": mul,
+                          "asl_div": floordiv,
+                          "asl_mod": mod,
+                          }
+
+
+def slice_items(items, start, end):
+    """Return the items that (take (sub end start) (drop start ls)) gives."""
+    # A negative start drops nothing, but the count still counts from it
+    begin = max(start, 0)
+    return items[begin:begin + max(end - start, 0)]
+
+
+class MatrixNatives(NativeSupport):
+    """Native versions of the matrix functions in the standard library.
+
+A matrix is a list of rows, each a list. The results are packed lists
+(see packed.py): rows of Ints are stored in machine-word arrays where
+they fit, and everything else in tuples. Either way, they are ordinary
+Appleseed lists as far as any code can tell.
+
+These only work on lists that have already been built. Where a list
+still has delayed calls in it, the Appleseed version is used, so that
+nothing is worked out sooner than it would have been; and transpose,
+which often gets infinite lists, goes only as far as the built part of
+its rows before leaving the rest for later. The exception is zip-with
+of Streams that haven't been started (see streams.py), which gives a
+Stream of its own.
+"""
+
+    def int_list(self, ls):
+        """Return a list of the Ints in a built list ls, or None."""
+        ls = resolve_thunks(ls)
+        items = packed.int_items(ls)
+        if items is not None:
+            return items
+        items = self.built_items(ls)
+        if items is None:
+            return None
+        items = [settled(item) for item in items]
+        if all(type(item) is int for item in items):
+            return items
+        return None
+
+    def int_rows(self, matrix):
+        """Return a list of the rows of a built matrix of Ints, or None."""
+        rows = self.built_items(resolve_thunks(matrix))
+        if rows is None:
+            return None
+        rows = [self.int_list(settled(row)) for row in rows]
+        if None in rows:
+            return None
+        return rows
+
+    @function
+    @params(1)
+    def native_transpose(self, matrix):
+        # (both matrix (all matrix))
+        is_true = self.asl_bool
+        rows = []
+        ls = resolve_thunks(matrix)
+        while isinstance(ls, tuple) and ls:
+            row = resolve_thunks(ls[0])
+            if not is_true(row):
+                return nil
+            elif not isinstance(row, tuple):
+                return self.native_fallback("transpose", matrix)
+            rows.append(row)
+            ls = resolve_thunks(ls[1])
+        if not isinstance(ls, tuple):
+            return self.native_fallback("transpose", matrix)
+        elif not rows:
+            return nil
+        row_items = [self.built_items(row) for row in rows]
+        if None not in row_items:
+            # All the rows are there, so the whole result can be too
+            return pack_list([pack_list(column) for column
+                              in packed.transpose(row_items)])
+        # Go one column at a time, for as long as the rows are built;
+        # then leave the rest for when it is needed
+        columns = []
+        while True:
+            columns.append([row[0] for row in rows])
+            tails = [row[1] for row in rows]
+            rows = []
+            rest = nil
+            for tail in tails:
+                tail = settled(tail)
+                if isinstance(tail, tuple) and tail:
+                    rows.append(tail)
+                elif isinstance(tail, Thunk) or is_true(tail):
+                    # A call that hasn't been made, or an improper row
+                    rest = NativeThunk(self, self.native_transpose,
+                                       [self.native_list(tails)])
+                    break
+                else:
+                    # A row has run out
+                    break
+            if len(rows) < len(tails):
+                break
+        result = rest
+        for column in reversed(columns):
+            result = (pack_list(column), result)
+        return result
+
+    def native_list(self, items):
+        """Make a list of cons cells out of a Python list of items."""
+        result = nil
+        for item in reversed(items):
+            result = (item, result)
+        return result
+
+    @function
+    @params(1)
+    def native_zip_with(self, func_and_lists):
+        args = self.built_items(func_and_lists)
+        if args is None or len(args) < 2:
+            return self.native_fallback("zip-with", func_and_lists)
+        streams = unstarted_streams(args[1:])
+        if streams is not None:
+            # Zip the Streams into one, whose calls are made as its
+            # cells are resolved
+            call = self.stream_caller(args[0])
+            if call is None:
+                return self.native_fallback("zip-with", func_and_lists)
+            return Stream(self, ZipSource(streams, call))
+        elif len(args) != 3:
+            return self.native_fallback("zip-with", func_and_lists)
+        func = resolve_thunks(args[0])
+        if not (func in self.builtins
+                and func.name in ELEMENTWISE_OPERATIONS):
+            return self.native_fallback("zip-with", func_and_lists)
+        operation = ELEMENTWISE_OPERATIONS[func.name]
+        items1 = self.int_list(args[1])
+        items2 = self.int_list(args[2]) if items1 is not None else None
+        if items2 is None:
+            return self.native_fallback("zip-with", func_and_lists)
+        elif (operation in (floordiv, mod)
+                and 0 in items2[:len(items1)]):
+            # Division by zero gives an error
+            return self.native_fallback("zip-with", func_and_lists)
+        return pack_list(list(map(operation, items1, items2)))
+
+    @function
+    @params(1)
+    def native_main_diagonal(self, matrix):
+        rows = self.built_items(resolve_thunks(matrix))
+        if rows is None:
+            return self.native_fallback("main-diagonal", matrix)
+        diagonal = []
+        for index, row in enumerate(rows):
+            # Take the tail of the row index times
+            row = settled(row)
+            if isinstance(row, ArrayList):
+                if index < row.length():
+                    diagonal.append(row.nth(index))
+                    continue
+                break
+            for i in range(index):
+                if not isinstance(row, tuple):
+                    return self.native_fallback("main-diagonal", matrix)
+                elif not row:
+                    break
+                row = settled(row[1])
+            if isinstance(row, tuple) and row:
+                diagonal.append(row[0])
+            elif isinstance(row, Thunk) or self.asl_bool(row):
+                return self.native_fallback("main-diagonal", matrix)
+            else:
+                break
+        return pack_list(diagonal)
+
+    @function
+    @params(2)
+    def native_dot(self, vec1, vec2):
+        items1 = self.int_list(vec1)
+        items2 = self.int_list(vec2) if items1 is not None else None
+        if items2 is None:
+            return self.native_fallback("dot", vec1, vec2)
+        return sum(map(mul, items1, items2))
+
+    @function
+    @params(2)
+    def native_matmul(self, matrix1, matrix2):
+        rows1 = self.int_rows(matrix1)
+        rows2 = self.int_rows(matrix2) if rows1 is not None else None
+        if rows2 is None:
+            return self.native_fallback("matmul", matrix1, matrix2)
+        return pack_list([pack_list(row)
+                          for row in packed.matmul(rows1, rows2)])
+
+    @function
+    @params(2)
+    def native_matrix_column(self, matrix, index):
+        index = resolve_thunks(index)
+        rows = self.built_items(resolve_thunks(matrix))
+        if type(index) is not int or rows is None:
+            return self.native_fallback("matrix-column", matrix, index)
+        column = []
+        for row in rows:
+            items = self.built_items(settled(row))
+            if items is None:
+                return self.native_fallback("matrix-column", matrix, index)
+            elif 0 <= index < len(items):
+                column.append(items[index])
+            else:
+                column.append(nil)
+        return pack_list(column)
+
+    @function
+    @params(5)
+    def native_submatrix(self, matrix, top, bottom, left, right):
+        bounds = [resolve_thunks(bound) for bound in (top, bottom, left,
+                                                      right)]
+        rows = self.built_items(resolve_thunks(matrix))
+        if (rows is None
+                or not all(type(bound) is int for bound in bounds)):
+            return self.native_fallback("submatrix", matrix, *bounds)
+        top, bottom, left, right = bounds
+        result = []
+        for row in slice_items(rows, top, bottom):
+            items = self.built_items(settled(row))
+            if items is None:
+                return self.native_fallback("submatrix", matrix, *bounds)
+            result.append(pack_list(slice_items(items, left, right)))
+        return pack_list(result)
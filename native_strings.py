@@ -0,0 +1,166 @@
+import re
+
+from cfg import nil
+from decorators import function, params
+from natives import NativeSupport
+from thunk import resolve_thunks
+
+
+# Native versions of functions from lib/strings.asl
+# Key = implementation name; value = name of the library function
+
+builtins = {"native_strlen": "strlen",
+            "native_strcat": "strcat",
+            "native_substring": "substring",
+            "native_starts_with": "starts-with?",
+            "native_join": "join",
+            "native_find": "find",
+            "native_split": "split",
+            "native_replace": "replace",
+            "native_parse_int": "parse-int",
+            }
+
+# What parse-int reads: leading spaces, then an optional minus sign,
+# then ASCII digits (not whatever else Python counts as digits)
+INT_PREFIX = re.compile(r" *(-?)([0-9]*)")
+
+
+class StringNatives(NativeSupport):
+    """Native versions of the string functions in the standard library.
+
+The Appleseed versions turn strings into lists of character codes and
+back; these work on the Python strings directly. Anything that isn't a
+string where a string is expected goes to the Appleseed definition.
+"""
+
+    def string_list(self, ls):
+        """Return a Python list of the Strings in ls, or None.
+
+None means that ls isn't a proper list of Strings.
+"""
+        strings = []
+        ls = resolve_thunks(ls)
+        while isinstance(ls, tuple) and ls:
+            string = resolve_thunks(ls[0])
+            if not isinstance(string, str):
+                return None
+            strings.append(string)
+            ls = resolve_thunks(ls[1])
+        if isinstance(ls, tuple):
+            return strings
+        return None
+
+    @function
+    @params(1)
+    def native_strlen(self, string):
+        string = resolve_thunks(string)
+        if not isinstance(string, str):
+            return self.native_fallback("strlen", string)
+        return len(string)
+
+    @function
+    @params(1)
+    def native_strcat(self, strings):
+        string_list = self.string_list(strings)
+        if string_list is None:
+            return self.native_fallback("strcat", strings)
+        return "".join(string_list)
+
+    @function
+    @params(3)
+    def native_substring(self, string, start, end):
+        string = resolve_thunks(string)
+        start = resolve_thunks(start)
+        end = resolve_thunks(end)
+        if (not isinstance(string, str) or type(start) is not int
+                or not (end == nil or type(end) is int)):
+            return self.native_fallback("substring", string, start, end)
+        # Like drop, a negative start drops nothing; but the count that
+        # take is given still counts from start
+        begin = max(start, 0)
+        if end == nil:
+            return string[begin:]
+        return string[begin:begin + max(end - start, 0)]
+
+    @function
+    @params(2)
+    def native_starts_with(self, prefix, string):
+        prefix = resolve_thunks(prefix)
+        string = resolve_thunks(string)
+        if not (isinstance(prefix, str) and isinstance(string, str)):
+            # Lists of character codes, which starts-with? also works on
+            return self.native_fallback("starts-with?", prefix, string)
+        return string.startswith(prefix)
+
+    @function
+    @params(2)
+    def native_join(self, strings, sep):
+        string_list = self.string_list(strings)
+        sep = resolve_thunks(sep)
+        if string_list is None:
+            return self.native_fallback("join", strings, sep)
+        elif len(string_list) < 2:
+            # sep is never used
+            return string_list[0] if string_list else ""
+        elif not isinstance(sep, str):
+            return self.native_fallback("join", strings, sep)
+        return sep.join(string_list)
+
+    @function
+    @params(2)
+    def native_find(self, pattern, string):
+        pattern = resolve_thunks(pattern)
+        string = resolve_thunks(string)
+        if not (isinstance(pattern, str) and isinstance(string, str)):
+            return self.native_fallback("find", pattern, string)
+        index = string.find(pattern)
+        if index < 0:
+            return nil
+        return index
+
+    @function
+    @params(2)
+    def native_split(self, string, sep):
+        string = resolve_thunks(string)
+        sep = resolve_thunks(sep)
+        if not (isinstance(string, str) and isinstance(sep, str)):
+            return self.native_fallback("split", string, sep)
+        elif sep:
+            pieces = string.split(sep)
+        else:
+            pieces = [string]
+        result = nil
+        for piece in reversed(pieces):
+            result = (piece, result)
+        return result
+
+    @function
+    @params(3)
+    def native_replace(self, string, old, replacement):
+        string = resolve_thunks(string)
+        old = resolve_thunks(old)
+        replacement = resolve_thunks(replacement)
+        if not (isinstance(string, str) and isinstance(old, str)
+                and isinstance(replacement, str)):
+            return self.native_fallback("replace", string, old,
+                                        replacement)
+        elif not old:
+            # An empty old string never matches
+            return string
+        return string.replace(old, replacement)
+
+    @function
+    @params(1)
+    def native_parse_int(self, string):
+        string = resolve_thunks(string)
+        if not isinstance(string, str):
+            return self.native_fallback("parse-int", string)
+        sign, digits = INT_PREFIX.match(string).groups()
+        if not digits:
+            return 0
+        try:
+            number = int(digits)
+        except ValueError:
+            # More digits than Python will convert at once
+            return self.native_fallback("parse-int", string)
+        return -number if sign else number
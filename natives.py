@@ -0,0 +1,218 @@
+
+from cfg import nil, identical
+from arraylist import ArrayList
+import binding
+import hashcons
+from thunk import Thunk, resolve_thunks, cons_iter
+
+
+# How many cells of a list whose items are known in advance (a range of
+# numbers, say) a native function builds before leaving the rest of the
+# list for later
+NATIVE_CHUNK_SIZE = 32
+
+
+def settled(value):
+    """Return the result of value, if it is a thunk that has been resolved.
+
+Thunks that haven't been resolved, and other values, are returned
+unchanged.
+"""
+    while isinstance(value, Thunk) and value.resolved is not None:
+        value = value.resolved
+    return value
+
+
+class NativeThunk(Thunk):
+    """For delayed calls of native library functions.
+
+Where the Appleseed version of a library function returns a list cell
+whose tail is a recursive call, the native version returns a cell
+whose tail is one of these, so that the rest of the list is only worked
+out when it is needed, just as it would have been.
+"""
+    __slots__ = ("native",)
+
+    def __init__(self, environment, native, arglist):
+        super().__init__(environment, None, None, arglist)
+        self.native = native
+
+    def __eq__(self, value):
+        if (isinstance(value, NativeThunk) and self.environment is not None
+                and value.environment is not None):
+            return (self.native == value.native
+                    and identical(self.arglist, value.arglist))
+        return super().__eq__(value)
+
+    def __str__(self):
+        if self.environment is None:
+            return "NativeThunk(resolved to %s)" % (self.resolved,)
+        return "NativeThunk(%s, %s)" % (self.native.name, self.arglist)
+
+    def set_result(self, value):
+        super().set_result(value)
+        self.native = None
+
+    def resolve(self):
+        if self.resolved is not None:
+            return self.resolved
+        return_val = self.native(*self.arglist)
+        self.set_result(return_val)
+        return return_val
+
+
+class NativeSupport:
+    """What the native versions of library functions have in common.
+
+A native function stands in for a library function written in
+Appleseed. The library function itself stays as it was, so it is still
+a user-defined function: calls to it are deferred in the same way, and
+it can be passed around, printed, and taken apart like any other. The
+native function is a fast path kept alongside it, in native_bodies:
+when any engine calls the function, it evaluates a call of the native
+function, passing along all the parameters, in place of the body.
+
+Native functions have to give exactly the results that the Appleseed
+versions would. They do this for the arguments that they expect (proper
+lists, Ints where Ints are called for); as soon as they come across
+anything else, they hand the rest of the work over to the original
+Appleseed definition, which then gives whatever result and error
+messages it always would have. Thunks are only resolved where the
+Appleseed version would resolve them, and in the same order, so that
+nothing happens earlier than it would have; and lazy functions stay
+lazy, one list cell (or chunk of cells) at a time.
+"""
+    def add_native_version(self, name, function):
+        """Make calls of a library function use its native version.
+
+If the function doesn't have the shape that its native version
+expects, it is left to run as Appleseed code.
+"""
+        native = self.native_functions[name]
+        function_parts = self.function_parts(function)
+        if function_parts is None:
+            return
+        param_names, body = function_parts
+        plan = binding.make_plan(resolve_thunks(param_names))
+        if (plan is None or len(plan.names()) != native.max_param_count
+                or not isinstance(body, tuple) or not body):
+            return
+        native_call = nil
+        for param_name in reversed(plan.names()):
+            native_call = (param_name, native_call)
+        # For arguments the native version doesn't handle, the body is
+        # run as Appleseed code; a copy of its first cell does that,
+        # since only the body itself has the fast path
+        fallback_body = (body[0], body[1])
+        # Keep references to the parameter list and body, so their ids
+        # aren't reused while the fast path exists
+        self.native_originals[name] = (param_names, body, fallback_body)
+        self.native_bodies[(id(param_names), id(body))] = (native,
+                                                           native_call)
+
+    def add_native_versions(self):
+        """Set up the native versions of all the library functions.
+
+This is for when the library functions have been replaced all at once,
+as by restoring a snapshot.
+"""
+        self.native_originals.clear()
+        self.native_bodies.clear()
+        for name in self.native_functions:
+            function = self.global_names.get(name)
+            if function is not None:
+                self.add_native_version(name, function)
+
+    def native_fallback(self, name, *args):
+        """Continue a call using the Appleseed definition of a function.
+
+Returns a deferred call, which the caller resolves like any other.
+"""
+        param_names, body, fallback_body = self.native_originals[name]
+        if isinstance(resolve_thunks(param_names), str):
+            # A variadic function; its one argument is the list of all
+            # the arguments it was called with
+            args = cons_iter(args[0])
+        return self.thunk_type(self, param_names, fallback_body, list(args))
+
+    def built_items(self, ls):
+        """Return a Python list of the items of ls, if it is all there.
+
+Returns None unless ls is a proper list whose every cell has already
+been built. Delayed calls that have been made count as built; calls
+that haven't are left alone, so this never does any work that the
+Appleseed version of a function might not have done. The items
+themselves can be anything, including thunks.
+"""
+        items = []
+        while True:
+            ls = settled(ls)
+            if isinstance(ls, ArrayList):
+                items.extend(ls.values())
+                return items
+            elif not isinstance(ls, tuple):
+                # An improper list, or a call that hasn't been made
+                return None
+            elif not ls:
+                return items
+            items.append(ls[0])
+            ls = ls[1]
+
+    def function_caller(self, function, strict=False):
+        """Return a way of calling an Appleseed function with evaluated args.
+
+The result is a Python function that does what calling function from
+Appleseed code would do, given argument values: user-defined functions
+return a deferred call, and builtin functions are called straight
+away. If function is anything else (such as a macro, or eval, which
+evaluates code in the caller's scope), return None.
+
+If strict is true, the result is going to be resolved right away (as
+with the predicate of filter), so calls of user-defined functions are
+made straight away too, without a thunk.
+"""
+        function = resolve_thunks(function)
+        if function and isinstance(function, tuple):
+            function_parts = self.function_parts(function)
+            if function_parts is None:
+                return None
+            param_names, body = function_parts
+            if strict:
+                run_call = self.run_call
+
+                def call_function(*args):
+                    return run_call(param_names, body, list(args))
+                return call_function
+            thunk_type = self.thunk_type
+
+            def call_function(*args):
+                return thunk_type(self, param_names, body, list(args))
+            return call_function
+        elif (function in self.builtins and not function.is_macro
+              and function != self.asl_eval):
+            def call_builtin(*args):
+                return self.call_builtin(function, list(args))
+            return call_builtin
+        else:
+            return None
+
+    def stream_caller(self, function, strict=False):
+        """Return function_caller(function, strict) for adding to a Stream.
+
+Streams (see streams.py) are zipped and folded before the Appleseed
+version would have looked at the function; so if finding the function
+would take any work (it is a call that hasn't been made), return None,
+and the Stream is used as an ordinary list instead.
+"""
+        function = settled(function)
+        if isinstance(function, Thunk):
+            return None
+        return self.function_caller(function, strict)
+
+    def native_cons(self, head, tail):
+        """Make a list cell, as the cons builtin would."""
+        if self.hash_cons:
+            cell = hashcons.cons(head, tail)
+            if cell is not None:
+                return cell
+        return (head, tail)
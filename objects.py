@@ -0,0 +1,203 @@
+from cfg import identical
+from hamt import Hamt
+
+
+# Objects with more properties than this keep them in a Hamt instead of
+# a Shape and a tuple of values, so that copying one with a property
+# changed doesn't have to copy all the values
+MAX_SHAPE_PROPERTIES = 32
+
+
+class Shape:
+    """The property names of an Object, in the order they were set.
+
+Objects with the same property names, set in the same order, share one
+Shape (a "hidden class"), and each Object only keeps a tuple of its
+values, in the same order as the names. The Shape maps each name to its
+place in the tuple.
+
+Shapes are made by adding one name at a time to a shorter Shape, which
+remembers the ones made from it; so every Object built with the same
+names in the same order ends up with the very same Shape.
+"""
+    __slots__ = ("names", "slots", "transitions")
+
+    def __init__(self, names):
+        self.names = names
+        self.slots = {name: index for index, name in enumerate(names)}
+        self.transitions = {}
+
+    def with_name(self, name):
+        """Return the Shape with name added after the names of this one."""
+        shape = self.transitions.get(name)
+        if shape is None:
+            shape = Shape(self.names + (name,))
+            self.transitions[name] = shape
+        return shape
+
+
+EMPTY_SHAPE = Shape(())
+
+
+class Object:
+    """An Appleseed Object: an immutable collection of named properties.
+
+An Object usually has a Shape, which holds its property names, and a
+tuple of the values. Objects of the same type, which have the same
+properties, all share one Shape, so each of them takes little more
+memory than its values; and finding a property is one lookup in the
+Shape's index.
+
+Objects with more than MAX_SHAPE_PROPERTIES properties have no Shape
+(shape is None); instead, values is a Hamt (see hamt.py) that maps each
+name to its place in the order the properties were set and its value.
+Copying such an Object with a property added or changed, as copy does,
+takes O(log n) time and memory, sharing everything else with the
+original.
+
+Either way, properties are listed in the order they were first set,
+which is the order that repr and print show them in, and changing a
+property leaves it where it was.
+
+Objects can be used like a read-only dict of property names and values.
+"""
+    __slots__ = ("shape", "values", "next_order")
+
+    def __init__(self, items=()):
+        # (A dict keeps the names in the order they were first set)
+        properties = dict(items)
+        if len(properties) > MAX_SHAPE_PROPERTIES:
+            self.shape = None
+            self.values = Hamt((name, (order, value)) for order, (name, value)
+                               in enumerate(properties.items()))
+            self.next_order = len(properties)
+        else:
+            shape = EMPTY_SHAPE
+            for name in properties:
+                shape = shape.with_name(name)
+            self.shape = shape
+            self.values = tuple(properties.values())
+
+    @classmethod
+    def shaped(cls, shape, values):
+        """Return an Object with the given Shape and values."""
+        obj = cls.__new__(cls)
+        obj.shape = shape
+        obj.values = values
+        return obj
+
+    @classmethod
+    def unshaped(cls, properties, next_order):
+        """Return an Object with the given Hamt of properties."""
+        obj = cls.__new__(cls)
+        obj.shape = None
+        obj.values = properties
+        obj.next_order = next_order
+        return obj
+
+    def __len__(self):
+        return len(self.values)
+
+    def __bool__(self):
+        return len(self.values) > 0
+
+    def __contains__(self, name):
+        if self.shape is None:
+            return name in self.values
+        return name in self.shape.slots
+
+    def __getitem__(self, name):
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __iter__(self):
+        for name, value in self.items():
+            yield name
+
+    def __eq__(self, other):
+        # Equal to any Object with the same properties, in any order.
+        # The values are compared with identical, which (like
+        # value_key) never takes a Bool to be equal to an Int
+        if not isinstance(other, Object):
+            return NotImplemented
+        elif self is other:
+            return True
+        elif self.shape is not None and self.shape is other.shape:
+            return all(map(identical, self.values, other.values))
+        elif len(self) != len(other):
+            return False
+        for name, value in self.items():
+            other_value = other.get(name)
+            if other_value is None or not identical(value, other_value):
+                return False
+        return True
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    # Like dicts, Objects can't be hashed
+    __hash__ = None
+
+    def __repr__(self):
+        return "Object(%r)" % (list(self.items()),)
+
+    def __reduce__(self):
+        # Rebuilt from the names and values, so that Objects that are
+        # unpickled share Shapes with all the others
+        return (Object, (list(self.items()),))
+
+    def get(self, name, default=None):
+        shape = self.shape
+        if shape is None:
+            entry = self.values.get(name)
+            if entry is None:
+                return default
+            return entry[1]
+        index = shape.slots.get(name)
+        if index is None:
+            return default
+        return self.values[index]
+
+    def items(self):
+        """Iterate over the property names and values, in order."""
+        if self.shape is not None:
+            return zip(self.shape.names, self.values)
+        entries = sorted(self.values.items(),
+                         key=lambda name_and_entry: name_and_entry[1][0])
+        return ((name, value) for name, (order, value) in entries)
+
+    def keys(self):
+        return iter(self)
+
+    def with_property(self, name, value):
+        """Return a copy of the Object with property name set to value."""
+        shape = self.shape
+        values = self.values
+        if shape is None:
+            entry = values.get(name)
+            if entry is None:
+                return Object.unshaped(
+                    values.with_item(name, (self.next_order, value)),
+                    self.next_order + 1)
+            elif entry[1] is value:
+                return self
+            return Object.unshaped(values.with_item(name, (entry[0], value)),
+                                   self.next_order)
+        index = shape.slots.get(name)
+        if index is None:
+            if len(values) >= MAX_SHAPE_PROPERTIES:
+                # Too many for a Shape
+                return Object(list(self.items()) + [(name, value)])
+            return Object.shaped(shape.with_name(name), values + (value,))
+        elif values[index] is value:
+            return self
+        return Object.shaped(shape,
+                             values[:index] + (value,) + values[index + 1:])
+
+
+EMPTY_OBJECT = Object()
@@ -0,0 +1,99 @@
+from array import array
+from operator import mul
+
+import cfg
+from arraylist import ArrayList
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Ints that fit in a signed 64-bit machine word can be packed
+PACKED_MIN = -(1 << 63)
+PACKED_MAX = (1 << 63) - 1
+
+# Matrix products with fewer multiplications than this are done in
+# Python even when NumPy is there, since converting to and from NumPy
+# arrays costs more than it saves
+NUMPY_MIN_PRODUCTS = 1 << 12
+
+
+def pack_list(items):
+    """Return a list of items (a Python list), packed if they are all Ints.
+
+A list of Ints that all fit in 64 bits is an ArrayList backed by an
+array('q'); anything else, including bigger Ints, is an ArrayList
+backed by a tuple. Either way, the list looks and behaves exactly like
+one made of cons cells.
+"""
+    if not items:
+        return cfg.nil
+    elif all(type(item) is int for item in items):
+        # (Bools are left alone; an array would turn them into Ints)
+        try:
+            return ArrayList(array("q", items))
+        except OverflowError:
+            pass
+    return ArrayList(tuple(items))
+
+
+def is_packed(value):
+    return type(value) is ArrayList and type(value.items) is array
+
+
+def int_items(value):
+    """Return the items of a packed list, or None if it isn't one."""
+    if is_packed(value):
+        return value.items[value.offset:]
+    return None
+
+
+def transpose(rows):
+    """Transpose a list of lists of items, as the transpose function does.
+
+The result has as many rows as the shortest of the lists has items.
+"""
+    return [list(column) for column in zip(*rows)]
+
+
+def matmul(rows1, rows2):
+    """Multiply two matrices of Ints, given as lists of rows.
+
+Each item of the result is the dot product of a row of the first
+matrix and a column of the second, as far as the shorter of the two
+goes; so ragged and mismatched matrices give what matmul in
+lib/matrices.asl gives.
+"""
+    columns = transpose(rows2)
+    if numpy is not None and fits_numpy(rows1, rows2, columns):
+        inner = min(len(rows1[0]), len(rows2))
+        product = numpy.matmul(
+            numpy.array([row[:inner] for row in rows1], dtype=numpy.int64),
+            numpy.array(rows2[:inner], dtype=numpy.int64))
+        # Back to Python Ints
+        return product.tolist()
+    return [[sum(map(mul, row, column)) for column in columns]
+            for row in rows1]
+
+
+def fits_numpy(rows1, rows2, columns):
+    """Tell whether NumPy can multiply these matrices without overflow.
+
+Both have to be rectangular, and no sum of products can leave the
+range of 64-bit Ints; otherwise the Python Ints have to be used.
+"""
+    if not rows1 or not columns:
+        return False
+    width = len(rows1[0])
+    height = len(columns[0])
+    if (any(len(row) != width for row in rows1)
+            or any(len(row) != len(columns) for row in rows2)):
+        return False
+    inner = min(width, height)
+    if len(rows1) * len(columns) * inner < NUMPY_MIN_PRODUCTS:
+        return False
+    largest1 = max(max(map(abs, row[:inner]), default=0) for row in rows1)
+    largest2 = max(max(map(abs, row), default=0) for row in rows2[:inner])
+    return largest1 * largest2 * inner <= PACKED_MAX
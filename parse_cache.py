@@ -0,0 +1,218 @@
+
+import os
+import hashlib
+import marshal
+import tempfile
+
+import cfg
+from arraylist import build_list
+import version
+
+
+# The cache for a file lives in a subdirectory next to it, in the same
+# way that Python keeps .pyc files in __pycache__
+CACHE_DIRECTORY = "__aslcache__"
+CACHE_EXTENSION = ".aslc"
+INDEX_EXTENSION = ".autoload"
+
+# Cache files written by a different interpreter version, or in a
+# different format, are ignored
+CACHE_FORMAT = 1
+MAGIC = "appleseed-%s-%d-%d" % (version.VERSION, CACHE_FORMAT,
+                                marshal.version)
+
+# Markers used in the flattened form of a parse tree
+LIST_START = Ellipsis
+LIST_END = None
+
+
+def cache_path(path, extension=CACHE_EXTENSION):
+    """Return the path of the cache file for the source file at path."""
+    directory, filename = os.path.split(os.path.abspath(path))
+    name, source_extension = os.path.splitext(filename)
+    return os.path.join(directory, CACHE_DIRECTORY, name + extension)
+
+
+def digest(code):
+    """Hash the contents of a source file."""
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+def load(path, code):
+    """Return the cached top-level expressions for a source file.
+
+The file's contents, code, have already been read by the caller. If
+there is no usable cache file, return None. The cache is used if the
+source file's modification time and size are unchanged since the cache
+was written; failing that, if its contents still hash the same, in
+which case the cache's header is brought up to date, so that the next
+run doesn't have to hash them again.
+"""
+    try:
+        stat = os.stat(path)
+        with open(cache_path(path), "rb") as f:
+            header = marshal.load(f)
+            magic, mtime, size, code_digest = header
+            if magic != MAGIC:
+                return None
+            data = f.read()
+        flat_exprs = marshal.loads(data)
+    except (OSError, EOFError, ValueError, TypeError):
+        # No cache file, or it couldn't be read
+        return None
+    if (mtime, size) != (stat.st_mtime_ns, stat.st_size):
+        # The file has been touched; check whether its contents have
+        # actually changed
+        if digest(code) != code_digest:
+            return None
+        header = (MAGIC, stat.st_mtime_ns, stat.st_size, code_digest)
+        try:
+            write_atomically(cache_path(path), marshal.dumps(header) + data)
+        except (OSError, ValueError):
+            pass
+    return unflatten(flat_exprs)
+
+
+def store(path, code, exprs):
+    """Write the top-level expressions parsed from code to the cache.
+
+The cache file is written to a temporary file and then moved into
+place, so a half-written cache is never seen. If the cache can't be
+written (for instance, the directory is read-only), nothing happens.
+"""
+    try:
+        stat = os.stat(path)
+        header = (MAGIC, stat.st_mtime_ns, stat.st_size, digest(code))
+        data = marshal.dumps(header) + marshal.dumps(flatten(exprs))
+        write_atomically(cache_path(path), data)
+    except (OSError, ValueError):
+        # Caching is only an optimization, so give up quietly
+        pass
+
+
+def file_stats(paths):
+    """Return the mtime and size of each file."""
+    stats = []
+    for path in paths:
+        stat = os.stat(path)
+        stats.append((path, stat.st_mtime_ns, stat.st_size))
+    return stats
+
+
+def load_index(path):
+    """Return the cached autoload index for a library file, or None.
+
+The index is only used if neither the library file nor any of the
+modules in the index have changed since it was written.
+"""
+    try:
+        with open(cache_path(path, INDEX_EXTENSION), "rb") as f:
+            magic, stats, index = marshal.load(f)
+        if magic != MAGIC:
+            return None
+        if file_stats(source for source, mtime, size in stats) != stats:
+            return None
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return index
+
+
+def store_index(path, index):
+    """Write the autoload index for a library file to the cache."""
+    filename = cache_path(path, INDEX_EXTENSION)
+    try:
+        paths = [os.path.abspath(path)] + sorted(set(index.values()))
+        data = marshal.dumps((MAGIC, file_stats(paths), index))
+        write_atomically(filename, data)
+    except (OSError, ValueError):
+        pass
+
+
+def write_atomically(filename, data):
+    """Write data to a file by way of a temporary file."""
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_filename = tempfile.mkstemp(dir=directory,
+                                         suffix=CACHE_EXTENSION)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+
+
+def parse_and_store(path, code, exprs):
+    """Yield parsed expressions, then cache them for the file at path.
+
+The expressions are passed through as they are parsed, so that the
+code can be executed as it is parsed. If parsing gave any warnings,
+nothing is cached, so that the warnings are given again next time.
+"""
+    exprs = iter(exprs)
+    parsed = []
+    clean = True
+    while True:
+        warning_count = cfg.warning_count
+        try:
+            expr = next(exprs)
+        except StopIteration:
+            break
+        finally:
+            clean = clean and cfg.warning_count == warning_count
+        parsed.append(expr)
+        yield expr
+    if clean:
+        store(path, code, parsed)
+
+
+def flatten(exprs):
+    """Turn a list of parse trees into a flat list of names and literals.
+
+Each (sub)list in the trees is replaced by a start marker, its items,
+and an end marker. This keeps the nesting depth of the data the cache
+stores independent of how long the lists in the code are.
+"""
+    flat = []
+    # Stack of the remaining parts of the lists we are partway through
+    stack = []
+    for expr in exprs:
+        while True:
+            if isinstance(expr, tuple):
+                flat.append(LIST_START)
+                stack.append(expr)
+            else:
+                flat.append(expr)
+            # Find the next item, finishing off any lists that have
+            # run out of items
+            while stack:
+                rest = stack[-1]
+                if rest:
+                    expr, stack[-1] = rest
+                    break
+                else:
+                    stack.pop()
+                    flat.append(LIST_END)
+            else:
+                # Finished this parse tree
+                break
+    return flat
+
+
+def unflatten(flat_exprs):
+    """Rebuild a list of parse trees from their flattened form."""
+    exprs = []
+    stack = []
+    items = exprs
+    for item in flat_exprs:
+        if item is LIST_START:
+            stack.append(items)
+            items = []
+        elif item is LIST_END:
+            expr = build_list(items)
+            items = stack.pop()
+            items.append(expr)
+        else:
+            items.append(item)
+    return exprs
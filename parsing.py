@@ -1,32 +1,64 @@
 
+import sys
+import re
+
 import cfg
+from arraylist import build_list
+
+
+# A single regular expression recognizes every kind of token; the
+# name of the group that matched tells scan() what it has found
+_special = re.escape(cfg.SPECIAL_CHARS)
+_delim = re.escape(cfg.TOKEN_DELIMITER)
+_quote = re.escape(cfg.STRING_DELIMITER)
+_escape = re.escape(cfg.STRING_ESCAPE_CHAR)
+TOKEN_REGEX = re.compile(
+    # Whitespace--ignore
+    r"(?P<whitespace>[%s]+)" % re.escape(cfg.WHITESPACE)
+    # Comment--runs till newline
+    + r"|(?P<comment>%s[^\n]*)" % re.escape(cfg.LINE_COMMENT_CHAR)
+    # Start of a block comment--this will be handled by the parser
+    + r"|(?P<block_comment>%s)" % re.escape(cfg.BLOCK_COMMENT_OPEN)
+    # Reserved symbol
+    + r"|(?P<symbol>[%s])" % re.escape(cfg.SYMBOLS)
+    # Extended token: any characters except a lone delimiter, with an
+    # optional closing delimiter (missing if the token is unterminated)
+    + r"|(?P<extended>%s[^%s]*(?:%s%s[^%s]*)*(?P<extended_end>%s)?)"
+      % (_delim, _delim, _delim, _delim, _delim, _delim)
+    # Literal string: any characters except newline, with escape
+    # sequences kept together; if it isn't terminated by a delimiter,
+    # it may end with a dangling escape character before the newline
+    + r"|(?P<string>%s[^%s%s\n]*(?:%s[^\n][^%s%s\n]*)*"
+      r"(?:(?P<string_end>%s)|(?P<string_escape>%s))?)"
+      % (_quote, _quote, _escape, _escape, _quote, _escape, _quote,
+         _escape)
+    # Regular, non-extended token (name or literal)
+    + r"|(?P<token>[^%s]+)" % _special
+)
+
+# Escape sequences in string literals and what they stand for; any
+# other escape sequence is left as-is
+STRING_ESCAPE_REGEX = re.compile(r"%s(.)" % _escape, re.DOTALL)
+STRING_ESCAPES = {cfg.STRING_ESCAPE_CHAR: cfg.STRING_ESCAPE_CHAR,
+                  cfg.STRING_DELIMITER: cfg.STRING_DELIMITER,
+                  "n": "\n",
+                  "t": "\t",
+                  }
 
 
 def scan(code):
-    """Take a string and yield a series of tokens."""
-    # Add a newline to the end to allow peeking at the next character
-    # without requiring a check for end-of-string
-    code += "\n"
-    i = 0
-    while i < len(code):
-        char = code[i]
-        if char in cfg.WHITESPACE:
-            # Whitespace--ignore
-            pass
-        elif char == cfg.LINE_COMMENT_CHAR:
-            # Start of a comment--scan till newline
-            while code[i+1] != "\n":
-                i += 1
-        elif code[i:i+2] == cfg.BLOCK_COMMENT_OPEN:
-            # Start of a block comment--this will be handled by the
-            # parser
-            yield code[i:i+2]
-            i += 1
-        elif char in cfg.SYMBOLS:
-            # Reserved symbol
-            yield char
-        elif char == cfg.TOKEN_DELIMITER:
-            # Start of an extended token--scan till the end of it
+    """Take a string and yield a series of tokens.
+
+Names and other regular tokens are interned, so that repeated names
+share a single string object and compare quickly.
+"""
+    for match in TOKEN_REGEX.finditer(code):
+        kind = match.lastgroup
+        if kind == "token":
+            yield sys.intern(match.group())
+        elif kind == "symbol" or kind == "block_comment":
+            yield match.group()
+        elif kind == "extended":
             # An extended token looks like:
             #  `chars ``and`` backtick pairs`
             # which represents this token:
@@ -35,64 +67,32 @@ def scan(code):
             # special characters such as ( )"; in tokens
             # TBD: how should a token be displayed that contains
             # literal newlines?
-            a = i
-            try:
-                while code[i] == cfg.TOKEN_DELIMITER:
-                    while code[i+1] != cfg.TOKEN_DELIMITER:
-                        i += 1
-                    i += 2
-            except IndexError:
-                # code[i+1] is past the end of the token; in this
-                # case, code[i] is the final newline, so yield
-                # everything but the newline, with a supplied
-                # closing delimiter, as the extended token
-                cfg.warn("unterminated backtick-enclosed token")
-                yield code[a:i] + cfg.TOKEN_DELIMITER
+            if match.group("extended_end"):
+                yield match.group()
             else:
-                # For properly terminated extended tokens, the while
-                # loop takes us past the closing delimiter, so
-                # back up a notch and then yield the token
-                i -= 1
-                yield code[a:i+1]
-        elif char == cfg.STRING_DELIMITER:
-            # Start of a literal string--scan till the end of it
+                # The closing delimiter is missing and the token has
+                # run to the end of the code; supply the delimiter
+                cfg.warn("unterminated backtick-enclosed token")
+                yield match.group() + cfg.TOKEN_DELIMITER
+        elif kind == "string":
             # A literal string looks like:
             #  "chars \"and\" escapes"
             # which represents this string:
             #  chars "and" escapes
             # This will be parsed as a (possibly extended) token,
             # quoted with q.
-            a = i
-            i += 1
-            while code[i] != cfg.STRING_DELIMITER:
-                if code[i] == "\n":
-                    cfg.warn("unterminated string literal")
-                    yield code[a:i] + cfg.STRING_DELIMITER
-                    i -= 1
-                    break
-                elif code[i] == cfg.STRING_ESCAPE_CHAR:
-                    if code[i+1] == "\n":
-                        cfg.warn("unterminated string literal")
-                        yield (code[a:i+1]
-                               + cfg.STRING_ESCAPE_CHAR
-                               + cfg.STRING_DELIMITER)
-                        break
-                    else:
-                        # Include the whole escape sequence together
-                        i += 2
-                else:
-                    # Include a single character
-                    i += 1
+            if match.group("string_end"):
+                yield match.group()
             else:
-                yield code[a:i+1]
-        else:
-            # Start of a regular, non-extended token (name or literal)
-            # Scan till the end of it
-            a = i
-            while code[i+1] not in cfg.SPECIAL_CHARS:
-                i += 1
-            yield code[a:i+1]
-        i += 1
+                # The string ran into a newline before its closing
+                # delimiter; supply the delimiter (completing the
+                # escape sequence first, if there is a dangling one)
+                cfg.warn("unterminated string literal")
+                token = match.group()
+                if match.group("string_escape"):
+                    token += cfg.STRING_ESCAPE_CHAR
+                yield token + cfg.STRING_DELIMITER
+        # Whitespace and comments are ignored
 
 
 def parse(code):
@@ -115,7 +115,7 @@ Each resulting parse tree is an Appleseed list (i.e. nested tuples).
             elif token == cfg.BLOCK_COMMENT_OPEN:
                 # After a block comment opener, parse expressions until
                 # the matching closing parenthesis and discard
-                parse_expressions(code)
+                parse_expressions(code, discard=True)
             elif token == ")":
                 cfg.warn("unmatched closing parenthesis")
             else:
@@ -125,34 +125,163 @@ Each resulting parse tree is an Appleseed list (i.e. nested tuples).
         pass
     
 
-def parse_expressions(code):
+def parse_lines(lines, max_pending=None):
+    """Take an iterable of lines of code, yield a series of parse trees.
+
+Each parse tree is yielded as soon as the lines that make it up have
+been read, so the code can be executed while it is still being read.
+The results are the same as parsing all the lines at once in the way
+Program.parse_code does: if any line contains more closing parens than
+opening parens, the code is in multiline form and is parsed as a whole;
+otherwise each line is parsed separately.
+To be parsed the same way in either form, a line must begin and end
+outside of any s-expression. Such lines are parsed right away. Lines
+that leave an s-expression open are held until the s-expression is
+closed at the end of a line and the code is known to be in multiline
+form (which a line with extra closing parens, such as the one that
+finishes off a multiline s-expression, shows); or until the end of the
+code, at which point they are parsed as single-line form.
+No more than max_pending bytes of code (cfg.MAX_PENDING_CODE_SIZE by
+default) are held. Past that, an error is given and the held lines are
+parsed in the form the code is known to be in so far--single-line form,
+unless a line has shown it to be multiline--and in single-line form,
+each line after that is parsed as soon as it is read. In that case, the
+results can differ from those of parsing the code all at once.
+"""
+    if max_pending is None:
+        max_pending = cfg.MAX_PENDING_CODE_SIZE
+    multiline = False
+    # Set once the code has been taken to be in single-line form
+    single_line = False
+    pending = []
+    pending_size = 0
+    # Parenthesis depth at the end of the pending lines, and whether
+    # they end partway through a backtick-enclosed token
+    depth = 0
+    in_token = False
+    newline_at_end = False
+    for line in lines:
+        newline_at_end = line.endswith("\n")
+        if newline_at_end:
+            line = line[:-1]
+        if single_line:
+            yield from parse(line)
+            continue
+        if line.count(")") > line.count("("):
+            multiline = True
+        if in_token:
+            # The token might continue through this line, so the
+            # pending code has to be scanned again as a whole
+            pending.append(line)
+            depth, in_token = paren_depth("\n".join(pending))
+        elif pending:
+            pending.append(line)
+            depth, in_token = paren_depth(line, depth)
+        else:
+            depth, in_token = paren_depth(line)
+            if depth == 0 and not in_token:
+                # A line on its own: same results in either form
+                yield from parse(line)
+                continue
+            pending.append(line)
+        pending_size += len(line) + 1
+        if multiline and depth == 0 and not in_token:
+            yield from parse("\n".join(pending))
+            pending = []
+            pending_size = 0
+        elif pending_size > max_pending:
+            cfg.error("s-expression still open after", pending_size,
+                      "bytes of code; parsing the code up to here in",
+                      "multiline" if multiline else "single-line", "form")
+            if multiline:
+                yield from parse("\n".join(pending))
+            else:
+                single_line = True
+                for line in pending:
+                    yield from parse(line)
+            pending = []
+            pending_size = 0
+            depth = 0
+            in_token = False
+    if pending and newline_at_end:
+        # The code ended with a newline, which can matter to a
+        # backtick-enclosed token that runs to the end
+        pending.append("")
+    if multiline:
+        yield from parse("\n".join(pending))
+    else:
+        for line in pending:
+            yield from parse(line)
+
+
+def paren_depth(code, depth=0):
+    """Track how deeply nested in parentheses a piece of code ends up.
+
+Starting from the given depth, return the depth at the end of the
+code, and whether the code ends partway through a backtick-enclosed
+token. Unmatched closing parentheses are ignored, as in the parser.
+Unlike scan(), this gives no warnings.
+"""
+    for match in TOKEN_REGEX.finditer(code):
+        kind = match.lastgroup
+        if kind == "block_comment":
+            depth += 1
+        elif kind == "symbol":
+            if match.group() == "(":
+                depth += 1
+            elif depth > 0:
+                depth -= 1
+        elif kind == "extended" and not match.group("extended_end"):
+            return depth, True
+    return depth, False
+
+
+def parse_expressions(code, discard=False):
     """Take a token iterator and parse expressions from it until ).
 
 This function assumes we're parsing an s-expression and that the
 opening parenthesis has already been processed. So we parse the items
-or [sub]expressions in the s-expr one after the other, turning them
-into a cons list of nested tuples. When we go to parse another item
-and we find a closing parenthesis, we've hit the end of the s-expr, so
-we return nil.
+or [sub]expressions in the s-expr one after the other, collecting them
+until we find the closing parenthesis that ends the s-expr; then we
+turn them into a cons list of nested tuples, built from the end
+backwards. Unfinished subexpressions are kept on an explicit stack
+rather than in recursive calls, so lists of any length and depth can
+be parsed.
+If discard is true, the s-expr is a block comment: it is parsed to
+find where it ends, but no list is built and None is returned.
 """
-    try:
-        token = next(code)
-    except StopIteration:
-        # If the s-expression is unfinished and we've run out of tokens,
-        # supply the missing close-paren
-        # TODO: some kind of warning about implicit close-parens
-        token = ")"
-    if token == ")":
-        return cfg.nil
-    elif token == "(":
-        # The subexpression is itself a list
-        expr = parse_expressions(code)
-    elif token == cfg.BLOCK_COMMENT_OPEN:
-        rest_of_comment = parse_expressions(code)
-        return parse_expressions(code)
-    else:
-        expr = parse_name_or_literal(token)
-    return (expr, parse_expressions(code))
+    # Each stack entry holds the items parsed so far in an enclosing
+    # s-expr, and whether that s-expr is (part of) a block comment
+    stack = []
+    items = []
+    while True:
+        try:
+            token = next(code)
+        except StopIteration:
+            # If the s-expression is unfinished and we've run out of
+            # tokens, supply the missing close-paren
+            # TODO: some kind of warning about implicit close-parens
+            token = ")"
+        if token == ")":
+            # End of the current s-expression
+            if discard:
+                expr = None
+            else:
+                expr = build_list(items)
+            if not stack:
+                return expr
+            # Resume parsing the enclosing s-expression
+            items, discard = stack.pop()
+            if expr is not None:
+                items.append(expr)
+        elif token == "(" or token == cfg.BLOCK_COMMENT_OPEN:
+            # Start of a subexpression, which is itself a list; a block
+            # comment is parsed the same way but then left out
+            stack.append((items, discard))
+            items = []
+            discard = discard or token == cfg.BLOCK_COMMENT_OPEN
+        elif not discard:
+            items.append(parse_name_or_literal(token))
 
 
 def parse_name_or_literal(token):
@@ -161,28 +290,13 @@ def parse_name_or_literal(token):
         # Strip the delimiters from the outside
         token = token[1:-1]
         # Replace the escape sequences
-        i = 0
-        string = ""
-        while i < len(token):
-            if token[i] == cfg.STRING_ESCAPE_CHAR:
-                i += 1
-                if token[i] in [cfg.STRING_ESCAPE_CHAR,
-                                cfg.STRING_DELIMITER]:
-                    string += token[i]
-                elif token[i] == "n":
-                    string += "\n"
-                elif token[i] == "t":
-                    string += "\t"
-                else:
-                    string += cfg.STRING_ESCAPE_CHAR + token[i]
-            else:
-                string += token[i]
-            i += 1
+        string = STRING_ESCAPE_REGEX.sub(replace_escape, token)
         return ("q", (string, ()))
     if token.startswith(cfg.TOKEN_DELIMITER):
         # `Extended `` token`
         token = token[1:-1]
         token = token.replace(cfg.TOKEN_DELIMITER * 2, cfg.TOKEN_DELIMITER)
+        token = sys.intern(token)
     if token.isdigit() or token.startswith("-") and token[1:].isdigit():
         # Integer literal
         return int(token)
@@ -193,3 +307,8 @@ def parse_name_or_literal(token):
         # If it's not any kind of recognized literal, it's a name
         return token
 
+
+def replace_escape(match):
+    """Give the replacement for an escape sequence in a string literal."""
+    char = match.group(1)
+    return STRING_ESCAPES.get(char, cfg.STRING_ESCAPE_CHAR + char)
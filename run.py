@@ -1,15 +1,23 @@
 
+import sys
+import os
+
 import cfg
 import version
 import builtin_events
 from execution import Program
+from snapshots import DEFAULT_SNAPSHOT
 
 
 def run_file(filename, environment=None):
     if environment is None:
-        environment = Program(repl=False)
+        environment = Program(repl=False, snapshot=DEFAULT_SNAPSHOT)
     try:
         with open(filename) as f:
+            if os.fstat(f.fileno()).st_size > cfg.STREAMING_FILE_SIZE:
+                # Big files are executed as they are read
+                run_stream(f, environment)
+                return
             code = f.read()
     except FileNotFoundError:
         cfg.error("could not find", filename)
@@ -21,14 +29,43 @@ def run_file(filename, environment=None):
         cfg.error("could not read", filename)
         return
     # If file read was successful, execute the code
-    run_program(code, environment)
+    run_program(code, environment, path=filename)
 
 
-def run_program(code, environment=None):
+def run_program(code, environment=None, path=None):
     if environment is None:
-        environment = Program(repl=False)
+        environment = Program(repl=False, snapshot=DEFAULT_SNAPSHOT)
+    if path is not None:
+        # The code came from a file, so its parse can be cached
+        run_with_events(environment, environment.execute_file, path, code)
+    else:
+        run_with_events(environment, environment.execute, code)
+
+
+def run_stream(stream, environment=None):
+    """Run code from a file or pipe, executing it as it is read.
+
+Lines that leave an s-expression open are held back until it closes;
+see parsing.parse_lines for what happens if more than
+cfg.MAX_PENDING_CODE_SIZE bytes of them pile up.
+"""
+    if environment is None:
+        environment = Program(repl=False, snapshot=DEFAULT_SNAPSHOT)
+
+    def execute_stream():
+        environment.execute_stream(stream)
+        if stream is sys.stdin:
+            # All the code has been read from stdin, so now the
+            # program can take user input from the terminal
+            reopen_terminal_stdin()
+
+    run_with_events(environment, execute_stream)
+
+
+def run_with_events(environment, execute, *args):
+    """Execute code by calling execute(*args), then run the event loop."""
     try:
-        environment.execute(code)
+        execute(*args)
         # If code execution was successful, begin event loop
         builtin_events.event_loop(environment)
     except KeyboardInterrupt:
@@ -44,11 +81,34 @@ def run_program(code, environment=None):
         return
 
 
+def reopen_terminal_stdin():
+    """Reset stdin to the terminal after reading piped-in code."""
+    if os.name == "posix":
+        try:
+            terminal_stdin = open("/dev/tty", "r")
+        except OSError:
+            # This system doesn't have a terminal; we just leave
+            # stdin alone and let any user input actions in the
+            # program fail
+            # TODO: more graceful ways to handle this?
+            pass
+        else:
+            sys.stdin = terminal_stdin
+    elif os.name == "nt":
+        try:
+            terminal_stdin = open("CONIN$", "r")
+        except OSError:
+            pass
+        else:
+            sys.stdin = terminal_stdin
+
+
 def repl(environment=None):
     print("Appleseed", version.VERSION)
     print("Type (help) for information")
     if environment is None:
-        environment = Program(repl=True, max_list_items=20)
+        environment = Program(repl=True, max_list_items=20,
+                              snapshot=DEFAULT_SNAPSHOT)
     instruction = input_instruction()
     while True:
         try:
@@ -0,0 +1,116 @@
+
+import os
+import pickle
+
+import version
+from parse_cache import file_stats
+
+
+# Snapshot files written by a different interpreter version, or in a
+# different format, are ignored
+SNAPSHOT_FORMAT = 4
+MAGIC = "appleseed-snapshot-%s-%d" % (version.VERSION, SNAPSHOT_FORMAT)
+
+# Where the command-line interpreter keeps its snapshot of the
+# environment with the standard library loaded
+DEFAULT_SNAPSHOT = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                                "__aslcache__", "library.snapshot")
+
+
+class SnapshotPickler(pickle.Pickler):
+    """Pickles an environment's names, referring to the environment.
+
+Builtins are bound methods of the Program, and thunks keep a reference
+to it; neither can be pickled directly. Instead, they are stored as
+references that are resolved against the Program being restored.
+"""
+    def __init__(self, file, environment):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.environment = environment
+
+    def persistent_id(self, obj):
+        if obj is self.environment:
+            return "environment"
+        elif hasattr(obj, "is_macro") and obj in self.environment.builtins:
+            return ("builtin", obj.name)
+        else:
+            return None
+
+
+class SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, file, environment):
+        super().__init__(file)
+        self.environment = environment
+
+    def persistent_load(self, pid):
+        if pid == "environment":
+            return self.environment
+        elif pid[0] == "builtin":
+            return getattr(self.environment, pid[1])
+        else:
+            raise pickle.UnpicklingError("unknown reference %r" % (pid,))
+
+
+def builtin_names(environment):
+    """List the builtins of an environment, for checking snapshots.
+
+A snapshot taken by an interpreter with a different set of builtins
+can't be used, since its names would be missing some of them.
+"""
+    return sorted(builtin.name for builtin in environment.builtins)
+
+
+def save(environment, path):
+    """Write a snapshot of an environment's global names and modules.
+
+The snapshot records the modification time and size of every module
+that has been loaded, so that it can be rejected once any of them
+changes. The file is written atomically; if it can't be written,
+nothing happens.
+"""
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        header = (MAGIC, builtin_names(environment),
+                  file_stats(environment.modules))
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(temp_path, "wb") as f:
+                pickle.dump(header, f)
+                pickler = SnapshotPickler(f, environment)
+                pickler.dump(environment.global_names)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    except (OSError, pickle.PicklingError, RecursionError):
+        # Snapshots are only an optimization, so give up quietly
+        pass
+
+
+def restore(environment, path):
+    """Restore an environment's global names and modules from a snapshot.
+
+Return True if the snapshot was restored; False if there is no usable
+snapshot, in which case the environment is left untouched.
+"""
+    try:
+        with open(path, "rb") as f:
+            magic, builtins, stats = pickle.load(f)
+            if magic != MAGIC or builtins != builtin_names(environment):
+                return False
+            modules = [module_path for module_path, mtime, size in stats]
+            if file_stats(modules) != stats:
+                # Some module has changed since the snapshot was taken
+                return False
+            unpickler = SnapshotUnpickler(f, environment)
+            global_names = unpickler.load()
+    except Exception:
+        # No snapshot file, or it is unreadable or corrupt in some way
+        return False
+    environment.global_names.clear()
+    environment.global_names.update(global_names)
+    environment.add_native_versions()
+    environment.modules = modules
+    return True
@@ -0,0 +1,489 @@
+from itertools import chain, count, cycle, islice
+
+from cfg import nil
+from natives import NATIVE_CHUNK_SIZE
+from thunk import Thunk, resolve_thunks
+
+
+# What an iterator gives when it has run out
+END = object()
+
+
+class RangeSource:
+    """The Ints from lower up to upper, or on up forever if upper is None."""
+    __slots__ = ("lower", "upper")
+    # Working out the items doesn't run any Appleseed code
+    pure = True
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+
+    def items(self, start=0):
+        """Return an iterator over the items after the first start ones."""
+        if self.upper is None:
+            return count(self.lower + start)
+        return iter(range(self.lower + start, self.upper + 1))
+
+    def rest(self, taken):
+        """Return the source of the items after the first taken ones."""
+        if self.upper is not None and self.lower + taken > self.upper:
+            return None
+        return RangeSource(self.lower + taken, self.upper)
+
+
+class CycleSource:
+    """The items of prefix, and then those of values over and over."""
+    __slots__ = ("prefix", "values")
+    pure = True
+
+    def __init__(self, prefix, values):
+        self.prefix = prefix
+        self.values = values
+
+    def items(self, start=0):
+        return islice(chain(self.prefix, cycle(self.values)), start, None)
+
+    def rest(self, taken):
+        if taken < len(self.prefix):
+            return CycleSource(self.prefix[taken:], self.values)
+        start = (taken - len(self.prefix)) % len(self.values)
+        return CycleSource(self.values[start:], self.values)
+
+
+class ZipSource:
+    """The results of call on the items of several Streams, side by side.
+
+The Streams are all pure, so each can be started again for the zip; the
+calls are made once for each item, when the zipped Stream is resolved.
+"""
+    __slots__ = ("streams", "call")
+    pure = False
+
+    def __init__(self, streams, call):
+        self.streams = streams
+        self.call = call
+
+    def items(self):
+        return ZipItems([stream.items() for stream in self.streams],
+                        self.call)
+
+
+class ListSource:
+    """The items of a Stream that isn't pure, read from its cells.
+
+Each Stream made from one that isn't pure reads its items this way, so
+they are worked out once, however many lists are made from it.
+"""
+    __slots__ = ("ls",)
+    pure = False
+
+    def __init__(self, ls):
+        self.ls = ls
+
+    def items(self):
+        return ListItems(self.ls)
+
+
+# The iterators below work out an item in steps that may each run
+# Appleseed code, which can be interrupted by an exception; an iterator
+# only moves on once the whole item has been worked out, so that the
+# next attempt carries on with the same item, as resolving the thunk
+# for it again would in Appleseed.
+
+class ListItems:
+    """Iterate over the items of a list, resolving its cells on the way."""
+    __slots__ = ("ls",)
+
+    def __init__(self, ls):
+        self.ls = ls
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # The list is (the rest of) a Stream, so it's a proper list
+        ls = resolve_thunks(self.ls)
+        if not ls:
+            raise StopIteration
+        self.ls = ls[1]
+        return ls[0]
+
+
+class ZipItems:
+    """Iterate over the results of call on the items of the iterators."""
+    __slots__ = ("iterators", "call", "column")
+
+    def __init__(self, iterators, call):
+        self.iterators = iterators
+        self.call = call
+        self.column = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Like transpose, take an item from each list in turn, stopping
+        # at the first list that has run out
+        if self.iterators is None:
+            raise StopIteration
+        column = self.column
+        while len(column) < len(self.iterators):
+            item = next(self.iterators[len(column)], END)
+            if item is END:
+                self.iterators = None
+                raise StopIteration
+            column.append(item)
+        return_val = self.call(*column)
+        self.column = []
+        return return_val
+
+
+def pipeline_items(source, stages, start=0):
+    """Start a pipeline, and return an iterator over its items.
+
+The first start items are skipped; this is only done for pure pipelines,
+which are started again after an exception. Stages don't run any
+Appleseed code then, so where there are any, the items are worked out
+and dropped; otherwise the source skips them itself.
+"""
+    if start and not stages:
+        return source.items(start)
+    items = source.items()
+    for stage, args in stages:
+        items = stage(items, *args)
+    if start:
+        return islice(items, start, None)
+    return items
+
+
+class TakeItems:
+    """The first remaining items, for take."""
+    __slots__ = ("items", "remaining")
+    pure = True
+
+    def __init__(self, items, remaining):
+        self.items = items
+        self.remaining = remaining
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # As with take, the next item is found before the count is
+        # checked
+        item = next(self.items)
+        if self.remaining <= 0:
+            self.items = iter(())
+            raise StopIteration
+        self.remaining -= 1
+        return item
+
+
+class MapItems:
+    """The results of call on each item, for map."""
+    __slots__ = ("items", "call", "item")
+    pure = False
+
+    def __init__(self, items, call):
+        self.items = items
+        self.call = call
+        self.item = END
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.item is END:
+            self.item = next(self.items)
+        return_val = self.call(self.item)
+        self.item = END
+        return return_val
+
+
+class FilterItems:
+    """The items that call is true for (or, if not keep, false for)."""
+    __slots__ = ("items", "call", "keep", "is_true", "item")
+    pure = False
+
+    def __init__(self, items, call, keep, is_true):
+        self.items = items
+        self.call = call
+        self.keep = keep
+        self.is_true = is_true
+        self.item = END
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            if self.item is END:
+                self.item = next(self.items)
+            item = self.item
+            kept = self.is_true(self.call(item)) == self.keep
+            self.item = END
+            if kept:
+                return item
+
+
+class TakeWhileItems:
+    """The items up to the first one that call is false for."""
+    __slots__ = ("items", "call", "is_true", "item")
+    pure = False
+
+    def __init__(self, items, call, is_true):
+        self.items = items
+        self.call = call
+        self.is_true = is_true
+        self.item = END
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.item is END:
+            self.item = next(self.items)
+        item = self.item
+        if not self.is_true(self.call(item)):
+            self.items = iter(())
+            raise StopIteration
+        self.item = END
+        return item
+
+
+class DropWhileItems:
+    """The items from the first one that call is false for on."""
+    __slots__ = ("items", "call", "is_true", "item", "dropping")
+    pure = False
+
+    def __init__(self, items, call, is_true):
+        self.items = items
+        self.call = call
+        self.is_true = is_true
+        self.item = END
+        self.dropping = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.dropping:
+            if self.item is END:
+                self.item = next(self.items)
+            item = self.item
+            if not self.is_true(self.call(item)):
+                self.dropping = False
+            self.item = END
+            if not self.dropping:
+                return item
+        return next(self.items)
+
+
+class Stream(Thunk):
+    """A lazy list made by native list functions that can be fused.
+
+A Stream stands for a list whose items come from a source (a range of
+Ints, a list cycled forever, several Streams zipped together, or the
+cells of another Stream) and then go through a series of stages, each
+an iterator that does the work of map, filter, take, and so on. Until
+it is resolved, nothing has been worked out; so the native versions of
+those functions, given a Stream that hasn't been resolved, return a new
+Stream with one more stage instead of a list, and foldl runs a pure
+pipeline straight through, without building any list cells.
+
+A Stream is pure if working out its items runs no Appleseed code, as
+with ranges, cycles, and take; its items can then be worked out as
+often as they are needed, by each chain made from it, without anyone
+being able to tell. A stage is only added to a pure Stream. A Stream
+that isn't pure (one with a map or filter stage, or a zip) makes its
+calls when it is resolved, into cells, once; a stage added to it goes
+on a new Stream that reads the items from those cells, so every list
+made from it shares them.
+
+When a Stream is resolved, the pipeline is started. A bare range or
+cycle gives a chunk of cells, ending with a Stream for the rest that
+can still be fused; anything else gives a LiveStream, which gives the
+cells as it is resolved in turn (one at a time, if the Stream isn't
+pure, so that no Appleseed code runs before it would have).
+"""
+    __slots__ = ("source", "stages", "pure")
+
+    def __init__(self, environment, source, stages=()):
+        super().__init__(environment, None, None, None)
+        self.source = source
+        self.stages = stages
+        self.pure = source.pure and all(stage.pure for stage, args in stages)
+
+    def __eq__(self, value):
+        if self is value:
+            return True
+        elif (isinstance(value, Stream) and self.environment is not None
+                and value.environment is not None):
+            return False
+        return super().__eq__(value)
+
+    def __str__(self):
+        if self.environment is None:
+            return "Stream(resolved to %s)" % (self.resolved,)
+        return "Stream(%s, %d stages)" % (type(self.source).__name__,
+                                          len(self.stages))
+
+    def set_result(self, value):
+        super().set_result(value)
+        self.source = None
+        self.stages = None
+
+    def with_stage(self, stage, *args):
+        """Return a Stream that passes the items through one more stage.
+
+The stage is an iterator class, which is called with an iterator over
+the items so far and the args. If this Stream isn't pure, the new
+Stream reads its items from this one's cells.
+"""
+        if self.pure:
+            return Stream(self.environment, self.source,
+                          self.stages + ((stage, args),))
+        return Stream(self.environment, ListSource(self), ((stage, args),))
+
+    def items(self):
+        """Start the pipeline, and return an iterator over its items."""
+        return pipeline_items(self.source, self.stages)
+
+    def counts_up_from(self, number):
+        """Tell whether this is the Ints from number on up, unchanged."""
+        source = self.source
+        return (not self.stages and isinstance(source, RangeSource)
+                and source.lower == number and source.upper is None)
+
+    def resolve(self):
+        if self.resolved is not None:
+            return self.resolved
+        environment = self.environment
+        if not self.stages and self.source.pure:
+            # A bare range or cycle: build a chunk of cells, and leave
+            # the rest to a Stream that can still be fused
+            taken = list(islice(self.source.items(), NATIVE_CHUNK_SIZE))
+            rest = self.source.rest(len(taken))
+            if rest is None:
+                return_val = nil
+            else:
+                return_val = Stream(environment, rest)
+            for item in reversed(taken):
+                return_val = (item, return_val)
+        elif self.pure:
+            return_val = LiveStream(environment, self.items(), 0,
+                                    self.source, self.stages)
+        else:
+            # The LiveStream is returned unresolved, like a tail call,
+            # so that this Stream already has it if working out the
+            # first item is interrupted
+            return_val = LiveStream(environment, self.items(), 0)
+        self.set_result(return_val)
+        return return_val
+
+
+class LiveStream(Thunk):
+    """The rest of a Stream whose pipeline has been started.
+
+It takes the next item from the running pipeline when it is resolved
+(or, if the pipeline is pure, the next chunk of them). Live streams
+can't be fused, since their pipeline has already got going.
+
+If the pipeline is interrupted by an exception, or by resolving an item
+needing the very cell that it is the head of (which would recurse
+forever), the next attempt carries on with the item it was working
+out. A pure pipeline runs no Appleseed code, so only something like a
+KeyboardInterrupt can stop it, between any two steps of its iterators;
+so it is given its source and stages, and is started again from them,
+skipping the items that were already given.
+"""
+    __slots__ = ("source", "stages", "iterator", "position", "running")
+
+    def __init__(self, environment, iterator, position, source=None,
+                 stages=None):
+        super().__init__(environment, None, None, None)
+        self.iterator = iterator
+        self.position = position
+        self.source = source
+        self.stages = stages
+        self.running = False
+
+    def __eq__(self, value):
+        if self is value:
+            return True
+        elif (isinstance(value, LiveStream) and self.environment is not None
+                and value.environment is not None):
+            return False
+        return super().__eq__(value)
+
+    def __str__(self):
+        if self.environment is None:
+            return "LiveStream(resolved to %s)" % (self.resolved,)
+        return "LiveStream(at item %d)" % (self.position,)
+
+    def set_result(self, value):
+        super().set_result(value)
+        self.source = None
+        self.stages = None
+        self.iterator = None
+
+    def resolve(self):
+        if self.resolved is not None:
+            return self.resolved
+        elif self.running:
+            # The Appleseed version would recurse forever here
+            raise RecursionError("stream item depends on itself")
+        pure = self.source is not None
+        if self.iterator is None:
+            self.iterator = pipeline_items(self.source, self.stages,
+                                           self.position)
+        chunk_size = NATIVE_CHUNK_SIZE if pure else 1
+        self.running = True
+        try:
+            taken = list(islice(self.iterator, chunk_size))
+        except BaseException:
+            if pure:
+                self.iterator = None
+            raise
+        finally:
+            self.running = False
+        if len(taken) < chunk_size:
+            return_val = nil
+        else:
+            return_val = LiveStream(self.environment, self.iterator,
+                                    self.position + chunk_size,
+                                    self.source, self.stages)
+        for item in reversed(taken):
+            return_val = (item, return_val)
+        self.set_result(return_val)
+        return return_val
+
+
+def resolve_stream(value):
+    """Resolve value like resolve_thunks, but stop at an unstarted Stream."""
+    while isinstance(value, Thunk):
+        if type(value) is Stream and value.resolved is None:
+            return value
+        value = value.resolve()
+    return value
+
+
+def unstarted_streams(lists):
+    """Return the Streams that lists are, if each is a pure, unstarted one.
+
+The lists are resolved in order, as transpose would resolve their first
+cells. Since resolving a list's first cell could show that it's empty,
+after which the rest wouldn't be resolved at all, a list is only looked
+at if all the ones before it are nonempty; otherwise (or if a list
+isn't a pure Stream) None is returned, and the rest are left alone.
+"""
+    streams = []
+    for ls in lists:
+        if streams and next(streams[-1].items(), END) is END:
+            return None
+        ls = resolve_stream(ls)
+        if type(ls) is not Stream or not ls.pure:
+            return None
+        streams.append(ls)
+    return streams
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests import the interpreter's modules from the top of the repo,
+# and their helpers from this directory
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, TESTS_DIR)
@@ -0,0 +1,57 @@
+"""Run corpora of Appleseed code, for tests that compare two ways of
+running the same code."""
+
+import contextlib
+import io
+import os
+
+from execution import Program
+
+CORPORA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "corpora")
+
+
+def read_corpus(name):
+    """Return the expressions in a corpus file, one per line.
+
+Blank lines and lines starting with a semicolon are skipped.
+"""
+    with open(os.path.join(CORPORA_DIR, name)) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.startswith(";")]
+
+
+def run_corpus(exprs, **options):
+    """Run the expressions in a fresh Program made with options.
+
+Returns a list with an (expression, result, output, errors) tuple for
+each one: result is the repr of its value (or, if running it raised a
+Python exception, the exception's type and message), and output and
+errors are what it wrote to stdout and stderr.
+"""
+    program = Program(max_list_items=50, **options)
+    outcomes = []
+    for expr in exprs:
+        output = io.StringIO()
+        errors = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            with contextlib.redirect_stderr(errors):
+                try:
+                    result = program.asl_repr(program.execute(expr))
+                except Exception as exception:
+                    result = "%s: %s" % (type(exception).__name__,
+                                         exception)
+        outcomes.append((expr, result, output.getvalue(),
+                         errors.getvalue()))
+    return outcomes
+
+
+def differences(outcomes1, outcomes2):
+    """Describe each expression whose outcomes differ, for a test failure."""
+    descriptions = []
+    for outcome1, outcome2 in zip(outcomes1, outcomes2):
+        if outcome1 != outcome2:
+            descriptions.append("%s\n  %r\n  %r" % (outcome1[0],
+                                                    outcome1[1:],
+                                                    outcome2[1:]))
+    return "\n".join(descriptions)
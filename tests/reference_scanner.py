@@ -0,0 +1,104 @@
+
+# The character-by-character scanner and string literal decoder that
+# parsing.py used before the regex scanner replaced them. They are kept
+# here, unchanged, so that the tests can check the new ones against
+# them and the scanner benchmark can compare their speed.
+
+import cfg
+
+
+def scan(code):
+    """Take a string and yield a series of tokens."""
+    # Add a newline to the end to allow peeking at the next character
+    # without requiring a check for end-of-string
+    code += "\n"
+    i = 0
+    while i < len(code):
+        char = code[i]
+        if char in cfg.WHITESPACE:
+            # Whitespace--ignore
+            pass
+        elif char == cfg.LINE_COMMENT_CHAR:
+            # Start of a comment--scan till newline
+            while code[i+1] != "\n":
+                i += 1
+        elif code[i:i+2] == cfg.BLOCK_COMMENT_OPEN:
+            # Start of a block comment--this will be handled by the
+            # parser
+            yield code[i:i+2]
+            i += 1
+        elif char in cfg.SYMBOLS:
+            # Reserved symbol
+            yield char
+        elif char == cfg.TOKEN_DELIMITER:
+            # Start of an extended token--scan till the end of it
+            a = i
+            try:
+                while code[i] == cfg.TOKEN_DELIMITER:
+                    while code[i+1] != cfg.TOKEN_DELIMITER:
+                        i += 1
+                    i += 2
+            except IndexError:
+                cfg.warn("unterminated backtick-enclosed token")
+                yield code[a:i] + cfg.TOKEN_DELIMITER
+            else:
+                i -= 1
+                yield code[a:i+1]
+        elif char == cfg.STRING_DELIMITER:
+            # Start of a literal string--scan till the end of it
+            a = i
+            i += 1
+            while code[i] != cfg.STRING_DELIMITER:
+                if code[i] == "\n":
+                    cfg.warn("unterminated string literal")
+                    yield code[a:i] + cfg.STRING_DELIMITER
+                    i -= 1
+                    break
+                elif code[i] == cfg.STRING_ESCAPE_CHAR:
+                    if code[i+1] == "\n":
+                        cfg.warn("unterminated string literal")
+                        yield (code[a:i+1]
+                               + cfg.STRING_ESCAPE_CHAR
+                               + cfg.STRING_DELIMITER)
+                        break
+                    else:
+                        # Include the whole escape sequence together
+                        i += 2
+                else:
+                    # Include a single character
+                    i += 1
+            else:
+                yield code[a:i+1]
+        else:
+            # Start of a regular, non-extended token (name or literal)
+            # Scan till the end of it
+            a = i
+            while code[i+1] not in cfg.SPECIAL_CHARS:
+                i += 1
+            yield code[a:i+1]
+        i += 1
+
+
+def decode_string(token):
+    """Return the string that a string literal token stands for."""
+    # Strip the delimiters from the outside
+    token = token[1:-1]
+    # Replace the escape sequences
+    i = 0
+    string = ""
+    while i < len(token):
+        if token[i] == cfg.STRING_ESCAPE_CHAR:
+            i += 1
+            if token[i] in [cfg.STRING_ESCAPE_CHAR,
+                            cfg.STRING_DELIMITER]:
+                string += token[i]
+            elif token[i] == "n":
+                string += "\n"
+            elif token[i] == "t":
+                string += "\t"
+            else:
+                string += cfg.STRING_ESCAPE_CHAR + token[i]
+        else:
+            string += token[i]
+        i += 1
+    return string
@@ -0,0 +1,85 @@
+"""Check that lazy_stdlib loads each library module on first use."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from execution import Program
+from thunk import resolve_thunks
+
+
+def run(program, code):
+    return resolve_thunks(program.execute(code))
+
+
+def library_module(name):
+    return os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), "lib", name + ".asl")
+
+
+class AutoloadTest(unittest.TestCase):
+
+    def test_module_loaded_on_first_use(self):
+        program = Program(lazy_stdlib=True)
+        self.assertNotIn(library_module("strings"), program.modules)
+        self.assertEqual(run(program, '(strlen "abcd")'), 4)
+        self.assertIn(library_module("strings"), program.modules)
+        # Modules whose names haven't been used are still not loaded
+        self.assertNotIn(library_module("matrices"), program.modules)
+
+    def test_module_loaded_from_inside_function(self):
+        program = Program(lazy_stdlib=True)
+        program.execute("(def count-row (lambda (n) (length (range n))))")
+        self.assertEqual(run(program, "(count-row 5)"), 5)
+        self.assertIn(library_module("lists"), program.modules)
+        # The module's names are global, not local to the call
+        self.assertEqual(run(program, "(length (list 1 2))"), 2)
+
+    def test_library_names_cant_be_redefined(self):
+        program = Program(lazy_stdlib=True)
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            program.execute("(def transpose 1)")
+        self.assertIn("name transpose already in use", errors.getvalue())
+
+    def test_same_results_as_eager_loading(self):
+        code = "(list (nth 3 (primes)) (join (list \"a\" \"b\") \"-\"))"
+        eager = Program()
+        lazy = Program(lazy_stdlib=True)
+        self.assertEqual(lazy.asl_repr(run(lazy, code)),
+                         eager.asl_repr(eager.execute(code)))
+
+
+class AutoloadIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.program = Program(lazy_stdlib=True)
+        self.program.module_paths[0] = self.directory
+        self.write("library", "(load module)\n")
+        self.module = self.write("module", "(def old-name 1)\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, code, mtime_ns=None):
+        path = os.path.join(self.directory, name + ".asl")
+        with open(path, "w") as f:
+            f.write(code)
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+        return path
+
+    def test_index_is_rebuilt_after_module_changes(self):
+        index = self.program.build_autoload_index("library")
+        self.assertEqual(index, {"old-name": self.module})
+        self.write("module", "(def new-name 1)\n", mtime_ns=2 * 10**18)
+        index = self.program.build_autoload_index("library")
+        self.assertEqual(index, {"new-name": self.module})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+"""Check that the execution engines all agree.
+
+Each corpus is run on the interpreted, compiled, and vm engines, and
+every expression has to give the same value, output, and error messages
+on each of them.
+"""
+
+import unittest
+
+from corpus import read_corpus, run_corpus, differences
+
+ENGINES = ["interpreted", "compiled", "vm"]
+CORPORA = ["engines.txt"]
+
+
+class EngineTest(unittest.TestCase):
+
+    def check_corpus(self, name):
+        exprs = read_corpus(name)
+        expected = run_corpus(exprs, engine=ENGINES[0])
+        for engine in ENGINES[1:]:
+            with self.subTest(corpus=name, engine=engine):
+                actual = run_corpus(exprs, engine=engine)
+                self.assertEqual(actual, expected,
+                                 "%s differs from %s:\n%s"
+                                 % (engine, ENGINES[0],
+                                    differences(actual, expected)))
+
+    def test_corpora(self):
+        for name in CORPORA:
+            self.check_corpus(name)
+
+
+if __name__ == "__main__":
+    unittest.main()
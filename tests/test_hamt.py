@@ -0,0 +1,111 @@
+"""Check the persistent hash map that Objects, Sets, and Maps are kept in."""
+
+import unittest
+
+from hamt import Hamt, BitmapNode, CollisionNode, SUBNODE
+
+
+class Key:
+    """A key with a chosen hash, so that hashes can be made to collide."""
+
+    def __init__(self, name, hash_value):
+        self.name = name
+        self.hash_value = hash_value
+
+    def __hash__(self):
+        return self.hash_value
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and self.name == other.name
+
+    def __repr__(self):
+        return "Key(%r)" % (self.name,)
+
+
+def nodes(node):
+    """Iterate over a node and every node under it."""
+    yield node
+    if type(node) is BitmapNode:
+        for index in range(0, len(node.entries), 2):
+            if node.entries[index] is SUBNODE:
+                yield from nodes(node.entries[index + 1])
+
+
+class HamtTest(unittest.TestCase):
+
+    def test_with_item_and_without(self):
+        empty = Hamt()
+        one = empty.with_item("a", 1)
+        two = one.with_item("b", 2)
+        changed = two.with_item("a", 3)
+        self.assertEqual((len(empty), len(one), len(two)), (0, 1, 2))
+        self.assertEqual(dict(changed.items()), {"a": 3, "b": 2})
+        # The older versions are left as they were
+        self.assertEqual(dict(two.items()), {"a": 1, "b": 2})
+        self.assertNotIn("a", empty)
+        removed = changed.without("a")
+        self.assertEqual(dict(removed.items()), {"b": 2})
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(dict(changed.items()), {"a": 3, "b": 2})
+
+    def test_unchanged_hamt_is_returned(self):
+        hamt = Hamt([("a", 1)])
+        value = hamt.get("a")
+        self.assertIs(hamt.with_item("a", value), hamt)
+        self.assertIs(hamt.without("missing"), hamt)
+        self.assertFalse(hamt.without("a"))
+
+    def test_many_keys(self):
+        hamt = Hamt()
+        for number in range(5000):
+            hamt = hamt.with_item(number, -number)
+        self.assertEqual(len(hamt), 5000)
+        self.assertTrue(all(hamt.get(number) == -number
+                            for number in range(5000)))
+        for number in range(0, 5000, 2):
+            hamt = hamt.without(number)
+        self.assertEqual(sorted(hamt), list(range(1, 5000, 2)))
+        self.assertIsNone(hamt.get(2))
+
+    def test_colliding_keys(self):
+        keys = [Key(name, 12345) for name in "abc"]
+        hamt = Hamt((key, index) for index, key in enumerate(keys))
+        self.assertEqual(len(hamt), 3)
+        self.assertTrue(any(type(node) is CollisionNode
+                            for node in nodes(hamt.root)))
+        self.assertEqual([hamt.get(key) for key in keys], [0, 1, 2])
+        self.assertIsNone(hamt.get(Key("d", 12345)))
+        hamt = hamt.with_item(Key("b", 12345), 10).without(keys[0])
+        self.assertEqual(dict((key.name, value)
+                              for key, value in hamt.items()),
+                         {"b": 10, "c": 2})
+
+    def test_node_collapses_after_deletes(self):
+        # Both keys are in slot 1 of the root, so they go down a level
+        # together; once one of them is gone, the other moves back up
+        first = Key("first", 1)
+        second = Key("second", 1 + (1 << 5))
+        hamt = Hamt([(first, 1), (second, 2)])
+        self.assertIs(hamt.root.entries[0], SUBNODE)
+        hamt = hamt.without(second)
+        self.assertEqual(hamt.root.entries, (first, 1))
+        # Likewise with colliding keys, down at the bottom of the trie
+        keys = [Key(name, 7) for name in "ab"]
+        hamt = Hamt((key, key.name) for key in keys).without(keys[1])
+        self.assertEqual(list(nodes(hamt.root)), [hamt.root])
+        self.assertEqual(hamt.root.entries, (keys[0], "a"))
+
+    def test_iteration_order(self):
+        # Keys are listed in the order of their hashes' slots, whatever
+        # order they were added in
+        numbers = [9, 3, 31, 0, 17]
+        forward = Hamt((number, None) for number in numbers)
+        backward = Hamt((number, None) for number in reversed(numbers))
+        self.assertEqual(list(forward), sorted(numbers))
+        self.assertEqual(list(backward), list(forward))
+        self.assertEqual(list(forward.items()),
+                         [(number, None) for number in sorted(numbers)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Check that the intern table drops cells that are no longer used."""
+
+import time
+import unittest
+
+import hashcons
+from execution import Program
+
+
+def nested_list(items):
+    result = ()
+    for item in reversed(items):
+        result = (item, result)
+    return result
+
+
+class InternTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = hashcons.InternTable()
+
+    def test_equal_lists_are_the_same_cell(self):
+        first = self.table.intern(nested_list([1, (2, ()), "a"]))
+        second = self.table.intern(nested_list([1, (2, ()), "a"]))
+        self.assertIs(first, second)
+        self.assertTrue(self.table.is_interned(first))
+        self.assertEqual(len(self.table), 4)
+
+    def test_sweep_keeps_cells_in_use(self):
+        kept = self.table.intern(nested_list([1, 2, 3]))
+        dropped = self.table.intern(nested_list([(1, ()), (2, ())]))
+        del dropped
+        self.table.sweep()
+        # kept's cells, including its tail, are still interned
+        self.assertEqual(len(self.table), 3)
+        self.assertTrue(self.table.is_interned(kept[1][1]))
+        self.assertIs(self.table.intern(nested_list([2, 3])), kept[1])
+
+    def test_dropped_large_list_is_swept(self):
+        size = 20000
+        value = self.table.intern(nested_list(list(range(size))))
+        self.assertEqual(len(self.table), size)
+        del value
+        self.table.sweep()
+        self.assertEqual(len(self.table), 0)
+        value = self.table.intern(nested_list(list(range(size))))
+        self.assertEqual(len(self.table), size)
+        self.assertIs(self.table.intern(nested_list(list(range(size)))),
+                      value)
+
+    def test_repeated_runs_take_the_same_time(self):
+        # Each run makes a new list, which the last run's list has to
+        # be swept out to make room for
+        program = Program(hash_cons=True, repl=False)
+        times = []
+        for run in range(4):
+            code = "(length (q (%s)))" % " ".join(
+                str(run * 100000 + i) for i in range(12000))
+            start = time.perf_counter()
+            self.assertEqual(program.asl_repr(program.execute(code)),
+                             "12000")
+            times.append(time.perf_counter() - start)
+        self.assertLess(max(times[1:]), 5 * times[0] + 0.1)
+        self.assertLess(len(hashcons.table), 4 * 12000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Check value_key and the Set and Map builtins built on it."""
+
+import contextlib
+import io
+import unittest
+
+from builtin_events import asl_print
+from execution import Program
+from hashed import value_key
+
+
+class HashedTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.program = Program(repl=False)
+
+    def value(self, code):
+        return self.program.execute(code)
+
+    def evaluate(self, code):
+        return self.program.asl_repr(self.program.execute(code))
+
+    def printed(self, code):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            asl_print(self.program.execute(code))
+        return output.getvalue()
+
+    def test_value_key_of_equal_values(self):
+        equal_pairs = [
+            ("(list 1 (list 2 3))", "(q (1 (2 3)))"),
+            # A list that is worked out lazily, and an ArrayList
+            ("(map inc (range 10))", "(q (1 2 3 4 5 6 7 8 9 10))"),
+            ("(object (a 1) (b 2))", "(object (b 2) (a 1))"),
+            ("(hash-set 1 2)", "(hash-set 2 1)"),
+        ]
+        for code1, code2 in equal_pairs:
+            with self.subTest(code1=code1, code2=code2):
+                self.assertEqual(value_key(self.value(code1)),
+                                 value_key(self.value(code2)))
+
+    def test_value_key_of_different_values(self):
+        different_pairs = [
+            ("1", "true"),
+            ("0", "false"),
+            ("(list 1)", "(list true)"),
+            ("(list 1 2)", "(list 2 1)"),
+            ("(q a)", "(hash-set (q a))"),
+            ("(hash-set 1)", "(hash-map 1 1)"),
+        ]
+        for code1, code2 in different_pairs:
+            with self.subTest(code1=code1, code2=code2):
+                self.assertNotEqual(value_key(self.value(code1)),
+                                    value_key(self.value(code2)))
+
+    def test_duplicates_are_removed(self):
+        self.assertEqual(self.evaluate(
+            "(to-list (hash-set (list 1 (list 2 3)) (q (1 (2 3))) 4))"),
+            "((1 (2 3)) 4)")
+        self.assertEqual(self.evaluate(
+            "(size (hash-set (object (a 1) (b 2)) (object (b 2) (a 1))))"),
+            "1")
+        # Items that are delayed calls are compared by their values
+        self.assertEqual(self.evaluate(
+            "(to-list (to-set (map inc (list 1 0 1 2))))"), "(2 1 3)")
+        self.assertEqual(self.evaluate("(size (hash-set 1 true 0 false))"),
+                         "4")
+        self.assertEqual(self.evaluate(
+            "(to-list (hash-map (list 1) (q a) (q (1)) (q b)))"),
+            "(((1) b))")
+
+    def test_to_map_needs_key_value_items(self):
+        for code in ["(to-map (list (list 1 2) 3))",
+                     "(to-map (list (list 1 2 3)))",
+                     "(to-map (list (list 1)))"]:
+            with self.subTest(code=code):
+                errors = io.StringIO()
+                with contextlib.redirect_stderr(errors):
+                    self.assertEqual(self.evaluate(code), "()")
+                self.assertIn("items of a list converted to Map must be"
+                              " (key value) lists", errors.getvalue())
+        self.assertEqual(self.evaluate(
+            "(to-list (to-map (list (list 1 2) (list 3 4))))"),
+            "((1 2) (3 4))")
+
+    def test_print(self):
+        self.assertEqual(self.printed("(hash-set)"), "#set{}\n")
+        self.assertEqual(self.printed("(hash-map)"), "#map{}\n")
+        self.assertEqual(self.printed('(hash-set 1 "a b" (list 2) 1)'),
+                         "#set{1 a b (2)}\n")
+        self.assertEqual(self.printed('(hash-map 1 "a" (list 2) true)'),
+                         "#map{(1 a) ((2) true)}\n")
+        self.assertEqual(self.evaluate('(hash-set 1 "a b" (list 2))'),
+                         "#set{1 `a b` (2)}")
+
+    def test_equal_agrees_with_value_key(self):
+        codes = ["(hash-set)", "(hash-set 1 2)", "(hash-set 2 1)",
+                 "(hash-set 1 true)", "(hash-set (list 1 2))",
+                 "(to-set (q ((1 2))))", "(hash-map)",
+                 "(hash-map 1 2 3 4)", "(hash-map 3 4 1 2)",
+                 "(hash-map 1 2 3 true)", "(hash-map 1 (hash-set 2))",
+                 "(hash-map 1 (to-set (list 2 2)))"]
+        values = [self.value(code) for code in codes]
+        for code1, value1 in zip(codes, values):
+            for code2, value2 in zip(codes, values):
+                with self.subTest(code1=code1, code2=code2):
+                    self.assertEqual(
+                        self.program.asl_equal(value1, value2),
+                        value_key(value1) == value_key(value2))
+
+
+if __name__ == "__main__":
+    unittest.main()
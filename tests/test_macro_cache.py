@@ -0,0 +1,107 @@
+"""Check that macro expansions are cached only when that's safe."""
+
+import unittest
+from unittest import mock
+
+import cfg
+from execution import Program
+from macro_cache import MacroCache
+from thunk import resolve_thunks
+
+MACROS = """
+(def twice (q (0 (x) (list x x))))
+(def with-default (q (0 ((x n)) (list x))))
+(def f (lambda (n) (twice (add n 1))))
+(def g (lambda (n) (with-default)))
+"""
+
+EXPRESSIONS = [
+    "(list (f 1) (f 2) (f 1))",
+    "(list (g 1) (g 2) (g 1))",
+    "(twice (twice 3))",
+    "(with-default 5)",
+]
+
+
+class MacroCacheTest(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = MacroCache(4)
+        macro, raw_args = (0, (("x", ()), ("x", ()))), ("a", ())
+        self.assertIsNone(cache.get(macro, raw_args))
+        cache.put(macro, raw_args, "expansion")
+        self.assertEqual(cache.get(macro, raw_args), "expansion")
+        # An equal argument list at another call site is another entry
+        self.assertIsNone(cache.get(macro, tuple(["a", ()])))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_least_recently_used_entry_is_dropped(self):
+        cache = MacroCache(2)
+        macro = (0, (("x", ()), ("x", ())))
+        args = [("a", ()), ("b", ()), ("c", ())]
+        cache.put(macro, args[0], 0)
+        cache.put(macro, args[1], 1)
+        cache.get(macro, args[0])
+        cache.put(macro, args[2], 2)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(macro, args[1]))
+        self.assertEqual(cache.get(macro, args[0]), 0)
+
+    def test_zero_size_caches_nothing(self):
+        cache = MacroCache(0)
+        macro, raw_args = (0, (("x", ()), ("x", ()))), ("a", ())
+        cache.put(macro, raw_args, "expansion")
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get(macro, raw_args))
+
+
+class MacroExpansionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.program = Program(repl=False)
+        self.program.execute(MACROS)
+        self.program.macro_cache.clear()
+        self.expansions = 0
+        expand_macro = self.program.expand_macro
+
+        def count_expansion(macro, raw_args):
+            self.expansions += 1
+            return expand_macro(macro, raw_args)
+        self.program.expand_macro = count_expansion
+
+    def run_code(self, code):
+        return self.program.asl_repr(resolve_thunks(
+            self.program.execute(code)))
+
+    def test_cached_expansion_is_reused(self):
+        self.assertEqual(self.run_code("(f 1)"), "(2 2)")
+        self.assertEqual(self.expansions, 1)
+        # The call site in f's body is the same, so the expansion is
+        # reused even though n is different
+        self.assertEqual(self.run_code("(list (f 2) (f 3))"),
+                         "((3 3) (4 4))")
+        self.assertEqual(self.expansions, 1)
+        self.assertEqual(self.program.macro_cache.hits, 2)
+
+    def test_default_from_call_site_is_not_cached(self):
+        # with-default's default value is evaluated where it's called,
+        # so its expansion has to be made afresh each time
+        self.assertEqual(self.run_code("(list (g 1) (g 2))"), "((1) (2))")
+        self.assertEqual(self.expansions, 2)
+        self.assertEqual(self.program.macro_cache.hits, 0)
+        self.assertEqual(len(self.program.macro_cache), 0)
+
+    def test_same_results_without_cache(self):
+        with mock.patch.object(cfg, "MACRO_CACHE_SIZE", 0):
+            uncached = Program(repl=False)
+        uncached.execute(MACROS)
+        for code in EXPRESSIONS:
+            with self.subTest(code=code):
+                self.assertEqual(self.run_code(code), uncached.asl_repr(
+                    resolve_thunks(uncached.execute(code))))
+        self.assertGreater(self.program.macro_cache.hits, 0)
+        self.assertEqual(len(uncached.macro_cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Check that the native library functions agree with the Appleseed ones.
+
+Each corpus is run with native_lib on and off, and every expression has
+to give the same value, output, and error messages both ways. The
+compiled engine is used, since it runs the Appleseed definitions the
+fastest (test_engines.py checks that the engines agree).
+"""
+
+import sys
+import unittest
+
+from corpus import read_corpus, run_corpus, differences
+
+CORPORA = ["lists.txt", "math.txt", "strings.txt", "matrices.txt",
+           "chars.txt", "fusion.txt"]
+
+# Some of the Appleseed definitions nest Python calls deeply
+RECURSION_LIMIT = 10000
+
+
+class NativeLibraryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(self.recursion_limit, RECURSION_LIMIT))
+
+    def tearDown(self):
+        sys.setrecursionlimit(self.recursion_limit)
+
+    def check_corpus(self, name):
+        exprs = read_corpus(name)
+        expected = run_corpus(exprs, native_lib=False, engine="compiled")
+        actual = run_corpus(exprs, native_lib=True, engine="compiled")
+        self.assertEqual(actual, expected,
+                         "native functions differ from Appleseed ones:\n%s"
+                         % differences(actual, expected))
+
+    def test_corpora(self):
+        for name in CORPORA:
+            with self.subTest(corpus=name):
+                self.check_corpus(name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+"""Check that Objects compare, repr, and print as they always have.
+
+The expected results are the ones given when Objects were dicts, except
+that an Object whose property is true is no longer equal to one whose
+property is 1 (as value_key already had it).
+"""
+
+import contextlib
+import io
+import unittest
+
+from builtin_events import asl_print
+from execution import Program
+from hashed import value_key
+from objects import Object, EMPTY_SHAPE, MAX_SHAPE_PROPERTIES
+
+POINT = '(object (type (q Point)) (x 1) (y (list 2 "b")))'
+
+
+class ObjectTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.program = Program(repl=False)
+
+    def evaluate(self, code):
+        return self.program.asl_repr(self.program.execute(code))
+
+    def printed(self, code):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            asl_print(self.program.execute(code))
+        return output.getvalue()
+
+    def test_repr(self):
+        self.assertEqual(self.evaluate("(object)"), "{}")
+        self.assertEqual(self.evaluate('(object (b "x") (a (list 1 true)))'),
+                         '{(b x) (a (1 true))}')
+        # The type comes first, wherever it was set
+        self.assertEqual(self.evaluate(POINT),
+                         "{(type Point) (x 1) (y (2 b))}")
+        self.assertEqual(self.evaluate("(copy %s (x 5))" % POINT),
+                         "{(type Point) (x 5) (y (2 b))}")
+
+    def test_print(self):
+        self.assertEqual(self.printed("(object)"), "{}\n")
+        self.assertEqual(self.printed(POINT),
+                         "{(type Point) (x 1) (y (2 b))}\n")
+        self.assertEqual(self.printed('(object (a (object (b "c"))))'),
+                         "{(a {(b c)})}\n")
+
+    def test_equality(self):
+        self.assertEqual(self.evaluate(
+            "(equal? (object (a 1) (b 2)) (object (b 2) (a 1)))"), "true")
+        self.assertEqual(self.evaluate(
+            "(equal? (object (a 1)) (object (a 1) (b 2)))"), "false")
+        self.assertEqual(self.evaluate(
+            "(equal? (object (a (list 1 2))) (object (a (list 1 2))))"),
+            "true")
+        self.assertEqual(self.evaluate(
+            "(equal? (object (a (object (b 1))))"
+            " (object (a (object (b 1)))))"), "true")
+
+    def test_bool_and_int_are_different(self):
+        with_int = Object([("a", 1)])
+        with_bool = Object([("a", True)])
+        self.assertNotEqual(with_int, with_bool)
+        self.assertNotEqual(value_key(with_int), value_key(with_bool))
+        self.assertEqual(self.evaluate(
+            "(equal? (object (a 1)) (object (a true)))"), "false")
+        self.assertEqual(self.evaluate(
+            "(equal? (object (a 0)) (object (a false)))"), "false")
+
+    def test_equality_agrees_with_value_key(self):
+        values = [Object(), Object([("a", 1)]), Object([("a", True)]),
+                  Object([("a", 1), ("b", 2)]), Object([("b", 2), ("a", 1)]),
+                  Object([("a", (1, ()))]), Object([("a", (True, ()))]),
+                  Object([("a", Object([("b", 1)]))])]
+        for value1 in values:
+            for value2 in values:
+                with self.subTest(value1=value1, value2=value2):
+                    self.assertEqual(value1 == value2,
+                                     value_key(value1) == value_key(value2))
+
+
+
+def numbered_object(count, first=0):
+    """Code for an Object with properties p<first> ... p<count - 1>."""
+    return "(object %s)" % " ".join(
+        "(p%d %d)" % (number, number) for number in range(first, count))
+
+
+class ShapeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.program = Program(repl=False)
+
+    def value(self, code):
+        return self.program.execute(code)
+
+    def evaluate(self, code):
+        return self.program.asl_repr(self.program.execute(code))
+
+    def test_shapes_are_shared(self):
+        first = self.value("(object (a 1) (b 2))")
+        second = self.value('(object (a "x") (b (list 3)))')
+        self.assertIs(first.shape, second.shape)
+        self.assertIs(EMPTY_SHAPE.with_name("a").with_name("b"), first.shape)
+        # A copy with a property changed keeps its Shape
+        self.assertIs(self.value("(copy (object (a 1) (b 2)) (b 5))").shape,
+                      first.shape)
+        self.assertIs(EMPTY_SHAPE.with_name("a").transitions["b"],
+                      first.shape)
+
+    def test_property_order(self):
+        forward = self.value("(object (a 1) (b 2) (c 3))")
+        backward = self.value("(object (c 3) (b 2) (a 1))")
+        self.assertIsNot(forward.shape, backward.shape)
+        self.assertEqual(forward, backward)
+        self.assertEqual(self.program.asl_repr(forward), "{(a 1) (b 2) (c 3)}")
+        self.assertEqual(self.program.asl_repr(backward),
+                         "{(c 3) (b 2) (a 1)}")
+        # Changing a property leaves it where it was
+        self.assertEqual(self.evaluate(
+            "(copy (object (c 3) (b 2) (a 1)) (b 5) (d 4))"),
+            "{(c 3) (b 5) (a 1) (d 4)}")
+
+    def test_many_properties_use_hamt(self):
+        count = MAX_SHAPE_PROPERTIES
+        shaped = self.value(numbered_object(count))
+        self.assertIsNotNone(shaped.shape)
+        # One property more than a Shape can hold
+        added = self.value("(copy %s (p%d %d) (p0 -1))"
+                           % (numbered_object(count), count, count))
+        self.assertIsNone(added.shape)
+        self.assertEqual(list(added.items()),
+                         [("p0", -1)] + [("p%d" % number, number)
+                                         for number in range(1, count + 1)])
+        built = self.value(numbered_object(count + 1))
+        self.assertIsNone(built.shape)
+        self.assertEqual(self.program.asl_repr(built),
+                         "{%s}" % " ".join("(p%d %d)" % (number, number)
+                                           for number in range(count + 1)))
+
+    def test_hamt_objects_in_any_order_are_equal(self):
+        count = MAX_SHAPE_PROPERTIES + 8
+        forward = self.value(numbered_object(count))
+        backward = self.value("(object %s)" % " ".join(
+            "(p%d %d)" % (number, number)
+            for number in reversed(range(count))))
+        self.assertIsNone(backward.shape)
+        self.assertEqual(forward, backward)
+        self.assertEqual(list(backward)[:2], ["p%d" % (count - 1),
+                                              "p%d" % (count - 2)])
+        self.assertNotEqual(forward, self.value(
+            "(copy %s (p3 true))" % numbered_object(count)))
+        self.assertEqual(backward.get("p39"), 39)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Check that the parse cache is used, refreshed, and rebuilt correctly.
+
+Each test works on a module file in a temporary directory, so that the
+cache it makes there starts out empty.
+"""
+
+import contextlib
+import io
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+import parse_cache
+from execution import Program
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.program = Program()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "module.asl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, code, mtime_ns=None):
+        with open(self.path, "w") as f:
+            f.write(code)
+        if mtime_ns is not None:
+            os.utime(self.path, ns=(mtime_ns, mtime_ns))
+        return code
+
+    def test_cache_is_written_and_used(self):
+        code = self.write("(def a 1)\n(def b (list a 2))\n")
+        self.assertIsNone(parse_cache.load(self.path, code))
+        exprs = self.program.read_module(self.path)
+        self.assertTrue(os.path.exists(parse_cache.cache_path(self.path)))
+        self.assertEqual(parse_cache.load(self.path, code), exprs)
+
+    def test_stale_cache_is_rebuilt(self):
+        self.write("(def a 1)\n", mtime_ns=10**18)
+        self.program.read_module(self.path)
+        # Same size, different contents and modification time
+        new_code = self.write("(def a 2)\n", mtime_ns=2 * 10**18)
+        self.assertIsNone(parse_cache.load(self.path, new_code))
+        exprs = self.program.read_module(self.path)
+        self.assertEqual(exprs, [("def", ("a", (2, ())))])
+        self.assertEqual(parse_cache.load(self.path, new_code), exprs)
+
+    def test_touched_file_refreshes_header(self):
+        code = self.write("(def a 1)\n", mtime_ns=10**18)
+        exprs = self.program.read_module(self.path)
+        self.write(code, mtime_ns=2 * 10**18)
+        self.assertEqual(parse_cache.load(self.path, code), exprs)
+        with open(parse_cache.cache_path(self.path), "rb") as f:
+            magic, mtime, size, code_digest = marshal.load(f)
+        self.assertEqual(mtime, 2 * 10**18)
+
+    def test_code_with_warnings_is_not_cached(self):
+        code = self.write('(def a "unterminated\n')
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.program.read_module(self.path)
+        self.assertIsNone(parse_cache.load(self.path, code))
+
+    def test_execute_file_uses_new_code(self):
+        self.write("(def cached-value 1)\n", mtime_ns=10**18)
+        program = Program()
+        with open(self.path) as f:
+            program.execute_file(self.path, f.read())
+        self.assertEqual(program.execute("cached-value"), 1)
+        code = self.write("(def cached-value 22)\n", mtime_ns=2 * 10**18)
+        program = Program()
+        program.execute_file(self.path, code)
+        self.assertEqual(program.execute("cached-value"), 22)
+
+
+if __name__ == "__main__":
+    unittest.main()
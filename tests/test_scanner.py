@@ -0,0 +1,79 @@
+"""Check the regex scanner against the character-by-character one.
+
+The snippets in corpora/scanner.txt, the standard library modules, and
+a batch of random strings built from the characters that matter to the
+scanner must all give the same tokens and the same warnings from both.
+String literals must also decode to the same strings.
+"""
+
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import unittest
+
+import cfg
+import parsing
+import reference_scanner
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+LIB_DIR = os.path.join(os.path.dirname(TESTS_DIR), "lib")
+
+# Characters that random snippets are built from: every special
+# character, plus a few ordinary ones
+FUZZ_CHARS = cfg.SPECIAL_CHARS + cfg.STRING_ESCAPE_CHAR + "ab1-nt"
+FUZZ_COUNT = 5000
+FUZZ_SEED = 2024
+
+
+def load_snippets():
+    snippets = []
+    with open(os.path.join(TESTS_DIR, "corpora", "scanner.txt")) as f:
+        for line in f:
+            if line.strip() and not line.startswith(";"):
+                snippets.append(json.loads(line))
+    return snippets
+
+
+def scan_with_warnings(scan, code):
+    """Return the tokens that scan gives for code, and its warnings."""
+    warnings = io.StringIO()
+    with contextlib.redirect_stderr(warnings):
+        tokens = list(scan(code))
+    return tokens, warnings.getvalue()
+
+
+class ScannerTest(unittest.TestCase):
+
+    def check_same(self, code):
+        expected = scan_with_warnings(reference_scanner.scan, code)
+        actual = scan_with_warnings(parsing.scan, code)
+        self.assertEqual(actual, expected, "scanning %r" % (code,))
+        for token in expected[0]:
+            if token.startswith(cfg.STRING_DELIMITER):
+                self.assertEqual(parsing.parse_name_or_literal(token),
+                                 ("q", (reference_scanner.decode_string(
+                                     token), ())),
+                                 "decoding %r" % (token,))
+
+    def test_snippets(self):
+        for code in load_snippets():
+            self.check_same(code)
+
+    def test_library_modules(self):
+        for path in sorted(glob.glob(os.path.join(LIB_DIR, "*.asl"))):
+            with open(path) as f:
+                self.check_same(f.read())
+
+    def test_random_snippets(self):
+        rng = random.Random(FUZZ_SEED)
+        for i in range(FUZZ_COUNT):
+            length = rng.randint(1, 30)
+            self.check_same("".join(rng.choice(FUZZ_CHARS)
+                                    for j in range(length)))
+
+
+if __name__ == "__main__":
+    unittest.main()
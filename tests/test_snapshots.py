@@ -0,0 +1,104 @@
+"""Check that environment snapshots are restored only while they're valid.
+
+A snapshot has to be rejected if it was written in another format, by
+an interpreter with different builtins, or before any module it holds
+was changed.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import snapshots
+from execution import Program
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.directory, "test.snapshot")
+        self.module = os.path.join(self.directory, "module.asl")
+        with open(self.module, "w") as f:
+            f.write("(def module-value (list 1 2 3))\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save_with_module(self, **options):
+        program = Program(**options)
+        program.asl_load(self.module)
+        snapshots.save(program, self.snapshot)
+        return program
+
+    def test_restore(self):
+        self.save_with_module()
+        program = Program()
+        self.assertTrue(snapshots.restore(program, self.snapshot))
+        self.assertIn(self.module, program.modules)
+        self.assertEqual(program.asl_repr(program.execute(
+            "(length module-value)")), "3")
+
+    def test_changed_module_is_rejected(self):
+        self.save_with_module()
+        with open(self.module, "a") as f:
+            f.write("(def another-value 4)\n")
+        self.assertFalse(snapshots.restore(Program(), self.snapshot))
+
+    def test_touched_module_is_rejected(self):
+        self.save_with_module()
+        stat = os.stat(self.module)
+        os.utime(self.module, ns=(stat.st_atime_ns,
+                                  stat.st_mtime_ns + 10**9))
+        self.assertFalse(snapshots.restore(Program(), self.snapshot))
+
+    def test_different_builtins_are_rejected(self):
+        # Without the native library, the builtins are different
+        self.save_with_module()
+        program = Program(native_lib=False)
+        self.assertFalse(snapshots.restore(program, self.snapshot))
+        self.assertNotIn(self.module, program.modules)
+
+    def test_other_format_is_rejected(self):
+        self.assertIn("-%d" % snapshots.SNAPSHOT_FORMAT, snapshots.MAGIC)
+        with mock.patch.object(snapshots, "MAGIC",
+                               snapshots.MAGIC + "-old"):
+            self.save_with_module()
+        self.assertFalse(snapshots.restore(Program(), self.snapshot))
+
+    def test_corrupt_snapshot_is_rejected(self):
+        with open(self.snapshot, "wb") as f:
+            f.write(b"not a snapshot")
+        self.assertFalse(snapshots.restore(Program(), self.snapshot))
+
+    def test_program_writes_and_uses_snapshot(self):
+        Program(snapshot=self.snapshot)
+        self.assertTrue(os.path.exists(self.snapshot))
+        # With a usable snapshot, the library isn't loaded again
+        results = []
+        restore = snapshots.restore
+
+        def record_restore(environment, path):
+            results.append(restore(environment, path))
+            return results[-1]
+        with mock.patch.object(snapshots, "restore", record_restore), \
+                mock.patch.object(snapshots, "save") as save:
+            program = Program(snapshot=self.snapshot)
+        self.assertEqual(results, [True])
+        save.assert_not_called()
+        self.assertEqual(program.asl_repr(program.execute(
+            "(length (list 1 2))")), "2")
+
+    def test_program_rebuilds_rejected_snapshot(self):
+        with open(self.snapshot, "wb") as f:
+            f.write(b"not a snapshot")
+        program = Program(snapshot=self.snapshot)
+        self.assertEqual(program.asl_repr(program.execute(
+            "(length (list 1 2))")), "2")
+        self.assertTrue(snapshots.restore(Program(), self.snapshot))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Check that code is executed as it is read, one form at a time."""
+
+import contextlib
+import io
+import unittest
+
+from execution import Program
+from parsing import parse_lines
+
+
+class StreamingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.program = Program(repl=False)
+        # How many lines had been read when each form was executed
+        self.lines_read = 0
+        self.executed_at = []
+        execute_expression = self.program.execute_expression
+
+        def record_execution(expr):
+            self.executed_at.append(self.lines_read)
+            return execute_expression(expr)
+        self.program.execute_expression = record_execution
+
+    def feed(self, lines):
+        for line in lines:
+            self.lines_read += 1
+            yield line
+
+    def test_each_form_runs_before_next_line_is_read(self):
+        lines = ["(def a 1)\n", "(def b (add a 1))\n", "(def c (list\n",
+                 "  a b))\n", "(def d (length c))\n"]
+        self.program.execute_stream(self.feed(lines))
+        self.assertEqual(self.executed_at, [1, 2, 4, 5])
+        self.assertEqual(self.program.asl_repr(self.program.execute(
+            "(list a b c d)")), "(1 2 (1 2) 2)")
+
+    def test_single_line_form_runs_at_end_of_input(self):
+        # Until the input ends, these could still be multiline form
+        lines = ["(def a (list 1 2\n", "(def b (length a\n"]
+        self.program.execute_stream(self.feed(lines))
+        self.assertEqual(self.executed_at, [2, 2])
+        self.assertEqual(self.program.asl_repr(self.program.execute(
+            "(list a b)")), "((1 2) 2)")
+
+    def test_unclosed_paren_stops_being_held_back(self):
+        lines = ["(def a (list 1 2\n", "(def b 3)\n", "(def c 4)\n",
+                 "(def d (add b c\n"]
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            exprs = parse_lines(self.feed(lines), max_pending=24)
+            for expr in exprs:
+                self.program.execute_expression(expr)
+        self.assertIn("s-expression still open", errors.getvalue())
+        # The first three lines are held back until there are more than
+        # 24 bytes of them; after that, each line is parsed as it comes
+        self.assertEqual(self.executed_at, [2, 2, 3, 4])
+        self.assertEqual(self.program.asl_repr(self.program.execute(
+            "(list a b c d)")), "((1 2) 3 4 7)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,18 @@
 
 from cfg import nil, identical
+from arraylist import ArrayList
 
 
 class Thunk:
-    """For delayed evaluation of function calls."""
+    """For delayed evaluation of function calls.
+
+Once a thunk has been resolved, it only keeps its result; the
+environment, parameter names, body, and arguments of the call are
+dropped, so that they can be garbage collected.
+"""
+    __slots__ = ("environment", "param_names", "body", "arglist",
+                 "resolved")
+
     def __init__(self, environment, param_names, body, arglist):
         self.environment = environment
         self.param_names = param_names
@@ -12,84 +21,148 @@ class Thunk:
         self.resolved = None
 
     def __eq__(self, value):
-        return (isinstance(value, Thunk)
-                and identical(self.environment, value.environment)
+        if not isinstance(value, Thunk):
+            return False
+        elif self.environment is None or value.environment is None:
+            # At least one of them has been resolved and no longer
+            # knows what call it was; if both have been, compare their
+            # results instead (without resolving anything)
+            return (self.environment is None and value.environment is None
+                    and identical(self.resolved, value.resolved))
+        return (identical(self.environment, value.environment)
                 and self.param_names == value.param_names
                 and identical(self.body, value.body)
                 and identical(self.arglist, value.arglist))
 
     def __str__(self):
+        if self.environment is None:
+            return "Thunk(resolved to %s)" % (self.resolved,)
         return "Thunk(%s, %s, %s)" % (self.body, self.param_names,
                                       self.arglist)
 
     def __repr__(self):
         return str(self)
-    
+
+    def set_result(self, value):
+        """Record the result of the call, and drop the call's data."""
+        self.resolved = value
+        self.environment = None
+        self.param_names = None
+        self.body = None
+        self.arglist = None
+
     def resolve(self):
-        """Perform a tail-recursive function call.
+        """Perform the call, unless that has already been done.
 
-Tail-recursion can include if, eval, macros, and cons. If the result
-after eliminating if, eval, and macros is another thunk, the caller
-is expected to resolve it (so that resolution uses a loop, not
-recursion). If there are non-tail-recursive nested calls, they are
-fully resolved.
+If the call turns out to be a tail call to another function, the result
+is another thunk, which the caller is expected to resolve (so that
+resolution uses a loop, not recursion).
 """
         if self.resolved is not None:
             return self.resolved
-        body = self.body
-        with self.environment.new_scope() as local_names:
-            # Bind arg values to param names in the new local scope
-            try:
-                self.environment.bind_params(self.param_names,
-                                             self.arglist,
-                                             local_names)
-            except TypeError:
-                # There was a problem with binding the parameters
-                # (bind_params already gave the error message)
-                return nil
-            # Eliminate any macros, ifs, and evals
-            head = None
-            tail = None
-            if body and isinstance(body, tuple):
-                head = self.environment.asl_eval(body[0])
-                tail = body[1]
-                try:
-                    head, tail = self.environment.resolve_macros(head, tail)
-                except TypeError:
-                    # resolve_macros encountered an error condition
-                    # (it already gave the error message)
-                    return nil
-                if head is None:
-                    # After resolving macros, the result was a
-                    # simple value, not an s-expression
-                    body = tail
-            # Are we left with a tail call to a user-defined
-            # function (either the same one or a different one)?
-            if head and isinstance(head, tuple):
-                # If so, calculate updated param names, function body,
-                # and arglist, and return a new Thunk (to be resolved
-                # in the calling context)
-                function = head
-                raw_args = tail
+        return_val = self.run(self.environment, self.param_names,
+                              self.body, self.arglist)
+        if return_val is None:
+            # There was an error (which has already been reported)
+            return nil
+        self.set_result(return_val)
+        return return_val
+
+    @staticmethod
+    def run(environment, param_names, body, arglist):
+        """Perform a tail-recursive function call.
+
+Tail-recursion can include if, eval, macros, and cons. If the result
+after eliminating if, eval, and macros is a call to a different
+user-defined function, it isn't made here; a new thunk for it is
+returned instead. A tail call to the same function is made by looping,
+with the parameters bound again in the same scope. If there are
+non-tail-recursive nested calls, they are fully resolved.
+
+Returns None if there was an error. This is also used by
+Program.run_call, to make calls whose value is needed right away
+without creating a thunk for them.
+"""
+        # A library function with a native version evaluates a call of
+        # that in place of its body (see natives.py)
+        code = environment.native_bodies.get((id(param_names), id(body)),
+                                             body)
+        with environment.new_scope() as local_names:
+            while True:
+                # Bind arg values to param names in the local scope
                 try:
-                    call_data = self.environment.call_data(function, raw_args)
+                    environment.bind_params(param_names, body, arglist,
+                                            local_names)
                 except TypeError:
-                    # There was a problem with the structure of the
-                    # supposed function (call_data already gave the
-                    # error message)
-                    return nil
+                    # There was a problem with binding the parameters
+                    # (bind_params already gave the error message)
+                    return None
+                # Eliminate any macros, ifs, and evals
+                head = None
+                tail = None
+                expression = code
+                if code and isinstance(code, tuple):
+                    head = environment.strict_eval(code[0])
+                    tail = code[1]
+                    try:
+                        head, tail = environment.resolve_macros(head, tail)
+                    except TypeError:
+                        # resolve_macros encountered an error condition
+                        # (it already gave the error message)
+                        return None
+                    if head is None:
+                        # After resolving macros, the result was a
+                        # simple value, not an s-expression
+                        expression = tail
+                # Are we left with a tail call to a user-defined
+                # function (either the same one or a different one)?
+                if head and isinstance(head, tuple):
+                    # If so, calculate updated param names, function
+                    # body, and arglist
+                    function = head
+                    raw_args = tail
+                    try:
+                        call_data = environment.call_data(function,
+                                                          raw_args)
+                    except TypeError:
+                        # There was a problem with the structure of the
+                        # supposed function (call_data already gave the
+                        # error message)
+                        return None
+                    if call_data[0] is param_names and call_data[1] is body:
+                        # The same function again: go around the loop
+                        # with the new arguments, in place of the old
+                        arglist = call_data[2]
+                        local_names.clear()
+                        continue
+                    # Return a new Thunk (to be resolved in the calling
+                    # context)
+                    return Thunk(environment, *call_data)
+                elif head is not None:
+                    # Otherwise, finish the call that is left (without
+                    # evaluating the original body again, which would
+                    # redo the work of resolving its macros and ifs)
+                    return environment.apply(head, tail)
                 else:
-                    return_val = Thunk(self.environment, *call_data)
-            else:
-                # Otherwise, just eval the final expression
-                return_val = self.environment.asl_eval(body)
-        self.resolved = return_val
-        return return_val
+                    # Or eval the simple value that was left
+                    return environment.asl_eval(expression)
 
 
 def resolve_thunks(value):
-    while isinstance(value, Thunk):
+    if isinstance(value, Thunk):
+        first_thunk = value
         value = value.resolve()
+        if isinstance(value, Thunk):
+            # A chain of thunks (tail calls); resolve it to the end, and
+            # then point every thunk in it straight at the final value,
+            # so that the chain doesn't have to be walked again
+            chain = [first_thunk]
+            while isinstance(value, Thunk):
+                chain.append(value)
+                value = value.resolve()
+            for thunk in chain:
+                if thunk.resolved is not None:
+                    thunk.resolved = value
     return value
 
 
@@ -97,6 +170,10 @@ def cons_iter(nested_tuple):
     """Iterate over a cons chain of nested tuples."""
     nested_tuple = resolve_thunks(nested_tuple)
     while nested_tuple:
+        if isinstance(nested_tuple, ArrayList):
+            # The rest of the list is all there, with no thunks
+            yield from nested_tuple.values()
+            return
         yield nested_tuple[0]
         nested_tuple = resolve_thunks(nested_tuple[1])
 
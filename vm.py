@@ -0,0 +1,568 @@
+
+from itertools import islice
+
+from cfg import nil
+import cfg
+import execution
+from objects import Object
+from hashed import HashedCollection
+from thunk import Thunk, resolve_thunks, cons_iter
+from compiler import local_name_set, proper_list, arg_count_ok
+
+
+# How many compiled function bodies to keep before the oldest ones are
+# thrown away
+MAX_CODE_OBJECTS = 4096
+
+# Opcodes. Every instruction is two entries in a code object's
+# instruction array: the opcode and its argument. Most arguments are
+# indices into the code object's constant pool; jump arguments are
+# offsets in the instruction array.
+LOAD_LOCAL = 0          # Push the value of a parameter
+LOAD_CONST = 1          # Push a constant
+LOAD_GLOBAL = 2         # Push the value of a global name (which
+                        # wasn't defined when the code was compiled)
+CALL_BUILTIN = 3        # Call a builtin with args from the stack
+JUMP_IF_FALSE = 4       # Pop a value; jump if it is falsey
+JUMP = 5                # Jump unconditionally
+RETURN = 6              # Pop a value and return it
+CALL_FUNCTION = 7       # Make a thunk for a call to a known function
+TAIL_CALL = 8           # Call a known function, reusing the frame
+CHECK_CALL = 9          # Pop a head; if it takes evaluated args, push
+                        # it back, otherwise push the result of the
+                        # whole call and jump past it
+CALL = 10               # Call the function checked by CHECK_CALL
+TAIL_CALL_DYNAMIC = 11  # Same as CALL, but reusing the frame
+CALL_BUILTIN_MACRO = 12 # Call a builtin macro with constant args
+EXPAND_MACRO = 13       # Run a user macro call (expanding it first)
+EVAL = 14               # Pop a value and push the result of eval'ing it
+EVAL_CONST = 15         # Push the result of eval'ing a constant
+CALL_FUNCTION_NOW = 16  # Call a known function whose value is needed
+                        # right away, without making a thunk
+CALL_NOW = 17           # Same as CALL, but without making a thunk
+
+OPNAMES = ["LOAD_LOCAL", "LOAD_CONST", "LOAD_GLOBAL", "CALL_BUILTIN",
+           "JUMP_IF_FALSE", "JUMP", "RETURN", "CALL_FUNCTION", "TAIL_CALL",
+           "CHECK_CALL", "CALL", "TAIL_CALL_DYNAMIC", "CALL_BUILTIN_MACRO",
+           "EXPAND_MACRO", "EVAL", "EVAL_CONST", "CALL_FUNCTION_NOW",
+           "CALL_NOW"]
+
+
+class CodeObject:
+    """Bytecode for a function body (or a macro expansion).
+
+Code is the instruction array and consts is the constant pool. Source
+is the expression the code was compiled from.
+"""
+    def __init__(self, source):
+        self.source = source
+        self.code = []
+        self.consts = []
+        self.const_indices = {}
+
+    def emit(self, opcode, arg=0):
+        self.code.extend((opcode, arg))
+        return len(self.code) - 1
+
+    def add_const(self, value):
+        """Add a value to the constant pool and return its index."""
+        if isinstance(value, str) or type(value) is int:
+            # Names and numbers are shared; other constants are stored
+            # once for each place they are used
+            key = (type(value), value)
+            if key not in self.const_indices:
+                self.const_indices[key] = len(self.consts)
+                self.consts.append(value)
+            return self.const_indices[key]
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+
+class MacroSite:
+    """A user macro call, which is expanded the first time it runs."""
+    def __init__(self, macro_params, macro_body, expr, local_names, tail,
+                 strict):
+        self.macro_params = macro_params
+        self.macro_body = macro_body
+        self.expr = expr
+        self.local_names = local_names
+        self.tail = tail
+        self.strict = strict
+        # The compiled expansion, or None if it hasn't been expanded
+        self.code_object = None
+        # True if the call can't be expanded once and for all
+        self.fallback = False
+
+
+class VMThunk(Thunk):
+    """A delayed function call that runs on the bytecode VM."""
+    __slots__ = ()
+
+    @staticmethod
+    def run(environment, param_names, body, arglist):
+        vm = environment.vm
+        code_object = vm.compile_function(param_names, body)
+        # Set up the frame for the call; tail calls made from it reuse
+        # it rather than returning a thunk
+        local_names = {}
+        environment.depth += 1
+        environment.names.append(local_names)
+        environment.local_names = local_names
+        try:
+            try:
+                environment.bind_params(param_names, body, arglist,
+                                        local_names)
+            except TypeError:
+                # There was a problem with binding the parameters
+                # (bind_params already gave the error message)
+                return None
+            return vm.execute(code_object, local_names)
+        finally:
+            environment.names.pop()
+            environment.depth -= 1
+            environment.local_names = environment.names[environment.depth]
+
+
+class VM:
+    """Compiles function bodies to bytecode and runs it.
+
+Each call runs in a frame: a scope holding the function's parameters,
+and a value stack. A call in tail position doesn't return a thunk to be
+resolved by the caller; the frame is reused for the called function,
+and execution continues from the start of its code. Nor does a call
+whose value is needed right away (see Program.strict_eval), which is
+made in a new frame. Calls anywhere else still return thunks, since the
+language needs them to be lazy (lists built with cons can be infinite,
+for example).
+
+The compiler decides what it can in advance, in the same way as the
+closure compiler (see compiler.Compiler), and leaves anything unusual
+to asl_eval, so error messages are the same as usual.
+"""
+    def __init__(self, environment):
+        self.environment = environment
+        self.code_objects = {}
+
+    def compile_function(self, param_names, body):
+        """Return the code object for a function's body."""
+        key = (id(param_names), id(body))
+        entry = self.code_objects.get(key)
+        if entry is not None:
+            return entry[2]
+        code_object = CodeObject(body)
+        # A library function with a native version runs a call of that
+        # in place of its body (see natives.py)
+        code = self.environment.native_bodies.get(key, body)
+        self.compile(code, local_name_set(param_names), True, code_object)
+        code_object.emit(RETURN)
+        if len(self.code_objects) >= MAX_CODE_OBJECTS:
+            # Throw away the oldest code object
+            del self.code_objects[next(iter(self.code_objects))]
+        # Keep references to the parameter list and body, so their ids
+        # aren't reused while the entry exists
+        self.code_objects[key] = (param_names, body, code_object)
+        return code_object
+
+    def compile(self, expr, local_names, tail, code_object, strict=False):
+        """Emit the instructions to push the value of an expression.
+
+If tail is true, the expression is in tail position, and calls can
+reuse the current frame. If strict is true, the expression's value is
+needed right away, and calls are made without making thunks.
+"""
+        environment = self.environment
+        if isinstance(expr, tuple):
+            if expr:
+                self.compile_call(expr, local_names, tail, code_object,
+                                  strict)
+            else:
+                code_object.emit(LOAD_CONST, code_object.add_const(nil))
+        elif isinstance(expr, str):
+            if expr in local_names:
+                code_object.emit(LOAD_LOCAL, code_object.add_const(expr))
+            elif (cfg.BIND_GLOBAL_NAMES and expr != "_"
+                  and expr in environment.global_names):
+                # A global name can't be redefined, so its value can be
+                # used directly
+                code_object.emit(LOAD_CONST,
+                                 code_object.add_const(
+                                     environment.global_names[expr]))
+            else:
+                code_object.emit(LOAD_GLOBAL, code_object.add_const(expr))
+        elif (isinstance(expr, int) or isinstance(expr, Object)
+              or isinstance(expr, HashedCollection)
+              or expr in environment.builtins):
+            code_object.emit(LOAD_CONST, code_object.add_const(expr))
+        else:
+            # Thunks, and anything else unexpected
+            code_object.emit(EVAL_CONST, code_object.add_const(expr))
+
+    def compile_call(self, expr, local_names, tail, code_object, strict):
+        environment = self.environment
+        head_code, raw_args = expr
+        args = proper_list(raw_args)
+        if args is None:
+            # Argument list with thunks in it, or improper list
+            code_object.emit(EVAL_CONST, code_object.add_const(expr))
+        elif (isinstance(head_code, str) and head_code not in local_names
+                and head_code != "_"
+                and head_code in environment.global_names
+                and not isinstance(environment.global_names[head_code],
+                                   Thunk)):
+            head = environment.global_names[head_code]
+            self.compile_static_call(head, expr, args, local_names, tail,
+                                     code_object, strict)
+        elif head_code in environment.builtins:
+            # A builtin in the code itself, as in the library functions
+            # that call native versions
+            self.compile_static_call(head_code, expr, args, local_names,
+                                     tail, code_object, strict)
+        elif isinstance(head_code, str) or isinstance(head_code, tuple):
+            # The head has to be evaluated each time, and the args
+            # are only evaluated if it turns out to be a function
+            self.compile(head_code, local_names, False, code_object, True)
+            call_info = [raw_args, None, strict]
+            code_object.emit(CHECK_CALL, code_object.add_const(call_info))
+            for arg in args:
+                self.compile(arg, local_names, False, code_object)
+            if tail:
+                code_object.emit(TAIL_CALL_DYNAMIC, len(args))
+            else:
+                code_object.emit(CALL_NOW if strict else CALL, len(args))
+            # Where to go if the call was done by CHECK_CALL
+            call_info[1] = len(code_object.code)
+        else:
+            # The head is something that can't be called; let asl_eval
+            # give the error
+            code_object.emit(EVAL_CONST, code_object.add_const(expr))
+
+    def compile_static_call(self, head, expr, args, local_names, tail,
+                            code_object, strict):
+        """Compile a call whose head is known at compile time."""
+        environment = self.environment
+        if head == environment.asl_if and len(args) == 3:
+            condition, true_branch, false_branch = args
+            self.compile(condition, local_names, False, code_object, True)
+            jump_to_false = code_object.emit(JUMP_IF_FALSE)
+            self.compile(true_branch, local_names, tail, code_object, strict)
+            jump_to_end = code_object.emit(JUMP)
+            code_object.code[jump_to_false] = len(code_object.code)
+            self.compile(false_branch, local_names, tail, code_object,
+                         strict)
+            code_object.code[jump_to_end] = len(code_object.code)
+        elif head == environment.asl_eval and len(args) == 1:
+            self.compile(args[0], local_names, False, code_object, True)
+            code_object.emit(EVAL)
+        elif environment.is_macro(head):
+            flag, macro_params, macro_body = cons_iter(head)
+            site = MacroSite(resolve_thunks(macro_params), macro_body, expr,
+                             local_names, tail, strict)
+            if isinstance(site.macro_params, tuple) and any(
+                    isinstance(resolve_thunks(param), tuple)
+                    for param in cons_iter(site.macro_params)):
+                # Default values for macro parameters are evaluated
+                # when the macro is expanded, so the expansion can't be
+                # kept
+                site.fallback = True
+            code_object.emit(EXPAND_MACRO, code_object.add_const(site))
+        elif head and isinstance(head, tuple):
+            function_parts = list(islice(cons_iter(head), 3))
+            if len(function_parts) != 2:
+                code_object.emit(EVAL_CONST, code_object.add_const(expr))
+                return
+            for arg in args:
+                self.compile(arg, local_names, False, code_object)
+            call_info = code_object.add_const((*function_parts, len(args)))
+            if tail:
+                code_object.emit(TAIL_CALL, call_info)
+            elif strict:
+                code_object.emit(CALL_FUNCTION_NOW, call_info)
+            else:
+                code_object.emit(CALL_FUNCTION, call_info)
+        elif (head in environment.builtins
+                and head.name not in execution.top_level_macros
+                and head.name not in execution.repl_macros
+                and arg_count_ok(head, len(args))
+                and head != environment.asl_if
+                and head != environment.asl_eval):
+            if head == environment.asl_quote:
+                code_object.emit(LOAD_CONST, code_object.add_const(args[0]))
+            elif head.is_macro:
+                call_info = code_object.add_const((head, args))
+                code_object.emit(CALL_BUILTIN_MACRO, call_info)
+            else:
+                for arg in args:
+                    self.compile(arg, local_names, False, code_object,
+                                 head.strict_args)
+                call_info = code_object.add_const((head, len(args)))
+                code_object.emit(CALL_BUILTIN, call_info)
+        else:
+            # Let asl_eval give the error
+            code_object.emit(EVAL_CONST, code_object.add_const(expr))
+
+    def expand(self, site):
+        """Expand a macro call site and compile the expansion."""
+        environment = self.environment
+        warning_count = cfg.warning_count
+        macro_names = {}
+        try:
+            environment.bind_params(site.macro_params, site.macro_body,
+                                    site.expr[1], macro_names)
+        except TypeError:
+            # There was a problem with the arguments (and bind_params
+            # gave the error message); from now on, let asl_eval give
+            # the error each time
+            site.fallback = True
+            return None
+        expression = environment.replace(macro_names,
+                                         resolve_thunks(site.macro_body))
+        code_object = CodeObject(site.expr)
+        self.compile(resolve_thunks(expression), site.local_names, site.tail,
+                     code_object, site.strict)
+        code_object.emit(RETURN)
+        if cfg.warning_count == warning_count:
+            site.code_object = code_object
+        else:
+            # Expanding the macro gave warnings, which asl_eval would
+            # give every time
+            site.fallback = True
+        return code_object
+
+    def execute(self, code_object, scope):
+        """Run a code object in the current frame and return the result.
+
+The caller has already entered the scope; tail calls replace it with
+the called function's scope.
+"""
+        environment = self.environment
+        global_names = environment.global_names
+        asl_bool = environment.asl_bool
+        run_call = environment.run_call
+        code = code_object.code
+        consts = code_object.consts
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            opcode = code[pc]
+            arg = code[pc + 1]
+            pc += 2
+            if opcode == LOAD_LOCAL:
+                push(scope[consts[arg]])
+            elif opcode == LOAD_CONST:
+                push(consts[arg])
+            elif opcode == CALL_BUILTIN:
+                builtin, arg_count = consts[arg]
+                if arg_count:
+                    args = stack[-arg_count:]
+                    del stack[-arg_count:]
+                    push(builtin(*args))
+                else:
+                    push(builtin())
+            elif opcode == JUMP_IF_FALSE:
+                if not asl_bool(pop()):
+                    pc = arg
+            elif opcode == LOAD_GLOBAL:
+                name = consts[arg]
+                try:
+                    value = global_names[name]
+                except KeyError:
+                    # Undefined name (or one that needs to be autoloaded)
+                    push(environment.asl_eval(name))
+                    continue
+                push(value)
+                if name != "_" and cfg.BIND_GLOBAL_NAMES:
+                    # The name is defined now, and can't be redefined;
+                    # turn the instruction into a LOAD_CONST of its value
+                    consts.append(value)
+                    code[pc - 2] = LOAD_CONST
+                    code[pc - 1] = len(consts) - 1
+            elif opcode == JUMP:
+                pc = arg
+            elif opcode == RETURN:
+                return pop()
+            elif opcode == CALL_FUNCTION:
+                param_names, body, arg_count = consts[arg]
+                args = pop_args(stack, arg_count)
+                push(VMThunk(environment, param_names, body, args))
+            elif opcode == TAIL_CALL:
+                param_names, body, arg_count = consts[arg]
+                args = pop_args(stack, arg_count)
+                code_object = self.compile_function(param_names, body)
+                scope = self.enter_tail_call(param_names, body, args)
+                if scope is None:
+                    return nil
+                code = code_object.code
+                consts = code_object.consts
+                pc = 0
+            elif opcode == CHECK_CALL:
+                function = resolve_thunks(pop())
+                if (function and isinstance(function, tuple)
+                        and not environment.is_macro(function)):
+                    function_parts = list(islice(cons_iter(function), 3))
+                    if len(function_parts) == 2:
+                        # Push the parameter names and body (as a
+                        # Python list, which no Appleseed value is)
+                        push(function_parts)
+                        continue
+                elif (function in environment.builtins
+                        and not function.is_macro
+                        and function != environment.asl_eval):
+                    push(function)
+                    continue
+                # Macros, if, eval, and errors
+                raw_args, pc, strict = consts[arg]
+                push(environment.apply(function, raw_args, strict=strict))
+            elif opcode == CALL:
+                args = pop_args(stack, arg)
+                function = pop()
+                if isinstance(function, list):
+                    push(VMThunk(environment, *function, args))
+                else:
+                    push(environment.call_builtin(function, args))
+            elif opcode == TAIL_CALL_DYNAMIC:
+                args = pop_args(stack, arg)
+                function = pop()
+                if isinstance(function, list):
+                    param_names, body = function
+                    code_object = self.compile_function(param_names, body)
+                    scope = self.enter_tail_call(param_names, body, args)
+                    if scope is None:
+                        return nil
+                    code = code_object.code
+                    consts = code_object.consts
+                    pc = 0
+                else:
+                    push(environment.call_builtin(function, args))
+            elif opcode == CALL_FUNCTION_NOW:
+                param_names, body, arg_count = consts[arg]
+                args = pop_args(stack, arg_count)
+                push(run_call(param_names, body, args))
+            elif opcode == CALL_NOW:
+                args = pop_args(stack, arg)
+                function = pop()
+                if isinstance(function, list):
+                    push(run_call(*function, args))
+                else:
+                    push(environment.call_builtin(function, args))
+            elif opcode == CALL_BUILTIN_MACRO:
+                builtin, args = consts[arg]
+                push(builtin(*args))
+            elif opcode == EXPAND_MACRO:
+                site = consts[arg]
+                expansion = site.code_object
+                if expansion is None and not site.fallback:
+                    expansion = self.expand(site)
+                    if expansion is None:
+                        push(nil)
+                        continue
+                if site.fallback and expansion is None:
+                    push(environment.asl_eval(site.expr))
+                elif site.tail:
+                    # Nothing is left to do in this code after the
+                    # expansion, so carry on in the expansion's code
+                    code = expansion.code
+                    consts = expansion.consts
+                    pc = 0
+                else:
+                    push(self.execute(expansion, scope))
+            elif opcode == EVAL:
+                push(environment.asl_eval(pop()))
+            elif opcode == EVAL_CONST:
+                push(environment.asl_eval(consts[arg]))
+            else:
+                raise NotImplementedError("unknown opcode %d" % opcode)
+
+    def enter_tail_call(self, param_names, body, args):
+        """Replace the current frame's scope for a tail call.
+
+Return the new scope, or None if the parameters couldn't be bound.
+"""
+        environment = self.environment
+        local_names = {}
+        environment.names[environment.depth] = local_names
+        environment.local_names = local_names
+        try:
+            environment.bind_params(param_names, body, args, local_names)
+        except TypeError:
+            # There was a problem with binding the parameters
+            # (bind_params already gave the error message)
+            return None
+        return local_names
+
+    def disassemble(self, function):
+        """Return a listing of the bytecode for a user-defined function."""
+        function_parts = list(islice(cons_iter(function), 3))
+        if len(function_parts) != 2:
+            raise ValueError("not a function: %s"
+                             % self.environment.asl_repr(function))
+        return self.disassemble_code(self.compile_function(*function_parts))
+
+    def disassemble_code(self, code_object, indent=""):
+        """Return a listing of a code object's instructions.
+
+Macro calls that have been expanded are followed by the listing of the
+expansion, indented.
+"""
+        asl_repr = self.environment.asl_repr
+        lines = [indent + "code for " + asl_repr(code_object.source)]
+        code = code_object.code
+        consts = code_object.consts
+        for offset in range(0, len(code), 2):
+            opcode, arg = code[offset], code[offset + 1]
+            line = "%s%4d %-18s" % (indent, offset, OPNAMES[opcode])
+            if opcode == RETURN or opcode == EVAL:
+                lines.append(line.rstrip())
+                continue
+            elif opcode in (JUMP, JUMP_IF_FALSE, CALL, TAIL_CALL_DYNAMIC,
+                            CALL_NOW):
+                # The argument is a jump target or an arg count
+                lines.append("%s %3d" % (line, arg))
+                continue
+            elif opcode == CALL_BUILTIN:
+                builtin, arg_count = consts[arg]
+                description = "%s, %d args" % (builtin_name(builtin),
+                                               arg_count)
+            elif opcode == CALL_BUILTIN_MACRO:
+                builtin, args = consts[arg]
+                description = "%s, %d args" % (builtin_name(builtin),
+                                               len(args))
+            elif opcode in (CALL_FUNCTION, TAIL_CALL, CALL_FUNCTION_NOW):
+                param_names, body, arg_count = consts[arg]
+                description = "%s, %d args" % (asl_repr(param_names),
+                                               arg_count)
+            elif opcode == CHECK_CALL:
+                raw_args, target, strict = consts[arg]
+                description = "else to %d" % target
+            elif opcode == EXPAND_MACRO:
+                site = consts[arg]
+                if site.code_object is not None:
+                    description = "expanded"
+                elif site.fallback:
+                    description = "not expandable"
+                else:
+                    description = "not yet expanded"
+            elif consts[arg] in self.environment.builtins:
+                description = builtin_name(consts[arg])
+            else:
+                description = asl_repr(consts[arg])
+            lines.append("%s %3d (%s)" % (line, arg, description))
+            if opcode == EXPAND_MACRO and site.code_object is not None:
+                lines.append(self.disassemble_code(site.code_object,
+                                                   indent + "    "))
+        return "\n".join(lines)
+
+
+def builtin_name(builtin):
+    return execution.builtins[builtin.name]
+
+
+def pop_args(stack, arg_count):
+    """Pop arg_count values off the stack, returning them as a list."""
+    if arg_count:
+        args = stack[-arg_count:]
+        del stack[-arg_count:]
+        return args
+    else:
+        return []